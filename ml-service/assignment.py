@@ -0,0 +1,87 @@
+import numpy as np
+
+from distance_engine import SpatialIndex
+from route_state import FleetRouteState
+from time_windows import EPSILON
+
+# Nearest unassigned pickups each vehicle is priced against per round
+DEFAULT_CANDIDATES = 16
+# Cost of the pairs a vehicle cannot take; never accepted from the matching
+_INFEASIBLE = 1e12
+
+
+def assign_in_rounds(
+    state: FleetRouteState,
+    weights: np.ndarray,
+    pickup_indices: np.ndarray,
+    delivery_indices: np.ndarray,
+    candidates: int = DEFAULT_CANDIDATES
+) -> np.ndarray:
+    """Assign trips to vehicles by repeated min-cost matching; returns the unassigned mask.
+
+    Each round prices every vehicle that can still take a trip against the
+    nearest unassigned pickups to where its route currently ends, with the
+    fuel the trip would burn there (empty leg plus loaded leg over the
+    vehicle's fuel efficiency), and gives each vehicle at most one trip so
+    that the fleet's total is minimal. Pairs over capacity or past the trip's
+    due time are excluded. A vehicle with no feasible pair among its
+    candidates looks twice as far next round, and drops out once it has
+    seen every remaining trip.
+    """
+    from scipy.optimize import linear_sum_assignment
+
+    distance_matrix = state.distance_matrix
+    coordinates = distance_matrix.coordinates
+    unassigned = np.ones(len(weights), dtype=bool)
+    trip_legs = distance_matrix.pairs(pickup_indices, delivery_indices)
+    reach = np.full(len(state), max(1, candidates), dtype=np.int64)
+    active = np.ones(len(state), dtype=bool)
+
+    while active.any() and unassigned.any():
+        open_trips = np.flatnonzero(unassigned)
+        # Vehicles that cannot fit even the lightest remaining trip are done
+        active &= state.capacity - state.load + EPSILON >= weights[open_trips].min()
+        vehicles = np.flatnonzero(active)
+        if len(vehicles) == 0:
+            break
+
+        # Candidate pairs: each vehicle's nearest open pickups, grouped by reach
+        index = SpatialIndex(coordinates[pickup_indices[open_trips]])
+        pair_vehicles, pair_trips = [], []
+        for k in np.unique(reach[vehicles]):
+            group = vehicles[reach[vehicles] == k]
+            nearest = index.nearest(coordinates[state.last_location[group]], int(k))
+            pair_vehicles.append(np.repeat(group, nearest.shape[1]))
+            pair_trips.append(open_trips[nearest.ravel()])
+        pair_vehicles = np.concatenate(pair_vehicles)
+        pair_trips = np.concatenate(pair_trips)
+
+        legs = distance_matrix.pairs(state.last_location[pair_vehicles], pickup_indices[pair_trips])
+        feasible = state.feasible_pairs(pair_vehicles, pair_trips, weights[pair_trips], legs, trip_legs[pair_trips])
+
+        # Vehicles with nothing feasible widen their search, or stop when it covers every trip
+        has_pair = np.zeros(len(state), dtype=bool)
+        has_pair[pair_vehicles[feasible]] = True
+        stuck = vehicles[~has_pair[vehicles]]
+        active[stuck[reach[stuck] >= len(open_trips)]] = False
+        reach[stuck] *= 2
+        if not feasible.any():
+            continue
+
+        pair_vehicles = pair_vehicles[feasible]
+        pair_trips = pair_trips[feasible]
+        fuel = (legs[feasible] + trip_legs[pair_trips]) / state.fuel_efficiency[pair_vehicles]
+        rows, row_of = np.unique(pair_vehicles, return_inverse=True)
+        columns, column_of = np.unique(pair_trips, return_inverse=True)
+        cost = np.full((len(rows), len(columns)), _INFEASIBLE)
+        cost[row_of, column_of] = fuel
+        matched_rows, matched_columns = linear_sum_assignment(cost)
+
+        for row, column in zip(matched_rows, matched_columns):
+            if cost[row, column] >= _INFEASIBLE:
+                continue
+            v, k = rows[row], columns[column]
+            state.assign(v, k, weights[k], pickup_indices[k], delivery_indices[k])
+            unassigned[k] = False
+
+    return unassigned
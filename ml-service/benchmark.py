@@ -0,0 +1,286 @@
+"""Scaling benchmark for RouteOptimizer.optimize_routes.
+
+    pip install -r requirements-dev.txt  # adds fakeredis for offline runs
+    python benchmark.py --sizes 10 100 1000 --scenarios clustered uniform
+    python benchmark.py --sizes 1000 10000 --strategies fuel_efficient --repeat 1 --json results.json
+
+Each case solves a seeded synthetic fleet (see generate_fleet) with every
+strategy and reports wall time per pipeline stage (metrics.stage timings), peak traced memory and
+solution quality: total distance, unassigned trips, routes over capacity
+and late deliveries, all checked by replaying the routes independently of
+the strategies. Runs offline against fakeredis unless --redis is a URL.
+The balanced strategy needs a trained model in --model-dir.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+
+from distance_engine import haversine_km, location_key
+from metrics import Trace, tracing
+from route_optimizer import Location, OptimizedRoute, RouteOptimizer, Trip, Vehicle
+
+SCENARIOS = ("clustered", "uniform", "depot_heavy")
+STRATEGIES = ("fuel_efficient", "time_optimal", "balanced")
+
+# Mumbai, spanning roughly 50 km each way
+CENTER = (19.07, 72.88)
+SPAN_DEGREES = 0.45
+# Fixed traffic snapshot, so every run sees the same average speed
+TRAFFIC = {"average_speed": 40.0, "congestion_level": 0.3, "incidents": []}
+
+
+def generate_fleet(
+    scenario: str,
+    trip_count: int,
+    vehicle_count: int = 0,
+    seed: int = 0,
+    departure: datetime = datetime(2024, 1, 1, 8)
+) -> Tuple[List[Vehicle], List[Trip]]:
+    """Seeded vehicles and trips with time windows from departure.
+
+    clustered places pickups, deliveries and vehicles around a few
+    neighbourhoods, uniform spreads them over the city, and depot_heavy sends
+    most pickups from three depots where the vehicles also start. Without
+    vehicle_count there is one vehicle per ten trips.
+    """
+    if scenario not in SCENARIOS:
+        raise ValueError(f"Unknown scenario '{scenario}', expected one of {SCENARIOS}")
+    rng = random.Random(seed)
+    vehicle_count = vehicle_count or max(2, trip_count // 10)
+
+    def uniform() -> Location:
+        return Location(
+            CENTER[0] + rng.uniform(-SPAN_DEGREES, SPAN_DEGREES) / 2,
+            CENTER[1] + rng.uniform(-SPAN_DEGREES, SPAN_DEGREES) / 2
+        )
+
+    def near(point: Location, spread: float = 0.02) -> Location:
+        return Location(point.latitude + rng.gauss(0, spread), point.longitude + rng.gauss(0, spread))
+
+    centers = [uniform() for _ in range(max(3, trip_count // 200))]
+    depots = [uniform() for _ in range(3)]
+    if scenario == "clustered":
+        pickup = lambda: near(rng.choice(centers))
+        delivery = lambda: near(rng.choice(centers))
+        start = lambda: near(rng.choice(centers))
+    elif scenario == "uniform":
+        pickup = delivery = start = uniform
+    else:
+        # Own Location per trip, so routes can be replayed by waypoint identity
+        pickup = lambda: Location(*location_key(rng.choice(depots))) if rng.random() < 0.8 else uniform()
+        delivery = uniform
+        start = lambda: rng.choice(depots)
+
+    vehicles = [
+        Vehicle(
+            id=f"vehicle-{i}",
+            capacity=rng.uniform(10, 30),
+            fuel_efficiency=rng.uniform(3, 8),
+            current_location=start(),
+            max_distance=500,
+            driver_id=f"driver-{i}"
+        )
+        for i in range(vehicle_count)
+    ]
+    trips = []
+    for i in range(trip_count):
+        ready = departure + timedelta(hours=rng.uniform(0, 4))
+        trips.append(Trip(
+            id=f"trip-{i}",
+            pickup=pickup(),
+            delivery=delivery(),
+            weight=rng.uniform(0.5, 5),
+            priority=rng.randint(1, 5),
+            time_window=(ready, ready + timedelta(hours=rng.uniform(2, 8))),
+            estimated_duration=rng.uniform(0.1, 0.3)
+        ))
+    return vehicles, trips
+
+
+def route_quality(
+    routes: List[OptimizedRoute],
+    vehicles: List[Vehicle],
+    trips: List[Trip],
+    departure: datetime,
+    average_speed: float = TRAFFIC["average_speed"]
+) -> Dict:
+    """Replay each route's waypoints: distance, unassigned trips, overloaded routes and late deliveries.
+
+    Pickups wait for the window to open and then take the trip's estimated
+    duration; a delivery is late when reached after the window closes.
+    """
+    vehicles_by_id = {v.id: v for v in vehicles}
+    stops = {}
+    for trip in trips:
+        stops[id(trip.pickup)] = (trip, False)
+        stops[id(trip.delivery)] = (trip, True)
+
+    origin = departure.timestamp()
+    distance = 0.0
+    overloaded = late = assigned = 0
+    for route in routes:
+        vehicle = vehicles_by_id[route.vehicle_id]
+        position, clock, load, peak = vehicle.current_location, 0.0, 0.0, 0.0
+        for waypoint in route.waypoints:
+            leg = float(haversine_km(position.latitude, position.longitude, waypoint.latitude, waypoint.longitude))
+            distance += leg
+            clock += leg / average_speed
+            position = waypoint
+            trip, is_delivery = stops[id(waypoint)]
+            start, end = (w.timestamp() - origin if w is not None else None for w in trip.time_window)
+            if is_delivery:
+                load -= trip.weight
+                late += end is not None and clock > end + 1e-6
+            else:
+                clock = max(clock, start or 0.0) + trip.estimated_duration
+                load += trip.weight
+                peak = max(peak, load)
+        overloaded += peak > vehicle.capacity + 1e-6
+        assigned += len(route.trips)
+
+    return {
+        "distance_km": round(distance, 1),
+        "unassigned": len(trips) - assigned,
+        "overloaded_routes": overloaded,
+        "late_deliveries": late,
+    }
+
+
+async def run_case(
+    optimizer: RouteOptimizer,
+    vehicles: List[Vehicle],
+    trips: List[Trip],
+    strategy: str,
+    departure: datetime,
+    trace_memory: bool
+) -> Dict:
+    """Solve once; returns wall time and per-stage seconds, plus peak MB when traced."""
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        with tracing(Trace()) as trace:
+            routes = await optimizer.optimize_routes(vehicles, trips, strategy, departure_time=departure)
+    finally:
+        wall = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+        tracemalloc.stop()
+
+    timings = {name: entry["seconds"] for name, entry in trace.stages.items()}
+    result = {"wall_s": wall, "stages": {"strategy": timings.pop(strategy, 0.0), **timings}, "routes": routes}
+    if peak is not None:
+        result["peak_mb"] = peak / 2 ** 20
+    return result
+
+
+def _cache_client(redis: str):
+    if redis != "fake":
+        return None
+    try:
+        import fakeredis.aioredis
+    except ImportError:
+        raise SystemExit("The offline benchmark needs fakeredis: pip install -r requirements-dev.txt, or pass --redis URL")
+    return fakeredis.aioredis.FakeRedis()
+
+
+async def benchmark(args) -> List[Dict]:
+    from cache_store import CacheStore
+
+    cache = CacheStore(args.redis if args.redis != "fake" else "redis://localhost:6379",
+                       client=_cache_client(args.redis))
+    optimizer = RouteOptimizer(
+        cache=cache,
+        # Repeated runs must solve, not replay cached results
+        result_cache_ttl=0,
+        # Solve on this thread, so stage timings are not skewed by thread handoffs
+        solver_threads=0,
+        search_time_budget=args.time_budget,
+        fuel_assignment=args.fuel_assignment,
+        model_dir=args.model_dir,
+        train_if_missing=False,
+        model_loading="lazy" if "balanced" not in args.strategies else "eager"
+    )
+    await cache.set("traffic_data", json.dumps(TRAFFIC).encode(), ttl=24 * 3600)
+
+    departure = datetime(2024, 1, 1, 8)
+    results = []
+    for scenario in args.scenarios:
+        for size in args.sizes:
+            vehicles, trips = generate_fleet(scenario, size, seed=args.seed, departure=departure)
+            for strategy in args.strategies:
+                runs = [
+                    await run_case(optimizer, vehicles, trips, strategy, departure, trace_memory=False)
+                    for _ in range(args.repeat)
+                ]
+                median = sorted(runs, key=lambda run: run["wall_s"])[len(runs) // 2]
+                row = {
+                    "scenario": scenario,
+                    "trips": size,
+                    "vehicles": len(vehicles),
+                    "strategy": strategy,
+                    "wall_s": median["wall_s"],
+                    "stages": median["stages"],
+                    **route_quality(median["routes"], vehicles, trips, departure),
+                }
+                if args.memory:
+                    # Separate run: tracing allocations slows the timed ones
+                    traced = await run_case(optimizer, vehicles, trips, strategy, departure, trace_memory=True)
+                    row["peak_mb"] = traced["peak_mb"]
+                results.append(row)
+                _print_row(row)
+    await cache.close()
+    return results
+
+
+def _print_header():
+    print(
+        f"{'scenario':<12}{'trips':>7}{'strategy':>16}{'wall s':>9}"
+        f"{'dist s':>8}{'solve s':>9}{'metric s':>9}{'cache s':>8}{'peak MB':>9}"
+        f"{'km':>10}{'unasg':>7}{'over':>6}{'late':>6}"
+    )
+
+
+def _print_row(row: Dict):
+    stages = row["stages"]
+    peak = f"{row['peak_mb']:>9.1f}" if "peak_mb" in row else f"{'-':>9}"
+    print(
+        f"{row['scenario']:<12}{row['trips']:>7}{row['strategy']:>16}{row['wall_s']:>9.3f}"
+        f"{stages.get('distance_matrix', 0):>8.3f}{stages.get('strategy', 0):>9.3f}"
+        f"{stages.get('route_metrics', 0):>9.3f}{stages.get('cache_results', 0):>8.3f}{peak}"
+        f"{row['distance_km']:>10.1f}{row['unassigned']:>7}{row['overloaded_routes']:>6}"
+        f"{row['late_deliveries']:>6}",
+        flush=True
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark route optimization by stage.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--strategies", nargs="+", choices=STRATEGIES, default=list(STRATEGIES))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per case; the median run is reported")
+    parser.add_argument("--time-budget", type=float, default=2.0,
+                        help="seconds of local search for time_optimal")
+    parser.add_argument("--fuel-assignment", choices=("global", "sequential"), default="global",
+                        help="how fuel_efficient assigns trips to vehicles")
+    parser.add_argument("--no-memory", dest="memory", action="store_false",
+                        help="skip the extra traced run that measures peak memory")
+    parser.add_argument("--model-dir", default=os.getenv("MODEL_DIR", "models"))
+    parser.add_argument("--redis", default="fake", help='"fake" for in-process fakeredis, or a Redis URL')
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    _print_header()
+    results = asyncio.run(benchmark(args))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
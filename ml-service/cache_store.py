@@ -0,0 +1,158 @@
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence
+
+import redis.asyncio as aioredis
+from redis.exceptions import RedisError
+
+from metrics import REDIS_ERRORS, REDIS_SECONDS
+
+
+class LocalCache:
+    """Bounded in-process LRU with per-key expiry."""
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        # key -> (expiry timestamp, value), least recently used first
+        self._entries: OrderedDict = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: bytes, ttl: float):
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def delete(self, key: str):
+        self._entries.pop(key, None)
+
+
+class CacheStore:
+    """Async key-value cache on a pooled Redis client with an in-process fallback.
+
+    Every write also lands in a local LRU. When Redis fails, reads and writes
+    are served locally and Redis is left alone for retry_interval seconds, so
+    an outage costs one failed round trip rather than one per request. Pass
+    client to use another asyncio Redis client, e.g. fakeredis.aioredis.FakeRedis.
+    """
+
+    def __init__(
+        self,
+        redis_url: str = "redis://localhost:6379",
+        max_connections: int = 20,
+        socket_timeout: float = 0.5,
+        retry_interval: float = 5.0,
+        fallback_entries: int = 1024,
+        local_ttl: float = 300,
+        client: Optional[aioredis.Redis] = None
+    ):
+        if client is None:
+            pool = aioredis.ConnectionPool.from_url(
+                redis_url,
+                max_connections=max_connections,
+                socket_timeout=socket_timeout,
+                socket_connect_timeout=socket_timeout
+            )
+            client = aioredis.Redis(connection_pool=pool)
+        self.client = client
+        self.retry_interval = retry_interval
+        self.local = LocalCache(fallback_entries)
+        self.local_ttl = local_ttl
+        self._down_until = 0.0
+        self.logger = logging.getLogger(__name__)
+
+    @property
+    def available(self) -> bool:
+        """False while Redis is being skipped after a failure."""
+        return time.monotonic() >= self._down_until
+
+    def _mark_down(self, command: str, error: Exception):
+        REDIS_ERRORS.inc(command=command)
+        if self.available:
+            self.logger.warning(
+                f"Redis unavailable, using in-process cache for {self.retry_interval}s: {error}"
+            )
+        self._down_until = time.monotonic() + self.retry_interval
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return (await self.get_many([key]))[0]
+
+    async def get_many(self, keys: Sequence[str], local_first: bool = False) -> List[Optional[bytes]]:
+        """Values for keys in one round trip; None where missing.
+
+        With local_first, keys found in the in-process LRU skip Redis and keys
+        read from Redis are kept locally for local_ttl seconds. Only use it for
+        values that never change once written.
+        """
+        keys = list(keys)
+        if not keys:
+            return []
+        if not local_first:
+            if self.available:
+                try:
+                    with REDIS_SECONDS.time(trace_stage="redis.mget", command="mget"):
+                        return await self.client.mget(keys)
+                except (RedisError, OSError) as e:
+                    self._mark_down("mget", e)
+            return [self.local.get(key) for key in keys]
+
+        values = [self.local.get(key) for key in keys]
+        missing = [i for i, value in enumerate(values) if value is None]
+        if missing and self.available:
+            try:
+                with REDIS_SECONDS.time(trace_stage="redis.mget", command="mget"):
+                    fetched = await self.client.mget([keys[i] for i in missing])
+            except (RedisError, OSError) as e:
+                self._mark_down("mget", e)
+            else:
+                for i, value in zip(missing, fetched):
+                    if value is not None:
+                        values[i] = value
+                        self.local.set(keys[i], value, self.local_ttl)
+        return values
+
+    async def set(self, key: str, value: bytes, ttl: float):
+        await self.set_many({key: value}, ttl)
+
+    async def set_many(self, items: Dict[str, bytes], ttl: float):
+        """Store items with a TTL in seconds, pipelined into one round trip."""
+        for key, value in items.items():
+            self.local.set(key, value, ttl)
+        if not items or not self.available:
+            return
+        try:
+            with REDIS_SECONDS.time(trace_stage="redis.setex", command="setex"):
+                async with self.client.pipeline(transaction=False) as pipe:
+                    for key, value in items.items():
+                        pipe.setex(key, int(max(ttl, 1)), value)
+                    await pipe.execute()
+        except (RedisError, OSError) as e:
+            self._mark_down("setex", e)
+
+    async def delete(self, *keys: str):
+        for key in keys:
+            self.local.delete(key)
+        if not keys or not self.available:
+            return
+        try:
+            with REDIS_SECONDS.time(trace_stage="redis.delete", command="delete"):
+                await self.client.delete(*keys)
+        except (RedisError, OSError) as e:
+            self._mark_down("delete", e)
+
+    async def close(self):
+        await self.client.aclose()
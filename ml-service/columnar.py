@@ -0,0 +1,198 @@
+import math
+from collections.abc import Sequence
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from time_windows import to_datetime
+
+# Columns of a trip table; estimated_duration and the window bounds are optional
+TRIP_COLUMNS = (
+    "id", "pickup_latitude", "pickup_longitude", "delivery_latitude", "delivery_longitude",
+    "weight", "priority", "ready_time", "due_time", "estimated_duration"
+)
+REQUIRED_TRIP_COLUMNS = TRIP_COLUMNS[:7]
+
+
+def epoch_seconds(values: Sequence) -> np.ndarray:
+    """Seconds since the epoch from numbers, datetimes or ISO 8601 strings; NaN where missing."""
+    if isinstance(values, np.ndarray) and values.dtype.kind in "iuf":
+        return values.astype(np.float64)
+    return np.array(
+        [
+            np.nan if value is None
+            else float(value) if isinstance(value, (int, float))
+            else to_datetime(value).timestamp()
+            for value in values
+        ],
+        dtype=np.float64
+    )
+
+
+class TripColumns(Sequence):
+    """Trips held as parallel arrays, for requests too large to build one object per trip.
+
+    Stages that work on arrays (fingerprints, distances, time windows, the
+    routing problem and the strategies) read the columns directly, so only
+    trips that end up in a route are built. Everything else sees a sequence
+    of trips: a trip object is only built the first time it is accessed,
+    with trip_type and location_type, and then kept so repeated accesses
+    return the same objects.
+    """
+
+    def __init__(
+        self,
+        ids: List[str],
+        pickups: np.ndarray,
+        deliveries: np.ndarray,
+        weights: np.ndarray,
+        priorities: np.ndarray,
+        ready_times: np.ndarray,
+        due_times: np.ndarray,
+        service_times: np.ndarray,
+        trip_type: Callable,
+        location_type: Callable
+    ):
+        """pickups and deliveries are (n, 2) degree arrays; times are epoch seconds, NaN when open."""
+        self.ids = ids
+        self.pickups = pickups
+        self.deliveries = deliveries
+        self.weights = weights
+        self.priorities = priorities
+        self.ready_times = ready_times
+        self.due_times = due_times
+        self.service_times = service_times
+        self.trip_type = trip_type
+        self.location_type = location_type
+        self._trips: List = [None] * len(ids)
+
+    @classmethod
+    def from_columns(
+        cls,
+        columns: Dict[str, Optional[Sequence]],
+        trip_type: Callable,
+        location_type: Callable
+    ) -> "TripColumns":
+        """Validate a table of parallel trip columns (see TRIP_COLUMNS); raises ValueError."""
+        missing = [name for name in REQUIRED_TRIP_COLUMNS if columns.get(name) is None]
+        if missing:
+            raise ValueError(f"Missing trip columns: {', '.join(missing)}")
+        n = len(columns["id"])
+        for name in TRIP_COLUMNS:
+            if columns.get(name) is not None and len(columns[name]) != n:
+                raise ValueError(f"Trip column '{name}' has {len(columns[name])} values, expected {n}")
+
+        ids = [str(trip_id) for trip_id in columns["id"]]
+        if len(set(ids)) != n:
+            raise ValueError("Trip ids must be unique")
+
+        def floats(name: str, default: float = np.nan) -> np.ndarray:
+            if columns.get(name) is None:
+                return np.full(n, default)
+            return np.asarray(columns[name], dtype=np.float64).reshape(n)
+
+        pickups = np.column_stack((floats("pickup_latitude"), floats("pickup_longitude")))
+        deliveries = np.column_stack((floats("delivery_latitude"), floats("delivery_longitude")))
+        for name, points in (("pickup", pickups), ("delivery", deliveries)):
+            if not (np.all(np.abs(points[:, 0]) <= 90) and np.all(np.abs(points[:, 1]) <= 180)):
+                raise ValueError(f"Trip {name} coordinates must be valid latitudes and longitudes")
+
+        weights = floats("weight")
+        service_times = floats("estimated_duration", 0.0)
+        if not (np.all(weights >= 0) and np.all(service_times >= 0)):
+            raise ValueError("Trip weights and estimated durations must be non-negative numbers")
+        priorities = floats("priority")
+        if not np.all((priorities >= 1) & (priorities <= 5) & (priorities == np.round(priorities))):
+            raise ValueError("Trip priorities must be integers from 1 to 5")
+
+        open_window = np.full(n, np.nan)
+        ready_times = open_window if columns.get("ready_time") is None else epoch_seconds(columns["ready_time"])
+        due_times = open_window if columns.get("due_time") is None else epoch_seconds(columns["due_time"])
+        if np.any(due_times < ready_times):
+            raise ValueError("Trip due times must not be before their ready times")
+
+        return cls(
+            ids, pickups, deliveries, weights, priorities.astype(np.int64),
+            ready_times, due_times, service_times, trip_type, location_type
+        )
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __getitem__(self, k):
+        if isinstance(k, slice):
+            return [self[i] for i in range(*k.indices(len(self)))]
+        trip = self._trips[k]
+        if trip is None:
+            trip = self._trips[k] = self._build(k)
+        return trip
+
+    def __iter__(self):
+        if any(trip is None for trip in self._trips):
+            self._build_all()
+        return iter(self._trips)
+
+    def _build(self, k: int):
+        return self.trip_type(
+            id=self.ids[k],
+            pickup=self.location_type(*self.pickups[k].tolist()),
+            delivery=self.location_type(*self.deliveries[k].tolist()),
+            weight=float(self.weights[k]),
+            priority=int(self.priorities[k]),
+            time_window=(_from_epoch(self.ready_times[k]), _from_epoch(self.due_times[k])),
+            estimated_duration=float(self.service_times[k])
+        )
+
+    def _build_all(self):
+        """Build every trip not built yet, converting the columns to Python values once."""
+        location = self.location_type
+        rows = zip(
+            self.ids, self.pickups.tolist(), self.deliveries.tolist(), self.weights.tolist(),
+            self.priorities.tolist(), self.ready_times.tolist(), self.due_times.tolist(),
+            self.service_times.tolist()
+        )
+        for k, (trip_id, pickup, delivery, weight, priority, ready, due, service) in enumerate(rows):
+            if self._trips[k] is None:
+                self._trips[k] = self.trip_type(
+                    id=trip_id,
+                    pickup=location(*pickup),
+                    delivery=location(*delivery),
+                    weight=weight,
+                    priority=priority,
+                    time_window=(_from_epoch(ready), _from_epoch(due)),
+                    estimated_duration=service
+                )
+
+    def stop_coordinates(self) -> np.ndarray:
+        """(2n, 2) degrees: each trip's pickup followed by its delivery."""
+        return np.hstack((self.pickups, self.deliveries)).reshape(-1, 2)
+
+    def time_window_hours(self, departure: datetime) -> Tuple[np.ndarray, np.ndarray]:
+        """Ready and due times in hours after departure; open bounds are 0 and inf."""
+        origin = departure.timestamp()
+        ready = np.nan_to_num((self.ready_times - origin) / 3600.0, nan=0.0)
+        due = np.nan_to_num((self.due_times - origin) / 3600.0, nan=np.inf)
+        return ready, due
+
+
+def trip_ids(trips: Sequence) -> List[str]:
+    """Ids of trip objects or TripColumns, without building any trip."""
+    if isinstance(trips, TripColumns):
+        return trips.ids
+    return [trip.id for trip in trips]
+
+
+def trip_arrays(trips: Sequence) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Weights, priorities and service times of trip objects or TripColumns."""
+    if isinstance(trips, TripColumns):
+        return trips.weights, trips.priorities, trips.service_times
+    return (
+        np.array([trip.weight for trip in trips], dtype=np.float64),
+        np.array([trip.priority for trip in trips], dtype=np.int64),
+        np.array([trip.estimated_duration for trip in trips], dtype=np.float64)
+    )
+
+
+def _from_epoch(seconds: float) -> Optional[datetime]:
+    return None if math.isnan(seconds) else datetime.fromtimestamp(seconds)
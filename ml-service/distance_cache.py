@@ -0,0 +1,125 @@
+import struct
+from typing import Optional
+
+import numpy as np
+
+from cache_store import CacheStore
+from metrics import CACHE_LOOKUPS
+
+PAIR_KEY_PREFIX = "distance:"
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+GEOHASH_CHARS = np.array(list(GEOHASH_ALPHABET))
+MISSING = struct.pack("<f", float("nan"))
+SAME_CELL = struct.pack("<f", 0.0)
+
+
+def geohashes(latitudes, longitudes, precision: int = 8) -> np.ndarray:
+    """Standard base-32 geohash of every point at once; precision 8 is a cell of roughly 38 x 19 m."""
+    bits = 5 * precision
+    lng_bits, lat_bits = (bits + 1) // 2, bits // 2
+    # Each coordinate's bisection bits are its offset within the range as a fixed-point integer
+    lng = np.asarray(longitudes, dtype=np.float64).ravel()
+    lat = np.asarray(latitudes, dtype=np.float64).ravel()
+    lng_code = np.clip(np.floor((lng + 180.0) / 360.0 * 2.0 ** lng_bits), 0, 2 ** lng_bits - 1).astype(np.uint64)
+    lat_code = np.clip(np.floor((lat + 90.0) / 180.0 * 2.0 ** lat_bits), 0, 2 ** lat_bits - 1).astype(np.uint64)
+
+    # Interleave them, longitude first, from the most significant bit
+    code = np.zeros(len(lng), dtype=np.uint64)
+    one = np.uint64(1)
+    for bit in range(bits):
+        source, width = (lng_code, lng_bits) if bit % 2 == 0 else (lat_code, lat_bits)
+        code = (code << one) | ((source >> np.uint64(width - 1 - bit // 2)) & one)
+
+    shifts = np.uint64(5) * np.arange(precision - 1, -1, -1, dtype=np.uint64)
+    digits = ((code[:, None] >> shifts[None, :]) & np.uint64(31)).astype(np.intp)
+    chars = np.ascontiguousarray(GEOHASH_CHARS[digits])
+    return chars.view(f"<U{precision}").reshape(len(code))
+
+
+def geohash(latitude: float, longitude: float, precision: int = 8) -> str:
+    """Standard base-32 geohash of one point."""
+    return str(geohashes([latitude], [longitude], precision)[0])
+
+
+class PairDistanceCache:
+    """Distances between geohash cells, persisted across requests.
+
+    Locations in the same cell share cached distances, which is what lets
+    recurring depots and customer sites hit the cache even when their GPS
+    fixes jitter. Values are float32 km under keys
+    distance:<method>:<origin cell>:<destination cell>; for symmetric methods
+    only the lexically ordered pair is stored.
+    """
+
+    def __init__(
+        self,
+        store: CacheStore,
+        method: str,
+        precision: int = 8,
+        ttl: float = 30 * 24 * 3600,
+        max_pairs: int = 250_000,
+        symmetric: bool = True
+    ):
+        self.store = store
+        self.method = method
+        self.precision = precision
+        self.ttl = ttl
+        self.max_pairs = max_pairs
+        self.symmetric = symmetric
+
+    def _cells(self, coordinates: np.ndarray) -> np.ndarray:
+        return geohashes(coordinates[:, 0], coordinates[:, 1], self.precision)
+
+    def _pairs(self, coordinates: np.ndarray):
+        """Unique cell-pair keys, and each location pair's position in them (-1 within a cell)."""
+        unique_cells, cell_of = np.unique(self._cells(coordinates), return_inverse=True)
+        cell_of = cell_of.ravel()
+
+        m = len(unique_cells)
+        origins, destinations = np.nonzero(~np.eye(m, dtype=bool))
+        if self.symmetric:
+            keep = origins < destinations
+            origins, destinations = origins[keep], destinations[keep]
+        # Built as string arrays; formatting each key in Python blocked the event loop
+        prefixes = np.array([f"{PAIR_KEY_PREFIX}{self.method}:{cell}:" for cell in unique_cells.tolist()])
+        keys = np.char.add(prefixes[origins], unique_cells[destinations]).tolist()
+
+        slot = np.full((m, m), -1, dtype=np.intp)
+        slot[origins, destinations] = np.arange(len(keys))
+        if self.symmetric:
+            slot[destinations, origins] = np.arange(len(keys))
+        return keys, slot[np.ix_(cell_of, cell_of)]
+
+    async def lookup(self, coordinates: np.ndarray) -> Optional[np.ndarray]:
+        """Cached distance matrix with NaN for missing pairs, from one multi-get.
+
+        Returns None when the problem has more cell pairs than max_pairs.
+        """
+        n = len(coordinates)
+        if n * (n - 1) // (2 if self.symmetric else 1) > self.max_pairs:
+            return None
+
+        keys, slots = self._pairs(coordinates)
+        values = await self.store.get_many(keys, local_first=True)
+        hits = sum(value is not None for value in values)
+        CACHE_LOOKUPS.inc(hits, cache="pair", outcome="hit")
+        CACHE_LOOKUPS.inc(len(values) - hits, cache="pair", outcome="miss")
+        cached = np.frombuffer(
+            b"".join(v if v is not None else MISSING for v in values) + SAME_CELL,
+            dtype="<f4"
+        ).astype(np.float32)
+        # Slot -1 selects the trailing SAME_CELL entry
+        known = cached[slots]
+        np.fill_diagonal(known, 0.0)
+        return known
+
+    async def save(self, coordinates: np.ndarray, matrix: np.ndarray, known: np.ndarray):
+        """Persist the pairs that were missing from known, pipelined into one round trip."""
+        keys, slots = self._pairs(coordinates)
+        new = np.isnan(known) & (slots >= 0)
+        # One value per cell pair: the first location pair that maps to it
+        new_slots, first = np.unique(slots[new], return_index=True)
+        packed = matrix[new][first].astype("<f4").tobytes()
+        items = {keys[slot]: packed[4 * k:4 * k + 4] for k, slot in enumerate(new_slots)}
+        if items:
+            await self.store.set_many(items, self.ttl)
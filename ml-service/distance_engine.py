@@ -0,0 +1,339 @@
+import numpy as np
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+EARTH_RADIUS_KM = 6371.0088
+
+# WGS-84 ellipsoid
+WGS84_A_KM = 6378.137
+WGS84_F = 1 / 298.257223563
+
+# Rows of the matrix computed per vectorized block, bounds float64 temporaries
+DEFAULT_BLOCK_SIZE = 1024
+
+
+def location_key(location) -> Tuple[float, float]:
+    """Key used to deduplicate locations by coordinates."""
+    return (location.latitude, location.longitude)
+
+
+def haversine_km(lat1, lng1, lat2, lng2) -> np.ndarray:
+    """Great-circle distance in km, broadcasting over degree arrays."""
+    lat1, lng1, lat2, lng2 = map(np.radians, (lat1, lng1, lat2, lng2))
+    a = (
+        np.sin((lat2 - lat1) / 2.0) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2.0) ** 2
+    )
+    return 2.0 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def ellipsoidal_km(lat1, lng1, lat2, lng2) -> np.ndarray:
+    """WGS-84 distance in km using Lambert's formula, broadcasting over degree arrays.
+
+    Within ~10 m of geopy's geodesic for the distances we route over, at the
+    cost of a few extra trig passes compared to haversine.
+    """
+    lat1, lng1, lat2, lng2 = map(np.radians, (lat1, lng1, lat2, lng2))
+    beta1 = np.arctan((1 - WGS84_F) * np.tan(lat1))
+    beta2 = np.arctan((1 - WGS84_F) * np.tan(lat2))
+
+    a = (
+        np.sin((beta2 - beta1) / 2.0) ** 2
+        + np.cos(beta1) * np.cos(beta2) * np.sin((lng2 - lng1) / 2.0) ** 2
+    )
+    sigma = 2.0 * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+    p = (beta1 + beta2) / 2.0
+    q = (beta2 - beta1) / 2.0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x = (sigma - np.sin(sigma)) * (np.sin(p) * np.cos(q)) ** 2 / np.cos(sigma / 2.0) ** 2
+        y = (sigma + np.sin(sigma)) * (np.cos(p) * np.sin(q)) ** 2 / np.sin(sigma / 2.0) ** 2
+        distance = WGS84_A_KM * (sigma - WGS84_F / 2.0 * (x + y))
+
+    return np.where(sigma > 0, distance, 0.0)
+
+
+DISTANCE_METHODS = {
+    "haversine": haversine_km,
+    "ellipsoidal": ellipsoidal_km,
+}
+
+
+# Closed-form methods: recomputing is cheaper than a cache round trip
+CLOSED_FORM_METHODS = frozenset(DISTANCE_METHODS)
+
+
+def register_distance_method(name: str, distance_fn):
+    """Add a distance source with the same broadcasting signature as haversine_km."""
+    DISTANCE_METHODS[name] = distance_fn
+
+
+def get_distance_function(method: str):
+    """Resolve a distance method name to its vectorized implementation."""
+    try:
+        return DISTANCE_METHODS[method]
+    except KeyError:
+        raise ValueError(
+            f"Unknown distance method '{method}', expected one of {sorted(DISTANCE_METHODS)}"
+        )
+
+
+def pairwise_distances(
+    origins: np.ndarray,
+    destinations: np.ndarray,
+    method: str = "haversine",
+    block_size: int = DEFAULT_BLOCK_SIZE
+) -> np.ndarray:
+    """Compute an origins x destinations float32 distance matrix from (lat, lng) arrays."""
+    distance_fn = get_distance_function(method)
+    result = np.empty((len(origins), len(destinations)), dtype=np.float32)
+
+    for start in range(0, len(origins), block_size):
+        block = origins[start:start + block_size]
+        result[start:start + block_size] = distance_fn(
+            block[:, 0:1], block[:, 1:2],
+            destinations[:, 0], destinations[:, 1]
+        )
+
+    return result
+
+
+class IndexedLocations:
+    """Unique locations addressed by integer index, in order of first occurrence.
+
+    Locations are objects with latitude and longitude, or an (n, 2) array of
+    degrees, which is indexed without building an object per row.
+    """
+
+    def __init__(self, locations: Union[Iterable, np.ndarray]):
+        if isinstance(locations, np.ndarray):
+            points = locations.astype(np.float64, copy=False).reshape(-1, 2)
+            unique, first = np.unique(points, axis=0, return_index=True)
+            self.coordinates = unique[np.argsort(first)]
+            self.index = {key: i for i, key in enumerate(map(tuple, self.coordinates.tolist()))}
+            return
+
+        unique = {}
+        for location in locations:
+            unique.setdefault(location_key(location), None)
+        self.index = {key: i for i, key in enumerate(unique)}
+        self.coordinates = np.array(list(unique), dtype=np.float64).reshape(-1, 2)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def index_of(self, location) -> int:
+        """Integer index of a location."""
+        return self.index[location_key(location)]
+
+    def indices_of(self, locations: Sequence) -> np.ndarray:
+        """Integer indices for a sequence of locations."""
+        return np.fromiter(
+            (self.index[location_key(loc)] for loc in locations),
+            dtype=np.intp,
+            count=len(locations)
+        )
+
+    def indices_of_points(self, points: np.ndarray) -> np.ndarray:
+        """Integer indices for an (n, 2) array of degrees."""
+        return np.fromiter(
+            (self.index[key] for key in map(tuple, points.tolist())),
+            dtype=np.intp,
+            count=len(points)
+        )
+
+    def extend(self, locations: Sequence) -> np.ndarray:
+        """Index any new locations after the existing ones; returns indices of all given."""
+        added = []
+        for location in locations:
+            key = location_key(location)
+            if key not in self.index:
+                self.index[key] = len(self.index)
+                added.append(key)
+        if added:
+            self.coordinates = np.vstack((self.coordinates, np.array(added, dtype=np.float64)))
+        return self.indices_of(locations)
+
+
+class DistanceMatrix(IndexedLocations):
+    """Dense distance matrix over unique locations, addressed by integer index.
+
+    computed_pairs counts the distances actually computed, i.e. not taken
+    from known.
+    """
+
+    def __init__(
+        self,
+        locations: Union[Iterable, np.ndarray],
+        method: str = "haversine",
+        block_size: int = DEFAULT_BLOCK_SIZE,
+        known: Optional[np.ndarray] = None
+    ):
+        super().__init__(locations)
+        self.method = method
+        if known is None:
+            self.matrix = pairwise_distances(
+                self.coordinates, self.coordinates, method, block_size
+            )
+            self.computed_pairs = len(self) ** 2
+        else:
+            # Previously cached distances; only the NaN entries are computed
+            self.matrix = known.astype(np.float32, copy=True)
+            origins, destinations = np.nonzero(np.isnan(self.matrix))
+            self.computed_pairs = len(origins)
+            self.matrix[origins, destinations] = get_distance_function(method)(
+                self.coordinates[origins, 0], self.coordinates[origins, 1],
+                self.coordinates[destinations, 0], self.coordinates[destinations, 1]
+            )
+        np.fill_diagonal(self.matrix, 0.0)
+
+    def extend(self, locations: Sequence) -> np.ndarray:
+        """Index new locations, computing only their rows and columns of the matrix."""
+        old = len(self)
+        indices = super().extend(locations)
+        if len(self) > old:
+            matrix = np.empty((len(self), len(self)), dtype=np.float32)
+            matrix[:old, :old] = self.matrix
+            added = self.coordinates[old:]
+            matrix[old:] = pairwise_distances(added, self.coordinates, self.method)
+            matrix[:old, old:] = pairwise_distances(self.coordinates[:old], added, self.method)
+            new = np.arange(old, len(self))
+            matrix[new, new] = 0.0
+            self.matrix = matrix
+            self.computed_pairs += len(self) ** 2 - old ** 2
+        return indices
+
+    def distance(self, i: int, j: int) -> float:
+        """Distance in km between two location indices."""
+        return float(self.matrix[i, j])
+
+    def one_to_many(self, i: int, js: np.ndarray) -> np.ndarray:
+        """Distances in km from one location index to many."""
+        return self.matrix[i, js]
+
+    def pairs(self, origins: np.ndarray, destinations: np.ndarray) -> np.ndarray:
+        """Element-wise distances in km between two index arrays."""
+        return self.matrix[origins, destinations]
+
+
+class LazyDistanceOracle(IndexedLocations):
+    """Distance oracle that only computes, and remembers, the pairs it is asked for.
+
+    Memory grows with the number of distinct pairs requested rather than with
+    the square of the number of locations.
+    """
+
+    def __init__(self, locations: Union[Iterable, np.ndarray], method: str = "haversine"):
+        super().__init__(locations)
+        self.method = method
+        self._distance_fn = get_distance_function(method)
+        self._cache: Dict[int, float] = {}
+
+    @property
+    def computed_pairs(self) -> int:
+        return len(self._cache)
+
+    def distance(self, i: int, j: int) -> float:
+        """Distance in km between two location indices."""
+        return float(self.pairs(np.array([i]), np.array([j]))[0])
+
+    def one_to_many(self, i: int, js: np.ndarray) -> np.ndarray:
+        """Distances in km from one location index to many."""
+        js = np.asarray(js, dtype=np.intp)
+        return self.pairs(np.full(len(js), i, dtype=np.intp), js)
+
+    def pairs(self, origins: np.ndarray, destinations: np.ndarray) -> np.ndarray:
+        """Element-wise distances in km, computing all missing pairs in one batch."""
+        origins = np.asarray(origins, dtype=np.intp)
+        destinations = np.asarray(destinations, dtype=np.intp)
+        # Keys stay valid when locations are added
+        keys = (origins << 32) | destinations
+
+        cache = self._cache
+        result = np.fromiter(
+            (cache.get(key, np.nan) for key in keys.tolist()),
+            dtype=np.float32,
+            count=len(keys)
+        )
+
+        missing = np.flatnonzero(np.isnan(result))
+        if len(missing):
+            start = self.coordinates[origins[missing]]
+            end = self.coordinates[destinations[missing]]
+            computed = self._distance_fn(
+                start[:, 0], start[:, 1], end[:, 0], end[:, 1]
+            ).astype(np.float32)
+            computed[origins[missing] == destinations[missing]] = 0.0
+            result[missing] = computed
+            cache.update(zip(keys[missing].tolist(), computed.tolist()))
+
+        return result
+
+
+DistanceOracle = Union[DistanceMatrix, LazyDistanceOracle]
+
+
+class SpatialIndex:
+    """Ball tree over (lat, lng) points for radius and k-nearest queries in km."""
+
+    def __init__(self, coordinates: np.ndarray):
+        from sklearn.neighbors import BallTree
+
+        self.size = len(coordinates)
+        self._tree = BallTree(np.radians(coordinates), metric="haversine")
+
+    def within_radius(self, points: np.ndarray, radius_km: float) -> List[np.ndarray]:
+        """Indices of indexed points within radius_km of each query point."""
+        return list(self._tree.query_radius(
+            np.radians(points), r=radius_km / EARTH_RADIUS_KM
+        ))
+
+    def nearest(self, points: np.ndarray, k: int) -> np.ndarray:
+        """Indices of the k nearest indexed points to each query point."""
+        k = min(k, self.size)
+        return self._tree.query(np.radians(points), k=k, return_distance=False)
+
+    def candidates(
+        self,
+        points: np.ndarray,
+        radius_km: float,
+        fallback_k: int
+    ) -> List[np.ndarray]:
+        """Points within radius_km, or the fallback_k nearest when none are in range."""
+        within = self.within_radius(points, radius_km)
+        empty = [i for i, found in enumerate(within) if len(found) == 0]
+        if empty:
+            nearest = self.nearest(points[empty], fallback_k)
+            for row, i in enumerate(empty):
+                within[i] = nearest[row]
+        return [np.sort(found) for found in within]
+
+
+def build_distance_oracle(
+    locations: Union[Iterable, np.ndarray],
+    method: str = "haversine",
+    mode: str = "auto",
+    lazy_threshold: int = 4000,
+    known: Optional[np.ndarray] = None
+) -> DistanceOracle:
+    """Build a dense matrix for small problems and a lazy oracle for large ones.
+
+    known holds cached distances (NaN where missing) in IndexedLocations order
+    and always yields a dense matrix.
+    """
+    if known is not None:
+        return DistanceMatrix(locations, method=method, known=known)
+
+    if not isinstance(locations, np.ndarray):
+        locations = list(locations)
+    if mode == "auto":
+        if isinstance(locations, np.ndarray):
+            unique_count = len(np.unique(locations.reshape(-1, 2), axis=0))
+        else:
+            unique_count = len({location_key(loc) for loc in locations})
+        mode = "lazy" if unique_count > lazy_threshold else "dense"
+
+    if mode == "dense":
+        return DistanceMatrix(locations, method=method)
+    if mode == "lazy":
+        return LazyDistanceOracle(locations, method=method)
+    raise ValueError(f"Unknown distance mode '{mode}', expected 'auto', 'dense' or 'lazy'")
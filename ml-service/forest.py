@@ -0,0 +1,145 @@
+import numpy as np
+
+from shared_data import map_npz
+
+
+def _float32_cut(threshold: np.ndarray) -> np.ndarray:
+    """Split point in float64 equivalent to sklearn's float32(x) <= threshold test.
+
+    sklearn casts features to float32 before comparing, so every x that rounds
+    to the largest float32 at or below the threshold still goes left. The cut
+    is the midpoint between that float32 and the next one up.
+    """
+    below = threshold.astype(np.float32)
+    below = np.where(below > threshold, np.nextafter(below, np.float32(-np.inf)), below)
+    above = np.nextafter(below, np.float32(np.inf))
+    return (below.astype(np.float64) + above.astype(np.float64)) / 2
+
+
+def _breadth_first(children_left: np.ndarray, children_right: np.ndarray) -> np.ndarray:
+    """Node ids in breadth-first order, with each node's children next to each other."""
+    order = [0]
+    for node in order:
+        if children_left[node] >= 0:
+            order.append(children_left[node])
+            order.append(children_right[node])
+    return np.array(order, dtype=np.intp)
+
+
+class CompiledForest:
+    """Random forest regressor flattened into node arrays for batched NumPy inference.
+
+    All trees share one set of node arrays, numbered breadth-first so a
+    node's right child directly follows its left child. Each row of a batch
+    walks every tree at once: for max_depth steps its current nodes compare
+    one feature with their threshold and step to left or left + 1. Leaves
+    point to themselves with an infinite threshold, so rows that reach a leaf
+    early stay there. The prediction is the mean leaf value over trees.
+
+    A StandardScaler fitted before the forest is folded into the thresholds,
+    so predict() takes raw features. Thresholds also absorb sklearn's float32
+    cast, so splits match sklearn exactly rather than to within rounding.
+    """
+
+    def __init__(
+        self,
+        feature: np.ndarray,
+        threshold: np.ndarray,
+        left: np.ndarray,
+        value: np.ndarray,
+        roots: np.ndarray,
+        max_depth: int
+    ):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.value = value
+        self.roots = roots
+        self.max_depth = int(max_depth)
+
+    @property
+    def n_trees(self) -> int:
+        return len(self.roots)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(
+            a.nbytes for a in (self.feature, self.threshold, self.left, self.value, self.roots)
+        )
+
+    @classmethod
+    def from_sklearn(cls, forest, scaler=None) -> "CompiledForest":
+        """Flatten a fitted RandomForestRegressor, optionally preceded by a StandardScaler."""
+        features, thresholds, lefts, values, roots = [], [], [], [], []
+        offset = 0
+        max_depth = 0
+        for estimator in forest.estimators_:
+            tree = estimator.tree_
+            order = _breadth_first(tree.children_left, tree.children_right)
+            position = np.empty_like(order)
+            position[order] = np.arange(len(order))
+
+            children_left = tree.children_left[order]
+            leaf = children_left < 0
+            feature = np.where(leaf, 0, tree.feature[order])
+            threshold = _float32_cut(tree.threshold[order])
+            if scaler is not None:
+                # x_scaled <= t  <=>  x <= t * scale + mean
+                threshold = threshold * scaler.scale_[feature] + scaler.mean_[feature]
+
+            features.append(feature)
+            thresholds.append(np.where(leaf, np.inf, threshold))
+            lefts.append(np.where(leaf, np.arange(len(order)), position[children_left]) + offset)
+            values.append(tree.value[order, 0, 0])
+            roots.append(offset)
+            offset += len(order)
+            max_depth = max(max_depth, tree.max_depth)
+
+        return cls(
+            np.concatenate(features).astype(np.int32),
+            np.concatenate(thresholds).astype(np.float64),
+            np.concatenate(lefts).astype(np.int32),
+            np.concatenate(values).astype(np.float64),
+            np.array(roots, dtype=np.int32),
+            max_depth
+        )
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        """Predictions for a (n_samples, n_features) matrix of raw features."""
+        X = np.asarray(X, dtype=np.float64)
+        n_features = X.shape[1]
+        flat = X.ravel()
+        row_offset = (np.arange(len(X)) * n_features)[:, None]
+
+        nodes = np.repeat(self.roots[None, :], len(X), axis=0)
+        for _ in range(self.max_depth):
+            go_right = flat[row_offset + self.feature[nodes]] > self.threshold[nodes]
+            nodes = self.left[nodes] + go_right
+
+        return self.value[nodes].mean(axis=1)
+
+    def save(self, path: str):
+        np.savez(
+            path,
+            feature=self.feature,
+            threshold=self.threshold,
+            left=self.left,
+            value=self.value,
+            roots=self.roots,
+            max_depth=np.array(self.max_depth)
+        )
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = False) -> "CompiledForest":
+        """Load a saved forest; with mmap, its arrays are mapped read-only and shared between processes."""
+        if mmap:
+            return cls._from_arrays(map_npz(path))
+        with np.load(path) as data:
+            return cls._from_arrays(data)
+
+    @classmethod
+    def _from_arrays(cls, data) -> "CompiledForest":
+        return cls(
+            data["feature"], data["threshold"], data["left"], data["value"],
+            data["roots"], int(data["max_depth"])
+        )
@@ -0,0 +1,149 @@
+import asyncio
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+from metrics import stage
+
+
+class QueueFullError(Exception):
+    """Raised when a job is offered while the queue is at its depth limit."""
+
+
+@dataclass
+class Job:
+    id: str
+    status: str = "queued"  # queued, running, done, failed
+    submitted_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    result: Any = None
+    error: Optional[str] = None
+    done: asyncio.Event = field(default_factory=asyncio.Event, repr=False)
+
+    def to_dict(self) -> Dict:
+        data = {
+            "job_id": self.id,
+            "status": self.status,
+            "submitted_at": self.submitted_at,
+            "finished_at": self.finished_at,
+        }
+        if self.status == "done":
+            data["result"] = self.result
+        elif self.status == "failed":
+            data["error"] = self.error
+        return data
+
+
+class JobQueue:
+    """Bounds how many optimizations run at once and how many may wait.
+
+    At most max_concurrency jobs run concurrently; together with the ones
+    waiting for a slot there are never more than max_queue. Offering more
+    raises QueueFullError so callers can shed load instead of piling up.
+    Jobs submitted for asynchronous polling keep their outcome for
+    result_ttl seconds after finishing.
+    """
+
+    def __init__(self, max_concurrency: int = 2, max_queue: int = 16, result_ttl: float = 600):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.result_ttl = result_ttl
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._depth = 0
+        self._jobs: Dict[str, Job] = {}
+        # The loop only holds weak references to tasks; these keep scheduled ones alive
+        self._tasks: Set[asyncio.Future] = set()
+
+    @property
+    def depth(self) -> int:
+        """Jobs currently running or waiting for a slot."""
+        return self._depth
+
+    def _schedule(self, coroutine: Awaitable) -> asyncio.Future:
+        task = asyncio.ensure_future(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def _reserve(self):
+        if self._depth >= self.max_queue:
+            raise QueueFullError(f"Optimization queue is full ({self.max_queue} jobs)")
+        self._depth += 1
+
+    async def _run_reserved(self, job: Optional[Job], fn: Callable[..., Awaitable], args, kwargs):
+        if self._slots is None:
+            # Created on first use so it binds to the serving event loop
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+        try:
+            with stage("queue_wait"):
+                await self._slots.acquire()
+            try:
+                if job is not None:
+                    job.status = "running"
+                return await fn(*args, **kwargs)
+            finally:
+                self._slots.release()
+        finally:
+            self._depth -= 1
+
+    async def run(self, fn: Callable[..., Awaitable], *args, **kwargs):
+        """Await fn(*args, **kwargs) once a slot is free; raises QueueFullError when full."""
+        self._reserve()
+        return await self._run_reserved(None, fn, args, kwargs)
+
+    def start(self, fn: Callable[..., Awaitable], *args, **kwargs) -> asyncio.Future:
+        """Schedule fn(*args, **kwargs) once a slot is free and return its future.
+
+        Unlike run(), a full queue raises QueueFullError here, before the
+        caller has committed to a response.
+        """
+        self._reserve()
+        return self._schedule(self._run_reserved(None, fn, args, kwargs))
+
+    def submit(self, fn: Callable[..., Awaitable], *args, **kwargs) -> Job:
+        """Schedule fn(*args, **kwargs) in the background and return its job for polling."""
+        self._expire()
+        self._reserve()
+        job = Job(id=uuid.uuid4().hex)
+        self._jobs[job.id] = job
+        self._schedule(self._execute(job, fn, args, kwargs))
+        return job
+
+    async def _execute(self, job: Job, fn: Callable[..., Awaitable], args, kwargs):
+        try:
+            job.result = await self._run_reserved(job, fn, args, kwargs)
+            job.status = "done"
+        except asyncio.CancelledError:
+            job.error = "cancelled"
+            job.status = "failed"
+            raise
+        except Exception as e:
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            job.finished_at = time.time()
+            job.done.set()
+
+    def get(self, job_id: str) -> Optional[Job]:
+        self._expire()
+        return self._jobs.get(job_id)
+
+    async def wait(self, job_id: str, timeout: float) -> Optional[Job]:
+        """Long-poll: return the job once finished or after timeout seconds, whichever is first."""
+        job = self.get(job_id)
+        if job is not None and timeout > 0 and not job.done.is_set():
+            try:
+                await asyncio.wait_for(job.done.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return job
+
+    def _expire(self):
+        cutoff = time.time() - self.result_ttl
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished_at is not None and job.finished_at < cutoff
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
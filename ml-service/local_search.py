@@ -0,0 +1,659 @@
+import time
+import numpy as np
+from dataclasses import dataclass
+from datetime import datetime
+from typing import List, Optional, Sequence, Tuple
+
+from distance_engine import DistanceOracle, SpatialIndex
+from columnar import TripColumns, trip_arrays
+from time_windows import EPSILON, RouteSchedule, to_datetime
+
+
+@dataclass
+class RoutingProblem:
+    """Pickup-and-delivery instance with every location given as an oracle index.
+
+    Times are hours relative to the common departure time of all vehicles.
+    """
+    distance_matrix: DistanceOracle
+    vehicle_locations: np.ndarray
+    capacities: np.ndarray
+    pickups: np.ndarray
+    deliveries: np.ndarray
+    weights: np.ndarray
+    ready_times: np.ndarray
+    due_times: np.ndarray
+    service_times: np.ndarray
+    average_speed: float = 40.0
+
+    @property
+    def vehicle_count(self) -> int:
+        return len(self.vehicle_locations)
+
+    @property
+    def trip_count(self) -> int:
+        return len(self.pickups)
+
+
+def time_window_hours(trips: Sequence, departure: datetime) -> Tuple[np.ndarray, np.ndarray]:
+    """Ready and due times of each trip's window in hours after departure."""
+    if isinstance(trips, TripColumns):
+        return trips.time_window_hours(departure)
+    ready = np.zeros(len(trips))
+    due = np.full(len(trips), np.inf)
+    origin = departure.timestamp()
+
+    for k, trip in enumerate(trips):
+        if not trip.time_window:
+            continue
+        start, end = trip.time_window
+        if start is not None:
+            ready[k] = (to_datetime(start).timestamp() - origin) / 3600.0
+        if end is not None:
+            due[k] = (to_datetime(end).timestamp() - origin) / 3600.0
+
+    return ready, due
+
+
+def stop_indices(distance_matrix: DistanceOracle, trips: Sequence) -> Tuple[np.ndarray, np.ndarray]:
+    """Location indices of each trip's pickup and of its delivery."""
+    if isinstance(trips, TripColumns):
+        return (
+            distance_matrix.indices_of_points(trips.pickups),
+            distance_matrix.indices_of_points(trips.deliveries)
+        )
+    return (
+        distance_matrix.indices_of([t.pickup for t in trips]),
+        distance_matrix.indices_of([t.delivery for t in trips])
+    )
+
+
+def routing_problem(
+    distance_matrix: DistanceOracle,
+    vehicles: Sequence,
+    trips: Sequence,
+    average_speed: float,
+    departure: datetime
+) -> RoutingProblem:
+    """RoutingProblem for vehicles and trips whose locations are all in distance_matrix."""
+    ready_times, due_times = time_window_hours(trips, departure)
+    weights, _, service_times = trip_arrays(trips)
+    pickups, deliveries = stop_indices(distance_matrix, trips)
+    return RoutingProblem(
+        distance_matrix=distance_matrix,
+        vehicle_locations=distance_matrix.indices_of([v.current_location for v in vehicles]),
+        capacities=np.array([v.capacity for v in vehicles], dtype=np.float64),
+        pickups=pickups,
+        deliveries=deliveries,
+        weights=weights,
+        ready_times=ready_times,
+        due_times=due_times,
+        service_times=service_times,
+        average_speed=average_speed
+    )
+
+
+class LocalSearchSolver:
+    """Cheapest feasible insertion followed by local search under a time budget.
+
+    Routes are lists of stops: stop 2*t is the pickup of trip t and 2*t + 1 its
+    delivery. Every route starts at its vehicle's location and is open ended.
+    A route is feasible when each delivery follows its pickup, the load never
+    exceeds capacity and every delivery arrives before its trip's due time.
+    Pickups wait for the trip's ready time and then spend its service time.
+    Each route keeps a RouteSchedule, so insertions are checked against time
+    windows from its slack arrays rather than by simulating the new route.
+
+    A solved instance can be kept and changed in place: trips added with
+    extend() and insert(), or removed, vehicles moved or disabled, and only
+    the routes touched are repaired.
+    """
+
+    def __init__(
+        self,
+        problem: RoutingProblem,
+        time_budget: float = 1.0,
+        neighbor_routes: int = 20,
+        neighbor_trips: int = 8,
+        candidates: Optional[List[np.ndarray]] = None
+    ):
+        self.problem = problem
+        self.time_budget = time_budget
+        self.neighbor_routes = neighbor_routes
+        self.neighbor_trips = neighbor_trips
+        self.candidates = candidates
+        self._index_stops()
+
+        # Vehicles that may take new stops
+        self.available = np.ones(problem.vehicle_count, dtype=bool)
+        self.routes: List[List[int]] = [[] for _ in range(problem.vehicle_count)]
+        self.unassigned: List[int] = []
+        self._route_locations = [
+            np.array([loc], dtype=np.intp) for loc in problem.vehicle_locations
+        ]
+        self._costs = np.zeros(problem.vehicle_count)
+        self._schedules = [self._schedule(v, []) for v in range(problem.vehicle_count)]
+        self._vehicle_of = np.full(problem.trip_count, -1, dtype=np.intp)
+        self._deadline = float("inf")
+
+    def solve(
+        self,
+        order: Optional[Sequence[int]] = None,
+        initial_routes: Optional[List[List[int]]] = None,
+        full_construction: bool = False
+    ) -> List[List[int]]:
+        """Insert every trip (in the given order) then improve until out of time.
+
+        Once the time budget runs out during construction, the remaining
+        trips are appended where that is cheapest instead of searched for
+        their best slots, so every feasible trip is still placed. With
+        full_construction, every trip gets the full search and the budget
+        starts after construction. With initial_routes, those routes are
+        kept as the starting solution and only the trips in order are
+        inserted into them.
+        """
+        self._deadline = time.perf_counter() + self.time_budget
+        for v, route in enumerate(initial_routes or []):
+            self._set_route(v, list(route))
+        order = range(self.problem.trip_count) if order is None else order
+        self.construct(order, timed=not full_construction)
+        if full_construction:
+            self._deadline = time.perf_counter() + self.time_budget
+        self.improve()
+        return self.routes
+
+    # Route bookkeeping
+
+    def _index_stops(self):
+        """Per-stop arrays derived from the problem's per-trip arrays."""
+        problem = self.problem
+        self._distance = problem.distance_matrix.distance
+        self._pairs = problem.distance_matrix.pairs
+        self._stop_locations = np.empty(2 * problem.trip_count, dtype=np.intp)
+        self._stop_locations[0::2] = problem.pickups
+        self._stop_locations[1::2] = problem.deliveries
+        self._stop_weights = np.empty(2 * problem.trip_count)
+        self._stop_weights[0::2] = problem.weights
+        self._stop_weights[1::2] = -problem.weights
+        # Pickups open at the ready time; deliveries close at the due time
+        self._stop_ready = np.zeros(2 * problem.trip_count)
+        self._stop_ready[0::2] = problem.ready_times
+        self._stop_latest = np.full(2 * problem.trip_count, np.inf)
+        self._stop_latest[1::2] = problem.due_times
+        self._stop_service = np.zeros(2 * problem.trip_count)
+        self._stop_service[0::2] = problem.service_times
+        self._timed = bool(
+            np.isfinite(problem.due_times).any() or (problem.ready_times > 0).any()
+        )
+
+    def _out_of_time(self) -> bool:
+        return time.perf_counter() >= self._deadline
+
+    def _locations(self, v: int, route: List[int]) -> np.ndarray:
+        locations = np.empty(len(route) + 1, dtype=np.intp)
+        locations[0] = self.problem.vehicle_locations[v]
+        locations[1:] = self._stop_locations[route]
+        return locations
+
+    def _route_cost(self, locations: np.ndarray) -> float:
+        if len(locations) < 2:
+            return 0.0
+        return float(self._pairs(locations[:-1], locations[1:]).sum(dtype=np.float64))
+
+    def _set_route(self, v: int, route: List[int]):
+        self.routes[v] = route
+        self._route_locations[v] = self._locations(v, route)
+        self._costs[v] = self._route_cost(self._route_locations[v])
+        if self._timed:
+            self._schedules[v] = self._schedule(v, route, self._route_locations[v])
+        for stop in route:
+            self._vehicle_of[stop >> 1] = v
+
+    @property
+    def total_distance(self) -> float:
+        return float(self._costs.sum())
+
+    def is_feasible(self, v: int, route: List[int]) -> bool:
+        """Check precedence, capacity and time windows by simulating the route."""
+        problem = self.problem
+        capacity = problem.capacities[v] + EPSILON
+        speed = problem.average_speed
+        load = 0.0
+        clock = 0.0
+        location = problem.vehicle_locations[v]
+        picked = set()
+
+        for stop in route:
+            trip = stop >> 1
+            next_location = self._stop_locations[stop]
+            clock += self._distance(location, next_location) / speed
+            location = next_location
+
+            if stop & 1:
+                if trip not in picked or clock > problem.due_times[trip] + EPSILON:
+                    return False
+                load -= problem.weights[trip]
+            else:
+                picked.add(trip)
+                load += problem.weights[trip]
+                if load > capacity:
+                    return False
+                clock = max(clock, problem.ready_times[trip]) + problem.service_times[trip]
+
+        return True
+
+    def _schedule(
+        self,
+        v: int,
+        route: List[int],
+        locations: Optional[np.ndarray] = None
+    ) -> RouteSchedule:
+        """Arrival, slack and forward time slack along vehicle v driving route."""
+        if locations is None:
+            locations = self._locations(v, route)
+        travel = (
+            self._pairs(locations[:-1], locations[1:]).astype(np.float64) / self.problem.average_speed
+            if len(route) else np.empty(0)
+        )
+        return RouteSchedule(
+            travel, self._stop_ready[route], self._stop_latest[route], self._stop_service[route]
+        )
+
+    def completion_times(self, routes: Optional[List[List[int]]] = None) -> np.ndarray:
+        """Hours after departure at which each vehicle leaves its last stop."""
+        routes = self.routes if routes is None else routes
+        return np.array([self._schedule(v, route).completion for v, route in enumerate(routes)])
+
+    # Insertion
+
+    @staticmethod
+    def _inserted(route: List[int], trip: int, i: int, j: int) -> List[int]:
+        """Route with trip's pickup after route[:i] and delivery after route[:j] (j >= i)."""
+        return route[:i] + [2 * trip] + route[i:j] + [2 * trip + 1] + route[j:]
+
+    def best_insertion(
+        self,
+        v: int,
+        route: List[int],
+        trip: int,
+        bound: float = float("inf")
+    ) -> Optional[Tuple[float, int, int]]:
+        """Cheapest feasible (added distance, pickup slot, delivery slot) below bound, or None.
+
+        Added distance, capacity and time windows are evaluated for every slot
+        pair at once, so the cheapest remaining slot pair is feasible.
+        """
+        problem = self.problem
+        weight = problem.weights[trip]
+        if weight > problem.capacities[v] + EPSILON:
+            return None
+
+        pickup = problem.pickups[trip]
+        delivery = problem.deliveries[trip]
+        n = len(route)
+        locations = self._locations(v, route)
+
+        to_pickup = self._pairs(locations, np.full(n + 1, pickup)).astype(np.float64)
+        to_delivery = self._pairs(locations, np.full(n + 1, delivery)).astype(np.float64)
+        pickup_to_delivery = self._distance(pickup, delivery)
+        same_slot = to_pickup + pickup_to_delivery
+        add_pickup = to_pickup
+        add_delivery = to_delivery
+        pickup_to_next = np.zeros(n + 1)
+        delivery_to_next = np.zeros(n + 1)
+        if n:
+            following = locations[1:]
+            edges = self._pairs(locations[:-1], following)
+            pickup_to_next[:n] = self._pairs(np.full(n, pickup), following)
+            delivery_to_next[:n] = self._pairs(np.full(n, delivery), following)
+            from_delivery = delivery_to_next[:n] - edges
+            add_pickup = to_pickup.copy()
+            add_pickup[:n] += pickup_to_next[:n] - edges
+            add_delivery = to_delivery.copy()
+            add_delivery[:n] += from_delivery
+            same_slot[:n] += from_delivery
+
+        costs = add_pickup[:, None] + add_delivery[None, :]
+        np.fill_diagonal(costs, same_slot)
+
+        # The trip's weight is carried after every location from slot i to slot j
+        loads = np.zeros(n + 1)
+        if n:
+            np.cumsum(self._stop_weights[route], out=loads[1:])
+        overloaded = np.concatenate(([0], np.cumsum(loads + weight > problem.capacities[v] + EPSILON)))
+        pickup_slots, delivery_slots = np.triu_indices(n + 1)
+        slot_costs = costs[pickup_slots, delivery_slots]
+        keep = (overloaded[delivery_slots + 1] == overloaded[pickup_slots]) & (slot_costs < bound - EPSILON)
+
+        if self._timed and keep.any():
+            schedule = (
+                self._schedules[v] if route is self.routes[v] else self._schedule(v, route, locations)
+            )
+            speed = problem.average_speed
+            keep &= schedule.insertion_feasible(
+                pickup_slots,
+                delivery_slots,
+                to_pickup / speed,
+                pickup_to_next / speed,
+                to_delivery / speed,
+                delivery_to_next / speed,
+                pickup_to_delivery / speed,
+                problem.ready_times[trip],
+                problem.service_times[trip],
+                problem.due_times[trip]
+            )
+
+        if not keep.any():
+            return None
+        k = int(np.flatnonzero(keep)[np.argmin(slot_costs[keep])])
+        return float(slot_costs[k]), int(pickup_slots[k]), int(delivery_slots[k])
+
+    def _allowed_routes(self, trip: int) -> np.ndarray:
+        """Available vehicles the trip may be assigned to."""
+        allowed = (
+            np.arange(self.problem.vehicle_count)
+            if self.candidates is None or trip >= len(self.candidates) else self.candidates[trip]
+        )
+        return allowed[self.available[allowed]]
+
+    def _candidate_routes(self, trip: int) -> np.ndarray:
+        """Allowed vehicles for a trip, nearest routes first, capped at neighbor_routes."""
+        allowed = self._allowed_routes(trip)
+        if len(allowed) <= self.neighbor_routes:
+            return allowed
+
+        # Proximity of a route is the distance from the pickup to its closest stop
+        nodes = [self._route_locations[v] for v in allowed]
+        offsets = np.cumsum([0] + [len(n) for n in nodes[:-1]])
+        nodes = np.concatenate(nodes)
+        distances = self._pairs(nodes, np.full(len(nodes), self.problem.pickups[trip]))
+        nearest = np.minimum.reduceat(distances, offsets)
+        return allowed[np.argsort(nearest, kind="stable")[:self.neighbor_routes]]
+
+    def _insert_cheapest(self, trip: int, vehicles: np.ndarray) -> bool:
+        best = None
+        best_cost = float("inf")
+        for v in vehicles:
+            found = self.best_insertion(v, self.routes[v], trip, bound=best_cost)
+            if found is not None and found[0] < best_cost:
+                best, best_cost = (v, found[1], found[2]), found[0]
+
+        if best is None:
+            return False
+        v, i, j = best
+        self._set_route(v, self._inserted(self.routes[v], trip, i, j))
+        return True
+
+    def _append_cheapest(self, trip: int, vehicles: np.ndarray) -> bool:
+        """Add the trip's pickup and delivery at the end of the route where that adds least distance."""
+        problem = self.problem
+        vehicles = vehicles[problem.capacities[vehicles] + EPSILON >= problem.weights[trip]]
+        if len(vehicles) == 0:
+            return False
+
+        # Routes are open ended and unload completely, so only the end of each matters
+        pickup, delivery = problem.pickups[trip], problem.deliveries[trip]
+        ends = np.array([self._route_locations[v][-1] for v in vehicles], dtype=np.intp)
+        costs = self._pairs(ends, np.full(len(ends), pickup)).astype(np.float64)
+        if self._timed:
+            speed = problem.average_speed
+            left = np.array([self._schedules[v].completion for v in vehicles])
+            start = np.maximum(left + costs / speed, problem.ready_times[trip])
+            delivered = start + problem.service_times[trip] + self._distance(pickup, delivery) / speed
+            costs[delivered > problem.due_times[trip] + EPSILON] = np.inf
+
+        k = int(np.argmin(costs))
+        if not np.isfinite(costs[k]):
+            return False
+        v = vehicles[k]
+        self._set_route(v, self.routes[v] + [2 * trip, 2 * trip + 1])
+        return True
+
+    def construct(self, order: Sequence[int], timed: bool = False):
+        """Cheapest feasible insertion of each trip's pickup/delivery pair.
+
+        When timed and past the deadline, trips are appended to the cheapest
+        route end instead; only those that fit no route end are searched.
+        """
+        for trip in order:
+            if timed and self._out_of_time() and self._append_cheapest(trip, self._allowed_routes(trip)):
+                continue
+            nearby = self._candidate_routes(trip)
+            if self._insert_cheapest(trip, nearby):
+                continue
+
+            allowed = self._allowed_routes(trip)
+            if len(allowed) > len(nearby) and self._insert_cheapest(trip, allowed):
+                continue
+
+            self.unassigned.append(trip)
+
+    # Changes to a solved instance
+
+    def extend(self, problem: RoutingProblem):
+        """Continue on a problem with trips appended or vehicles changed, keeping the routes.
+
+        Existing trips keep their indices. New trips are not on any route
+        until inserted with insert().
+        """
+        added = problem.trip_count - self.problem.trip_count
+        was_timed = self._timed
+        self.problem = problem
+        self._index_stops()
+        self._vehicle_of = np.concatenate((self._vehicle_of, np.full(added, -1, dtype=np.intp)))
+        if self._timed and not was_timed:
+            for v, route in enumerate(self.routes):
+                self._schedules[v] = self._schedule(v, route, self._route_locations[v])
+
+    def remove(self, trip: int) -> int:
+        """Take a trip off its route or the unassigned list; returns its former vehicle or -1."""
+        v = int(self._vehicle_of[trip])
+        if v >= 0:
+            self._set_route(v, [stop for stop in self.routes[v] if stop >> 1 != trip])
+            self._vehicle_of[trip] = -1
+        elif trip in self.unassigned:
+            self.unassigned.remove(trip)
+        return v
+
+    def reroute(self, v: int) -> List[int]:
+        """Recompute route v after its vehicle's location changed.
+
+        Trips whose deliveries would now be late are taken off the route, in
+        route order until the rest is on time, and returned.
+        """
+        self._set_route(v, self.routes[v])
+        displaced = []
+        while self._timed and not self._schedules[v].feasible:
+            late = int(np.argmax(self._schedules[v].slack < -EPSILON))
+            trip = self.routes[v][late - 1] >> 1
+            self.remove(trip)
+            displaced.append(trip)
+        return displaced
+
+    def disable(self, v: int) -> List[int]:
+        """Stop using vehicle v; returns the trips that were on its route."""
+        self.available[v] = False
+        displaced = [stop >> 1 for stop in self.routes[v] if not stop & 1]
+        self._set_route(v, [])
+        self._vehicle_of[displaced] = -1
+        return displaced
+
+    def insert(self, trips: Sequence[int], time_budget: float = 0.0, freed: Sequence[int] = ()) -> List[int]:
+        """Insert trips at their cheapest feasible positions, then improve the routes they joined.
+
+        Trips left unassigned earlier are retried only on the freed vehicles,
+        whose routes lost stops or moved, and only while time_budget lasts,
+        so a change stays cheap however many trips are waiting. Returns the
+        vehicles whose routes changed.
+        """
+        self._deadline = time.perf_counter() + time_budget
+        retry, self.unassigned = self.unassigned, []
+        self.construct(trips)
+        placed = list(trips)
+
+        freed = np.array(sorted(set(freed) - {-1}), dtype=np.intp)
+        new = set(placed)
+        for trip in retry:
+            if trip in new:
+                continue
+            vehicles = self._allowed_routes(trip)
+            vehicles = vehicles[np.isin(vehicles, freed)]
+            if len(vehicles) and not self._out_of_time() and self._insert_cheapest(trip, vehicles):
+                placed.append(trip)
+            else:
+                self.unassigned.append(trip)
+
+        touched = sorted({int(self._vehicle_of[t]) for t in placed} - {-1})
+        for v in touched:
+            while not self._out_of_time() and (self._two_opt(v) or self._or_opt(v)):
+                pass
+        return touched
+
+    # Local search
+
+    def improve(self):
+        """Apply improving moves until none is left or the time budget runs out."""
+        if self.problem.trip_count == 0 or self._out_of_time():
+            return
+
+        neighbors = self._neighbor_trips()
+        improved = True
+        while improved and not self._out_of_time():
+            improved = False
+            for v in range(self.problem.vehicle_count):
+                while not self._out_of_time() and (self._two_opt(v) or self._or_opt(v)):
+                    improved = True
+            improved |= self._relocate_pass()
+            improved |= self._exchange_pass(neighbors)
+
+    def _neighbor_trips(self) -> np.ndarray:
+        coordinates = self.problem.distance_matrix.coordinates[self.problem.pickups]
+        k = min(self.neighbor_trips + 1, self.problem.trip_count)
+        return SpatialIndex(coordinates).nearest(coordinates, k)
+
+    def _two_opt(self, v: int) -> bool:
+        """Reverse one segment of the route if that shortens it."""
+        route = self.routes[v]
+        n = len(route)
+        locations = self._route_locations[v]
+        d = self._distance
+
+        for i in range(1, n):
+            segment = set()
+            reversed_delta = 0.0
+            for j in range(i, n + 1):
+                stop = route[j - 1]
+                if stop & 1 and (stop ^ 1) in segment:
+                    # Reversal would put this delivery before its pickup
+                    break
+                segment.add(stop)
+                if j == i:
+                    continue
+
+                reversed_delta += d(locations[j], locations[j - 1]) - d(locations[j - 1], locations[j])
+                delta = d(locations[i - 1], locations[j]) - d(locations[i - 1], locations[i]) + reversed_delta
+                if j < n:
+                    delta += d(locations[i], locations[j + 1]) - d(locations[j], locations[j + 1])
+
+                if delta < -EPSILON:
+                    candidate = route[:i - 1] + route[i - 1:j][::-1] + route[j:]
+                    if self.is_feasible(v, candidate):
+                        self._set_route(v, candidate)
+                        return True
+
+        return False
+
+    def _or_opt(self, v: int, max_segment: int = 3) -> bool:
+        """Move a run of up to max_segment consecutive stops elsewhere in the route."""
+        route = self.routes[v]
+        n = len(route)
+        locations = self._route_locations[v]
+        d = self._distance
+
+        for length in range(1, max_segment + 1):
+            for a in range(0, n - length + 1):
+                first, last = locations[a + 1], locations[a + length]
+                removal_gain = d(locations[a], first)
+                if a + length < n:
+                    following = locations[a + length + 1]
+                    removal_gain += d(last, following) - d(locations[a], following)
+
+                reduced = route[:a] + route[a + length:]
+                reduced_locations = np.concatenate((locations[:a + 1], locations[a + length + 1:]))
+                m = len(reduced)
+                insert_cost = self._pairs(reduced_locations, np.full(m + 1, first)).astype(np.float64)
+                if m:
+                    after = reduced_locations[1:]
+                    insert_cost[:m] += self._pairs(np.full(m, last), after) - self._pairs(reduced_locations[:-1], after)
+                deltas = insert_cost - removal_gain
+                deltas[a] = np.inf  # original position
+
+                for b in np.argsort(deltas, kind="stable"):
+                    if deltas[b] >= -EPSILON:
+                        break
+                    candidate = reduced[:b] + route[a:a + length] + reduced[b:]
+                    if self.is_feasible(v, candidate):
+                        self._set_route(v, candidate)
+                        return True
+
+        return False
+
+    def _without_trip(self, v: int, trip: int) -> Tuple[List[int], float]:
+        """Route v with trip removed, and the distance that saves."""
+        route = [stop for stop in self.routes[v] if stop >> 1 != trip]
+        return route, self._costs[v] - self._route_cost(self._locations(v, route))
+
+    def _relocate_pass(self) -> bool:
+        """Move single trips to the cheapest feasible position in any nearby route."""
+        improved = False
+        for trip in range(self.problem.trip_count):
+            if self._out_of_time():
+                break
+            v = self._vehicle_of[trip]
+            if v < 0:
+                continue
+
+            reduced, gain = self._without_trip(v, trip)
+            best = None
+            bound = gain
+            for u in self._candidate_routes(trip):
+                base = reduced if u == v else self.routes[u]
+                found = self.best_insertion(u, base, trip, bound=bound)
+                if found is not None:
+                    best, bound = (u, base, found[1], found[2]), found[0]
+
+            if best is not None:
+                u, base, i, j = best
+                if u != v:
+                    self._set_route(v, reduced)
+                self._set_route(u, self._inserted(base, trip, i, j))
+                improved = True
+
+        return improved
+
+    def _exchange_pass(self, neighbors: np.ndarray) -> bool:
+        """Swap pairs of nearby trips that sit on different routes."""
+        improved = False
+        for a in range(self.problem.trip_count):
+            if self._out_of_time():
+                break
+            for b in neighbors[a]:
+                va, vb = self._vehicle_of[a], self._vehicle_of[b]
+                if va < 0 or vb < 0 or va == vb:
+                    continue
+
+                reduced_a, gain_a = self._without_trip(va, a)
+                reduced_b, gain_b = self._without_trip(vb, b)
+                gain = gain_a + gain_b
+                into_a = self.best_insertion(va, reduced_a, b, bound=gain)
+                if into_a is None:
+                    continue
+                into_b = self.best_insertion(vb, reduced_b, a, bound=gain - into_a[0])
+                if into_b is None:
+                    continue
+
+                self._set_route(va, self._inserted(reduced_a, b, into_a[1], into_a[2]))
+                self._set_route(vb, self._inserted(reduced_b, a, into_b[1], into_b[2]))
+                improved = True
+
+        return improved
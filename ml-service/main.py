@@ -0,0 +1,6 @@
+# ASGI entry point: uvicorn main:app
+from route_optimizer import app
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,240 @@
+"""Service metrics in the Prometheus text format, and per-request timing traces.
+
+Counters, gauges and histograms live in one process-wide registry and are
+safe to update from solver threads. While a Trace is active (see tracing),
+stage timings and counter increments of that request are also added to it.
+"""
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+REDIS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+
+_current_trace: contextvars.ContextVar = contextvars.ContextVar("trace", default=None)
+
+
+class Trace:
+    """Timing breakdown of one request: seconds and calls per stage, and counter increments."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self.counts: Dict[str, float] = {}
+
+    def add(self, stage: str, seconds: float):
+        entry = self.stages.setdefault(stage, {"seconds": 0.0, "calls": 0})
+        entry["seconds"] += seconds
+        entry["calls"] += 1
+
+    def count(self, name: str, amount: float):
+        self.counts[name] = self.counts.get(name, 0) + amount
+
+    def to_dict(self) -> Dict:
+        return {
+            "total_seconds": time.perf_counter() - self.started,
+            "stages": self.stages,
+            "counts": self.counts,
+        }
+
+
+@contextmanager
+def tracing(trace: Optional[Trace]):
+    """Make trace the active trace for this context; None traces nothing."""
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+def _sample_name(name: str, labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return name
+    escaped = (
+        (key, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels
+    )
+    return name + "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[Tuple[str, str], ...], object] = {}
+
+    def _labels(self, labels: Dict[str, str]) -> Tuple[Tuple[str, str], ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple((key, str(labels[key])) for key in self.labelnames)
+
+    def samples(self) -> List[Tuple[str, float]]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(f"{sample} {_format_value(value)}" for sample, value in self.samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels: str):
+        key = self._labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.count(_sample_name(self.name, key), amount)
+
+    def samples(self) -> List[Tuple[str, float]]:
+        with self._lock:
+            return [(_sample_name(self.name, key), value) for key, value in self._values.items()]
+
+
+class Gauge(_Metric):
+    """A value that goes up and down; set it, or read it from a function at render time."""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float, **labels: str):
+        key = self._labels(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, function: Callable[[], float]):
+        self._function = function
+
+    def samples(self) -> List[Tuple[str, float]]:
+        if self._function is not None:
+            return [(self.name, self._function())]
+        with self._lock:
+            return [(_sample_name(self.name, key), value) for key, value in self._values.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = STAGE_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value: float, **labels: str):
+        key = self._labels(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # Per-bucket counts, then sum
+                counts = self._values[key] = [0] * len(self.buckets) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, trace_stage: Optional[str] = None, **labels: str):
+        """Observe the seconds the block takes; with trace_stage, also add them to the active trace."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.observe(elapsed, **labels)
+            trace = _current_trace.get()
+            if trace_stage is not None and trace is not None:
+                trace.add(trace_stage, elapsed)
+
+    def samples(self) -> List[Tuple[str, float]]:
+        samples = []
+        with self._lock:
+            items = [(key, list(counts)) for key, counts in self._values.items()]
+        for key, counts in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                samples.append((
+                    _sample_name(f"{self.name}_bucket", key + (("le", _format_value(bound)),)),
+                    cumulative
+                ))
+            samples.append((_sample_name(f"{self.name}_sum", key), counts[-1]))
+            samples.append((_sample_name(f"{self.name}_count", key), cumulative))
+        return samples
+
+
+class Registry:
+    """The metrics a process exposes, rendered together."""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "route_optimizer_stage_seconds", "Time spent in each optimization pipeline stage.", ["stage"]
+))
+REDIS_SECONDS = REGISTRY.register(Histogram(
+    "route_optimizer_redis_seconds", "Redis round trip time by command.", ["command"], REDIS_BUCKETS
+))
+REDIS_ERRORS = REGISTRY.register(Counter(
+    "route_optimizer_redis_errors_total", "Redis calls that failed and fell back to the local cache.",
+    ["command"]
+))
+CACHE_LOOKUPS = REGISTRY.register(Counter(
+    "route_optimizer_cache_lookups_total", "Cache lookups by cache and outcome (hit or miss).",
+    ["cache", "outcome"]
+))
+PREDICT_CALLS = REGISTRY.register(Counter(
+    "route_optimizer_predict_calls_total", "Efficiency model predict calls."
+))
+PREDICT_ROWS = REGISTRY.register(Counter(
+    "route_optimizer_predict_rows_total", "Candidate rows scored by the efficiency model."
+))
+DISTANCE_PAIRS = REGISTRY.register(Counter(
+    "route_optimizer_distance_pairs_computed_total", "Location pair distances computed."
+))
+OPTIMIZATIONS = REGISTRY.register(Counter(
+    "route_optimizer_optimizations_total", "Optimizations run, by strategy.", ["strategy"]
+))
+QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "route_optimizer_queue_depth", "Optimizations running or waiting for a solver slot."
+))
+SESSIONS = REGISTRY.register(Gauge(
+    "route_optimizer_sessions", "Planning sessions held in memory."
+))
+
+
+def stage(name: str):
+    """Time a pipeline stage into STAGE_SECONDS and the active trace."""
+    return STAGE_SECONDS.time(trace_stage=name, stage=name)
@@ -0,0 +1,278 @@
+import asyncio
+import numpy as np
+from collections import namedtuple
+from concurrent.futures import Executor
+from dataclasses import dataclass, replace
+from multiprocessing import shared_memory
+from typing import Awaitable, Callable, List, Optional, Sequence, Tuple
+
+from distance_engine import DistanceMatrix, LazyDistanceOracle, pairwise_distances
+from local_search import LocalSearchSolver, RoutingProblem
+
+Point = namedtuple("Point", ["latitude", "longitude"])
+
+# Share of the time budget given to the cross-cluster repair pass
+REPAIR_BUDGET_FRACTION = 0.25
+
+
+@dataclass
+class SharedArraySpec:
+    """Picklable handle to a NumPy array stored in a shared memory segment."""
+    name: str
+    shape: Tuple[int, ...]
+    dtype: str
+
+
+def share_array(array: np.ndarray) -> Tuple[shared_memory.SharedMemory, SharedArraySpec]:
+    """Copy an array into a new shared memory segment owned by the caller."""
+    segment = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    view = np.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf)
+    view[...] = array
+    return segment, SharedArraySpec(segment.name, array.shape, array.dtype.str)
+
+
+def attach_array(spec: SharedArraySpec) -> Tuple[shared_memory.SharedMemory, np.ndarray]:
+    """Map a shared array created by the parent process.
+
+    Pool workers share the parent's resource tracker, so attaching does not
+    change who unlinks the segment.
+    """
+    segment = shared_memory.SharedMemory(name=spec.name)
+    return segment, np.ndarray(spec.shape, dtype=spec.dtype, buffer=segment.buf)
+
+
+class SharedDistanceMatrix(DistanceMatrix):
+    """DistanceMatrix over coordinate and matrix arrays mapped from shared memory.
+
+    Workers only address locations by index, so no location lookup is kept.
+    """
+
+    def __init__(self, coordinates: np.ndarray, matrix: np.ndarray, method: str):
+        self.index = {}
+        self.coordinates = coordinates
+        self.matrix = matrix
+        self.method = method
+        self.computed_pairs = 0
+
+    def __len__(self) -> int:
+        return len(self.coordinates)
+
+
+@dataclass
+class SharedDistances:
+    """Distance data published to worker processes.
+
+    Dense matrices are shared as-is. For lazy oracles only the coordinates are
+    shared and each worker computes the pairs it needs.
+    """
+    method: str
+    coordinates: SharedArraySpec
+    matrix: Optional[SharedArraySpec] = None
+
+    @classmethod
+    def publish(cls, oracle) -> Tuple["SharedDistances", List[shared_memory.SharedMemory]]:
+        segment, coordinates = share_array(oracle.coordinates)
+        segments = [segment]
+        matrix = None
+        if isinstance(oracle, DistanceMatrix):
+            segment, matrix = share_array(oracle.matrix)
+            segments.append(segment)
+        return cls(oracle.method, coordinates, matrix), segments
+
+    def open(self):
+        """Attach in a worker; returns the oracle and the segments to close after use."""
+        segment, coordinates = attach_array(self.coordinates)
+        segments = [segment]
+        if self.matrix is None:
+            oracle = LazyDistanceOracle(
+                (Point(lat, lng) for lat, lng in coordinates), method=self.method
+            )
+            return oracle, segments
+
+        segment, matrix = attach_array(self.matrix)
+        segments.append(segment)
+        return SharedDistanceMatrix(coordinates, matrix, self.method), segments
+
+
+@dataclass
+class SolveTask:
+    """One LocalSearchSolver run in a worker; problem.distance_matrix is left unset."""
+    distances: SharedDistances
+    problem: RoutingProblem
+    order: List[int]
+    time_budget: float
+    initial_routes: Optional[List[List[int]]] = None
+
+
+def _solve(task: SolveTask, oracle) -> Tuple[List[List[int]], List[int]]:
+    solver = LocalSearchSolver(
+        replace(task.problem, distance_matrix=oracle), time_budget=task.time_budget
+    )
+    routes = solver.solve(task.order, task.initial_routes)
+    return routes, solver.unassigned
+
+
+def run_solve_task(task: SolveTask) -> Tuple[List[List[int]], List[int]]:
+    """Worker entry point: solve one task against the shared distance data."""
+    oracle, segments = task.distances.open()
+    try:
+        return _solve(task, oracle)
+    finally:
+        # Views into the segments must be released before they can be closed
+        del oracle
+        for segment in segments:
+            segment.close()
+
+
+def partition(
+    vehicle_coordinates: np.ndarray,
+    pickup_coordinates: np.ndarray,
+    n_clusters: int,
+    seed: int = 0
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Cluster labels for vehicles and trips.
+
+    Trips are clustered by k-means on pickup coordinates. Each cluster gets a
+    share of the fleet proportional to its trip count, filled with the
+    vehicles nearest to its centre. Clusters that end up with no vehicle hand
+    their trips to the nearest cluster that has one.
+    """
+    from sklearn.cluster import KMeans
+
+    n_clusters = max(1, min(n_clusters, len(pickup_coordinates), len(vehicle_coordinates)))
+    kmeans = KMeans(n_clusters=n_clusters, n_init=3, random_state=seed).fit(pickup_coordinates)
+    centres = kmeans.cluster_centers_
+    trip_labels = kmeans.labels_.astype(np.intp)
+
+    # Largest-remainder split of the fleet by trip count
+    share = np.bincount(trip_labels, minlength=n_clusters) * len(vehicle_coordinates) / len(trip_labels)
+    quota = np.floor(share).astype(np.intp)
+    for c in np.argsort(quota - share, kind="stable")[:len(vehicle_coordinates) - quota.sum()]:
+        quota[c] += 1
+
+    vehicle_labels = np.full(len(vehicle_coordinates), -1, dtype=np.intp)
+    distances = pairwise_distances(vehicle_coordinates, centres)
+    for flat in np.argsort(distances, axis=None, kind="stable"):
+        v, c = divmod(int(flat), n_clusters)
+        if vehicle_labels[v] < 0 and quota[c] > 0:
+            vehicle_labels[v] = c
+            quota[c] -= 1
+
+    leftover = vehicle_labels < 0
+    vehicle_labels[leftover] = np.argmin(distances[leftover], axis=1)
+
+    staffed = np.unique(vehicle_labels)
+    centre_distances = pairwise_distances(centres, centres[staffed])
+    trip_labels = staffed[np.argmin(centre_distances, axis=1)][trip_labels]
+
+    return vehicle_labels, trip_labels
+
+
+def _subproblem(problem: RoutingProblem, vehicles: np.ndarray, trips: np.ndarray) -> RoutingProblem:
+    return replace(
+        problem,
+        distance_matrix=None,
+        vehicle_locations=problem.vehicle_locations[vehicles],
+        capacities=problem.capacities[vehicles],
+        pickups=problem.pickups[trips],
+        deliveries=problem.deliveries[trips],
+        weights=problem.weights[trips],
+        ready_times=problem.ready_times[trips],
+        due_times=problem.due_times[trips],
+        service_times=problem.service_times[trips],
+    )
+
+
+async def solve_clustered(
+    executor: Executor,
+    problem: RoutingProblem,
+    order: Sequence[int],
+    time_budget: float,
+    n_clusters: int,
+    on_final: Optional[Callable[[np.ndarray, List[List[int]]], Awaitable[None]]] = None
+) -> Tuple[List[List[int]], List[int]]:
+    """Solve geographic clusters in parallel worker processes, then repair across them.
+
+    Returns stop routes per vehicle and unassigned trips, both in the global
+    numbering of problem. The event loop only awaits worker futures.
+
+    With on_final, a cluster that places all its trips is final as soon as
+    it is solved: on_final is awaited with its vehicles and their stop
+    routes, and only the other clusters are repaired, together.
+    """
+    loop = asyncio.get_running_loop()
+    coordinates = problem.distance_matrix.coordinates
+    vehicle_labels, trip_labels = await loop.run_in_executor(
+        executor, partition,
+        coordinates[problem.vehicle_locations], coordinates[problem.pickups],
+        n_clusters
+    )
+
+    shared, segments = SharedDistances.publish(problem.distance_matrix)
+    try:
+        clusters = []
+        order = np.asarray(order, dtype=np.intp)
+        for c in np.unique(vehicle_labels):
+            vehicles = np.flatnonzero(vehicle_labels == c)
+            trips = np.flatnonzero(trip_labels == c)
+            local_trip = np.full(problem.trip_count, -1, dtype=np.intp)
+            local_trip[trips] = np.arange(len(trips))
+            cluster_order = local_trip[order[trip_labels[order] == c]]
+            clusters.append((vehicles, trips, SolveTask(
+                shared, _subproblem(problem, vehicles, trips),
+                cluster_order.tolist(), time_budget
+            )))
+
+        futures = {
+            loop.run_in_executor(executor, run_solve_task, task): c
+            for c, (_, _, task) in enumerate(clusters)
+        }
+
+        # Map cluster-local stops back to global trip numbering
+        routes: List[List[int]] = [[] for _ in range(problem.vehicle_count)]
+        unassigned = set()
+        open_clusters = []
+        while futures:
+            done, _ = await asyncio.wait(futures, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                c = futures.pop(future)
+                vehicles, trips, _ = clusters[c]
+                cluster_routes, cluster_unassigned = future.result()
+                for v, stops in zip(vehicles, cluster_routes):
+                    routes[v] = [2 * int(trips[stop >> 1]) + (stop & 1) for stop in stops]
+                unassigned.update(int(trips[k]) for k in cluster_unassigned)
+                if on_final is not None and not cluster_unassigned:
+                    await on_final(vehicles, [routes[v] for v in vehicles])
+                else:
+                    open_clusters.append(c)
+
+        if on_final is None:
+            # Cross-cluster repair: place leftovers anywhere and improve across borders
+            repair = SolveTask(
+                shared, replace(problem, distance_matrix=None),
+                [k for k in order.tolist() if k in unassigned],
+                time_budget * REPAIR_BUDGET_FRACTION, routes
+            )
+            return await loop.run_in_executor(executor, run_solve_task, repair)
+        if not open_clusters:
+            return routes, []
+
+        # Repair only across the clusters that left trips over; the others are already sent
+        vehicles = np.sort(np.concatenate([clusters[c][0] for c in open_clusters]))
+        trips = np.sort(np.concatenate([clusters[c][1] for c in open_clusters]))
+        local_trip = np.full(problem.trip_count, -1, dtype=np.intp)
+        local_trip[trips] = np.arange(len(trips))
+        repair = SolveTask(
+            shared, _subproblem(problem, vehicles, trips),
+            [int(local_trip[k]) for k in order.tolist() if k in unassigned],
+            time_budget * REPAIR_BUDGET_FRACTION,
+            [[2 * int(local_trip[stop >> 1]) + (stop & 1) for stop in routes[v]] for v in vehicles]
+        )
+        repaired_routes, repaired_unassigned = await loop.run_in_executor(executor, run_solve_task, repair)
+        for v, stops in zip(vehicles, repaired_routes):
+            routes[v] = [2 * int(trips[stop >> 1]) + (stop & 1) for stop in stops]
+        return routes, [int(trips[k]) for k in repaired_unassigned]
+    finally:
+        for segment in segments:
+            segment.close()
+            segment.unlink()
@@ -0,0 +1,164 @@
+import hashlib
+import json
+import zlib
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from cache_store import CacheStore
+from columnar import TripColumns, trip_ids
+from metrics import CACHE_LOOKUPS
+
+RESULT_KEY_PREFIX = "optimization:result:"
+# Five decimals is about 1 m, so re-submissions that only jitter GPS share a key
+COORDINATE_DECIMALS = 5
+
+
+def _point(location) -> List[float]:
+    return [
+        round(location.latitude, COORDINATE_DECIMALS),
+        round(location.longitude, COORDINATE_DECIMALS),
+    ]
+
+
+def traffic_bucket(traffic_data: Dict, now: datetime, bucket_seconds: int = 300) -> List:
+    """Coarse traffic snapshot: time slot plus rounded speed and congestion."""
+    return [
+        int(now.timestamp()) // bucket_seconds,
+        round(float(traffic_data.get("average_speed", 40))),
+        round(float(traffic_data.get("congestion_level", 0.3)), 1),
+    ]
+
+
+def _columns_digest(trips: TripColumns) -> str:
+    """Hash of array-backed trips in id order, normalized like request_fingerprint's rows."""
+    order = np.argsort(np.array(trips.ids))
+    digest = hashlib.sha256("\0".join(trips.ids[k] for k in order).encode())
+    for column in (
+        np.round(trips.pickups[order], COORDINATE_DECIMALS),
+        np.round(trips.deliveries[order], COORDINATE_DECIMALS),
+        np.round(trips.weights[order], 3),
+        trips.priorities[order],
+        trips.ready_times[order],
+        trips.due_times[order],
+        np.round(trips.service_times[order], 3),
+    ):
+        digest.update(np.ascontiguousarray(column).tobytes())
+    return digest.hexdigest()
+
+
+def request_fingerprint(
+    vehicles: Sequence,
+    trips: Sequence,
+    strategy: str,
+    bucket: List,
+    options: Optional[Dict] = None
+) -> str:
+    """Stable hash of a normalized optimization request.
+
+    Vehicles and trips are ordered by id so resubmitting the same set in
+    another order hits the same entry. options should carry everything else
+    the result depends on, such as the model stamp.
+    """
+    normalized = {
+        "strategy": strategy,
+        "traffic": bucket,
+        "options": options or {},
+        "vehicles": sorted(
+            [
+                v.id, round(v.capacity, 3), round(v.fuel_efficiency, 3),
+                _point(v.current_location), round(v.max_distance, 3), v.driver_id
+            ]
+            for v in vehicles
+        ),
+        "trips": _columns_digest(trips) if isinstance(trips, TripColumns) else sorted(
+            [
+                t.id, _point(t.pickup), _point(t.delivery), round(t.weight, 3),
+                t.priority, [str(w) for w in t.time_window], round(t.estimated_duration, 3)
+            ]
+            for t in trips
+        ),
+    }
+    payload = json.dumps(normalized, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _pickup_indices(vehicles: Sequence, trips: Sequence) -> Dict[str, int]:
+    """Index of each trip's pickup among the request's locations in fingerprint order.
+
+    Vehicle locations come first, then pickup and delivery per trip, each
+    by id, so indices survive reordering. A delivery follows its pickup.
+    """
+    return {trip_id: len(vehicles) + 2 * r for r, trip_id in enumerate(sorted(trip_ids(trips)))}
+
+
+def encode_routes(routes: Sequence, vehicles: Sequence, trips: Sequence) -> bytes:
+    """Compress routes to trip ids and waypoint indices into the request's locations."""
+    pickup_index = _pickup_indices(vehicles, trips)
+    rows = []
+    for route in routes:
+        location_index = {}
+        for trip in route.trips:
+            location_index[id(trip.pickup)] = pickup_index[trip.id]
+            location_index[id(trip.delivery)] = pickup_index[trip.id] + 1
+        rows.append([
+            route.vehicle_id,
+            [trip.id for trip in route.trips],
+            route.total_distance,
+            route.total_duration,
+            route.fuel_cost,
+            route.efficiency_score,
+            [location_index[id(loc)] for loc in route.waypoints],
+        ])
+    return zlib.compress(json.dumps(rows, separators=(",", ":")).encode())
+
+
+def decode_routes(data: bytes, vehicles: Sequence, trips: Sequence, route_type: Callable) -> List:
+    """Rebuild routes from encode_routes output against the current request.
+
+    Only the trips in the routes are looked up, so array-backed trips that
+    are left unassigned are never built.
+    """
+    ids = trip_ids(trips)
+    positions = {trip_id: k for k, trip_id in enumerate(ids)}
+    by_index = sorted(ids)
+    offset = len(vehicles)
+
+    def location(i: int):
+        trip = trips[positions[by_index[(i - offset) // 2]]]
+        return trip.delivery if (i - offset) % 2 else trip.pickup
+
+    return [
+        route_type(
+            vehicle_id=vehicle_id,
+            trips=[trips[positions[trip_id]] for trip_id in route_trip_ids],
+            total_distance=total_distance,
+            total_duration=total_duration,
+            fuel_cost=fuel_cost,
+            efficiency_score=efficiency_score,
+            waypoints=[location(i) for i in waypoints],
+        )
+        for (vehicle_id, route_trip_ids, total_distance, total_duration,
+             fuel_cost, efficiency_score, waypoints) in json.loads(zlib.decompress(data))
+    ]
+
+
+class ResultCache:
+    """Full optimization results keyed by request fingerprint.
+
+    Entries are content-addressed and never change, so the store's in-process
+    LRU is read before Redis. Redis expires entries after ttl seconds.
+    """
+
+    def __init__(self, store: CacheStore, ttl: float = 900):
+        self.store = store
+        self.ttl = ttl
+
+    async def get(self, fingerprint: str) -> Optional[bytes]:
+        data = (await self.store.get_many([RESULT_KEY_PREFIX + fingerprint], local_first=True))[0]
+        CACHE_LOOKUPS.inc(cache="result", outcome="miss" if data is None else "hit")
+        return data
+
+    async def set(self, fingerprint: str, data: bytes):
+        await self.store.set(RESULT_KEY_PREFIX + fingerprint, data, self.ttl)
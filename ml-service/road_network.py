@@ -0,0 +1,400 @@
+import heapq
+import logging
+import sys
+from typing import Dict, List, Tuple
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components, dijkstra
+
+from distance_engine import SpatialIndex, haversine_km
+from shared_data import map_npz
+
+logger = logging.getLogger(__name__)
+
+# Nodes a witness search may settle before giving up and keeping the shortcut
+WITNESS_SETTLE_LIMIT = 60
+# Meeting nodes shared by this share of source/target pairs are joined densely
+DENSE_JOIN_SHARE = 1 / 32
+# Upper bound on floats held by one batch of upward search rows
+SEARCH_BATCH_CELLS = 8_000_000
+# Largest source x target block computed at once by distance_km
+MAX_BLOCK_CELLS = 8_000_000
+# Stand-in for zero-length edges, which sparse graphs would drop
+MIN_EDGE_KM = 1e-9
+
+
+def _dedupe_edges(
+    sources: np.ndarray,
+    targets: np.ndarray,
+    lengths: np.ndarray,
+    n: int
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Drop self-loops and keep the shortest of parallel edges."""
+    keep = sources != targets
+    sources, targets, lengths = sources[keep], targets[keep], lengths[keep]
+    keys = sources.astype(np.int64) * n + targets
+    order = np.lexsort((lengths, keys))
+    first = np.r_[True, keys[order][1:] != keys[order][:-1]]
+    order = order[first]
+    return sources[order], targets[order], np.maximum(lengths[order], MIN_EDGE_KM)
+
+
+def read_graph_file(path: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Load an OSM GraphML file as (lat, lng) node coordinates and km edge arrays.
+
+    Uses osmnx when installed and plain networkx otherwise; both read the file
+    written by osmnx.save_graphml without any network access.
+    """
+    try:
+        import osmnx
+        graph = osmnx.load_graphml(path)
+    except ImportError:
+        import networkx
+        graph = networkx.read_graphml(path)
+
+    index = {node: i for i, node in enumerate(graph.nodes)}
+    coordinates = np.array(
+        [[float(data["y"]), float(data["x"])] for _, data in graph.nodes(data=True)],
+        dtype=np.float64
+    ).reshape(-1, 2)
+
+    sources, targets, lengths = [], [], []
+    for u, v, data in graph.edges(data=True):
+        sources.append(index[u])
+        targets.append(index[v])
+        lengths.append(float(data["length"]) / 1000 if "length" in data else np.nan)
+    sources = np.array(sources, dtype=np.intp)
+    targets = np.array(targets, dtype=np.intp)
+    lengths = np.array(lengths, dtype=np.float64)
+
+    # Edges without a length get the straight line between their ends
+    missing = np.isnan(lengths)
+    lengths[missing] = haversine_km(
+        coordinates[sources[missing], 0], coordinates[sources[missing], 1],
+        coordinates[targets[missing], 0], coordinates[targets[missing], 1]
+    )
+    return coordinates, sources, targets, lengths
+
+
+def largest_component(
+    coordinates: np.ndarray,
+    sources: np.ndarray,
+    targets: np.ndarray,
+    lengths: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Restrict the graph to its largest strongly connected component.
+
+    Every snapped location can then reach every other one.
+    """
+    n = len(coordinates)
+    graph = csr_matrix((np.ones(len(sources)), (sources, targets)), shape=(n, n))
+    _, labels = connected_components(graph, directed=True, connection="strong")
+    keep = labels == np.argmax(np.bincount(labels))
+    remap = np.full(n, -1, dtype=np.intp)
+    remap[keep] = np.arange(keep.sum())
+    edges = keep[sources] & keep[targets]
+    return coordinates[keep], remap[sources[edges]], remap[targets[edges]], lengths[edges]
+
+
+class _Contraction:
+    """Contracts nodes in edge-difference order into upward and downward edge lists."""
+
+    def __init__(self, n: int, sources: np.ndarray, targets: np.ndarray, lengths: np.ndarray):
+        self.out: List[Dict[int, float]] = [{} for _ in range(n)]
+        self.into: List[Dict[int, float]] = [{} for _ in range(n)]
+        for u, v, length in zip(sources.tolist(), targets.tolist(), lengths.tolist()):
+            self.out[u][v] = length
+            self.into[v][u] = length
+        self.deleted_neighbors = np.zeros(n, dtype=np.intp)
+        self.up: List[Tuple[int, int, float]] = []
+        self.down: List[Tuple[int, int, float]] = []
+
+    def _witness_distances(self, source: int, excluded: int, limit: float, targets) -> Dict[int, float]:
+        """Bounded Dijkstra from source that avoids the node being contracted."""
+        dist = {source: 0.0}
+        heap = [(0.0, source)]
+        remaining = set(targets)
+        settled = 0
+        while heap and remaining and settled < WITNESS_SETTLE_LIMIT:
+            d, u = heapq.heappop(heap)
+            if d > dist[u]:
+                continue
+            if d > limit:
+                break
+            remaining.discard(u)
+            settled += 1
+            for w, length in self.out[u].items():
+                if w == excluded:
+                    continue
+                nd = d + length
+                if nd < dist.get(w, np.inf):
+                    dist[w] = nd
+                    heapq.heappush(heap, (nd, w))
+        return dist
+
+    def shortcuts(self, v: int) -> List[Tuple[int, int, float]]:
+        """Shortcuts needed to keep shortest paths through v once it is removed."""
+        needed = []
+        for u, to_v in self.into[v].items():
+            via = {w: to_v + from_v for w, from_v in self.out[v].items() if w != u}
+            if not via:
+                continue
+            dist = self._witness_distances(u, v, max(via.values()), via)
+            needed.extend(
+                (u, w, length) for w, length in via.items() if dist.get(w, np.inf) > length
+            )
+        return needed
+
+    def priority(self, v: int) -> int:
+        return (
+            len(self.shortcuts(v)) - len(self.into[v]) - len(self.out[v])
+            + int(self.deleted_neighbors[v])
+        )
+
+    def contract(self, v: int):
+        shortcuts = self.shortcuts(v)
+        for w, length in self.out[v].items():
+            self.up.append((v, w, length))
+            del self.into[w][v]
+            self.deleted_neighbors[w] += 1
+        for u, length in self.into[v].items():
+            # Reverse of u -> v, so backward searches also only climb
+            self.down.append((v, u, length))
+            del self.out[u][v]
+            self.deleted_neighbors[u] += 1
+        self.out[v] = {}
+        self.into[v] = {}
+        for u, w, length in shortcuts:
+            if length < self.out[u].get(w, np.inf):
+                self.out[u][w] = length
+                self.into[w][u] = length
+
+    def run(self) -> np.ndarray:
+        """Contract every node; returns each node's rank."""
+        n = len(self.out)
+        rank = np.full(n, -1, dtype=np.intp)
+        heap = [(self.priority(v), v) for v in range(n)]
+        heapq.heapify(heap)
+        order = 0
+        while heap:
+            _, v = heapq.heappop(heap)
+            if rank[v] >= 0:
+                continue
+            # Lazy update: re-queue when the priority has gone stale
+            current = self.priority(v)
+            if heap and current > heap[0][0]:
+                heapq.heappush(heap, (current, v))
+                continue
+            self.contract(v)
+            rank[v] = order
+            order += 1
+            if order % 10000 == 0:
+                logger.info(f"Contracted {order}/{n} nodes")
+        return rank
+
+
+def _edge_matrix(edges: List[Tuple[int, int, float]], n: int) -> csr_matrix:
+    if not edges:
+        return csr_matrix((n, n))
+    sources, targets, lengths = (np.array(column) for column in zip(*edges))
+    sources, targets, lengths = _dedupe_edges(
+        sources.astype(np.intp), targets.astype(np.intp), lengths.astype(np.float64), n
+    )
+    return csr_matrix((lengths, (sources, targets)), shape=(n, n))
+
+
+class RoadNetwork:
+    """Road distances in km from a contraction hierarchy over an offline OSM graph.
+
+    Locations snap to their nearest graph node through a ball tree. A distance
+    is the straight-line access leg to the snapped node, plus the network path,
+    plus the leg from the destination's node. Queries run upward Dijkstra
+    searches from every source and target over the hierarchy, then take the
+    best meeting node per pair.
+    """
+
+    def __init__(self, coordinates: np.ndarray, upward: csr_matrix, downward: csr_matrix):
+        self.coordinates = coordinates
+        self.upward = upward
+        self.downward = downward
+        self._spatial_index = SpatialIndex(coordinates)
+
+    def __len__(self) -> int:
+        return len(self.coordinates)
+
+    @classmethod
+    def from_graph_file(cls, path: str) -> "RoadNetwork":
+        """Build the hierarchy from GraphML. Slow for city-sized graphs; see save()."""
+        coordinates, sources, targets, lengths = largest_component(*read_graph_file(path))
+        n = len(coordinates)
+        sources, targets, lengths = _dedupe_edges(sources, targets, lengths, n)
+        logger.info(f"Contracting road graph with {n} nodes and {len(sources)} edges")
+        contraction = _Contraction(n, sources, targets, lengths)
+        contraction.run()
+        return cls(coordinates, _edge_matrix(contraction.up, n), _edge_matrix(contraction.down, n))
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = False) -> "RoadNetwork":
+        """Load a hierarchy saved with save(), or build one from a GraphML file.
+
+        With mmap a saved hierarchy's arrays are mapped read-only, so worker
+        processes share one copy.
+        """
+        if not path.endswith(".npz"):
+            return cls.from_graph_file(path)
+        if mmap:
+            return cls._from_arrays(map_npz(path))
+        with np.load(path) as data:
+            return cls._from_arrays(data)
+
+    @classmethod
+    def _from_arrays(cls, data) -> "RoadNetwork":
+        n = len(data["coordinates"])
+        matrices = [
+            csr_matrix(
+                (data[f"{name}_data"], data[f"{name}_indices"], data[f"{name}_indptr"]),
+                shape=(n, n)
+            )
+            for name in ("upward", "downward")
+        ]
+        return cls(data["coordinates"], *matrices)
+
+    def save(self, path: str):
+        np.savez(
+            path,
+            coordinates=self.coordinates,
+            upward_data=self.upward.data,
+            upward_indices=self.upward.indices,
+            upward_indptr=self.upward.indptr,
+            downward_data=self.downward.data,
+            downward_indices=self.downward.indices,
+            downward_indptr=self.downward.indptr,
+        )
+
+    def snap(self, points: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Nearest node per (lat, lng) point and the straight-line km to it."""
+        nodes = self._spatial_index.nearest(points, 1)[:, 0]
+        access = haversine_km(
+            points[:, 0], points[:, 1],
+            self.coordinates[nodes, 0], self.coordinates[nodes, 1]
+        )
+        return nodes, access
+
+    def _search_spaces(self, graph: csr_matrix, nodes: np.ndarray):
+        """Upward search space of each node as flat (row, node, km) arrays."""
+        rows, columns, values = [], [], []
+        batch = max(1, SEARCH_BATCH_CELLS // max(len(self), 1))
+        for start in range(0, len(nodes), batch):
+            dist = dijkstra(graph, directed=True, indices=nodes[start:start + batch])
+            row, column = np.nonzero(np.isfinite(dist))
+            rows.append(row + start)
+            columns.append(column)
+            values.append(dist[row, column])
+        return np.concatenate(rows), np.concatenate(columns), np.concatenate(values)
+
+    def node_matrix(self, sources: np.ndarray, targets: np.ndarray) -> np.ndarray:
+        """Network km from each source node to each target node."""
+        unique_sources, source_of = np.unique(sources, return_inverse=True)
+        unique_targets, target_of = np.unique(targets, return_inverse=True)
+        s, t, n = len(unique_sources), len(unique_targets), len(self)
+
+        f_row, f_node, f_km = self._search_spaces(self.upward, unique_sources)
+        b_row, b_node, b_km = self._search_spaces(self.downward, unique_targets)
+        f_count = np.bincount(f_node, minlength=n)
+        b_count = np.bincount(b_node, minlength=n)
+        shared = f_count * b_count
+        dense = shared >= max(1, DENSE_JOIN_SHARE * s * t)
+
+        result = np.full((s, t), np.inf, dtype=np.float32)
+
+        # Nodes near the top of the hierarchy meet most pairs: one full min each
+        column = np.full(n, -1, dtype=np.intp)
+        column[dense] = np.arange(dense.sum())
+        forward = np.full((dense.sum(), s, 1), np.inf, dtype=np.float32)
+        backward = np.full((dense.sum(), 1, t), np.inf, dtype=np.float32)
+        mask = dense[f_node]
+        forward[column[f_node[mask]], f_row[mask], 0] = f_km[mask]
+        mask = dense[b_node]
+        backward[column[b_node[mask]], 0, b_row[mask]] = b_km[mask]
+        via = np.empty_like(result)
+        for k in range(len(forward)):
+            np.add(forward[k], backward[k], out=via)
+            np.minimum(result, via, out=result)
+
+        # Remaining meeting nodes: join the sparse search space entries per node
+        mask = ~dense[f_node] & (b_count[f_node] > 0)
+        f_row, f_node, f_km = f_row[mask], f_node[mask], f_km[mask]
+        mask = ~dense[b_node] & (f_count[b_node] > 0)
+        order = np.argsort(b_node[mask], kind="stable")
+        b_row, b_node, b_km = b_row[mask][order], b_node[mask][order], b_km[mask][order]
+        if len(f_row) and len(b_row):
+            b_start = np.searchsorted(b_node, np.arange(n))
+            repeats = b_count[f_node] * ~dense[f_node]
+            f_entry = np.repeat(np.arange(len(f_row)), repeats)
+            offsets = np.arange(len(f_entry)) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+            b_entry = b_start[f_node[f_entry]] + offsets
+            pair = f_row[f_entry] * t + b_row[b_entry]
+            km = f_km[f_entry] + b_km[b_entry]
+            order = np.argsort(pair, kind="stable")
+            pair, km = pair[order], km[order]
+            starts = np.flatnonzero(np.r_[True, pair[1:] != pair[:-1]])
+            flat = result.reshape(-1)
+            flat[pair[starts]] = np.minimum(flat[pair[starts]], np.minimum.reduceat(km, starts))
+
+        return result[np.ix_(source_of, target_of)].astype(np.float64)
+
+    def matrix(self, origins: np.ndarray, destinations: np.ndarray) -> np.ndarray:
+        """Road km between every origin and destination (lat, lng) point."""
+        source_nodes, source_access = self.snap(origins)
+        target_nodes, target_access = self.snap(destinations)
+        return (
+            source_access[:, None]
+            + self.node_matrix(source_nodes, target_nodes)
+            + target_access[None, :]
+        )
+
+    def distance_km(self, lat1, lng1, lat2, lng2) -> np.ndarray:
+        """Road km, broadcasting over degree arrays like the closed-form methods."""
+        lat1, lng1, lat2, lng2 = np.broadcast_arrays(lat1, lng1, lat2, lng2)
+        shape = lat1.shape
+        origins = np.column_stack([lat1.ravel(), lng1.ravel()])
+        destinations = np.column_stack([lat2.ravel(), lng2.ravel()])
+        if len(origins) == 0:
+            return np.zeros(shape)
+
+        unique_origins, origin_of = np.unique(origins, axis=0, return_inverse=True)
+        unique_destinations, destination_of = np.unique(destinations, axis=0, return_inverse=True)
+        origin_of, destination_of = origin_of.ravel(), destination_of.ravel()
+        if len(unique_origins) * len(unique_destinations) <= MAX_BLOCK_CELLS:
+            block = self.matrix(unique_origins, unique_destinations)
+            return block[origin_of, destination_of].reshape(shape)
+
+        result = np.empty(len(origins))
+        step = int(np.sqrt(MAX_BLOCK_CELLS))
+        if len(unique_origins) * len(unique_destinations) <= len(origins) * step:
+            # Dense pairs: blocks of origin rows, so each search runs once per block
+            rows = max(1, MAX_BLOCK_CELLS // len(unique_destinations))
+            for start in range(0, len(unique_origins), rows):
+                in_block = (origin_of >= start) & (origin_of < start + rows)
+                needed, column = np.unique(destination_of[in_block], return_inverse=True)
+                block = self.matrix(unique_origins[start:start + rows], unique_destinations[needed])
+                result[in_block] = block[origin_of[in_block] - start, column.ravel()]
+            return result.reshape(shape)
+
+        # Scattered pairs: bound each block by the pairs it serves
+        for start in range(0, len(origins), step):
+            part = slice(start, start + step)
+            result[part] = self.distance_km(
+                origins[part, 0], origins[part, 1],
+                destinations[part, 0], destinations[part, 1]
+            )
+        return result.reshape(shape)
+
+
+if __name__ == "__main__":
+    # Offline preprocessing: python road_network.py city.graphml city.npz
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) != 3:
+        sys.exit("usage: python road_network.py <graph.graphml> <hierarchy.npz>")
+    RoadNetwork.from_graph_file(sys.argv[1]).save(sys.argv[2])
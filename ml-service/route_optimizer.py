@@ -1,17 +1,37 @@
 import numpy as np
-import pandas as pd
-import requests
 import asyncio
 import logging
-from typing import List, Dict, Tuple, Optional
+from typing import Annotated, Awaitable, Callable, List, Dict, Literal, Sequence, Tuple, Optional
 from dataclasses import dataclass
-from geopy.distance import geodesic
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.preprocessing import StandardScaler
-import joblib
-import redis
 from datetime import datetime, timedelta
+import contextvars
 import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pydantic import Field
+
+from cache_store import CacheStore
+from assignment import assign_in_rounds
+from columnar import TripColumns, trip_arrays, trip_ids
+from jobs import JobQueue, QueueFullError
+from metrics import (
+    CACHE_LOOKUPS, DISTANCE_PAIRS, OPTIMIZATIONS, PREDICT_CALLS, PREDICT_ROWS, QUEUE_DEPTH,
+    REGISTRY, SESSIONS, Trace, stage, tracing
+)
+from result_cache import ResultCache, decode_routes, encode_routes, request_fingerprint, traffic_bucket
+from distance_cache import PairDistanceCache
+from distance_engine import (
+    CLOSED_FORM_METHODS, DistanceOracle, IndexedLocations, SpatialIndex,
+    build_distance_oracle, location_key, register_distance_method
+)
+from local_search import LocalSearchSolver, routing_problem, stop_indices, time_window_hours
+from parallel import solve_clustered
+from route_state import FleetRouteState
+from sessions import PlanningSession, SessionStore
+from training import load_models, model_stamp, train_models
+from travel_time import SpeedCache, SpeedProfiles, TravelTimes, horizon_hours
 
 @dataclass
 class Location:
@@ -33,10 +53,11 @@ class Trip:
     id: str
     pickup: Location
     delivery: Location
-    weight: float
-    priority: int  # 1=highest, 5=lowest
-    time_window: Tuple[datetime, datetime]
-    estimated_duration: float = 0.0
+    # Bounds match TripColumns.from_columns, so both request shapes accept the same trips
+    weight: Annotated[float, Field(ge=0)]
+    priority: Annotated[int, Field(ge=1, le=5)]  # 1=highest, 5=lowest
+    time_window: Tuple[Optional[datetime], Optional[datetime]]  # None leaves that side open
+    estimated_duration: Annotated[float, Field(ge=0)] = 0.0
 
 @dataclass
 class OptimizedRoute:
@@ -49,14 +70,113 @@ class OptimizedRoute:
     waypoints: List[Location]
 
 class RouteOptimizer:
-    def __init__(self, redis_url: str = "redis://localhost:6379"):
-        self.redis_client = redis.from_url(redis_url)
-        self.scaler = StandardScaler()
+    def __init__(
+        self,
+        redis_url: str = "redis://localhost:6379",
+        distance_method: str = "haversine",
+        distance_mode: str = "auto",
+        candidate_radius_km: Optional[float] = None,
+        candidate_fallback_count: int = 5,
+        fuel_assignment: str = "global",
+        search_time_budget: float = 2.0,
+        parallel_workers: int = 0,
+        parallel_min_trips: int = 500,
+        solver_threads: int = 2,
+        cache: Optional[CacheStore] = None,
+        result_cache_ttl: float = 900,
+        distance_cache: str = "auto",
+        distance_cache_precision: int = 8,
+        road_graph_path: Optional[str] = None,
+        speed_profile_path: Optional[str] = None,
+        shared_data: bool = False,
+        model_dir: str = "models",
+        model_loading: str = "eager",
+        train_if_missing: bool = True,
+        model_refresh_interval: float = 0,
+        max_sessions: int = 32,
+        session_ttl: float = 3600,
+        session_repair_budget: float = 0.05
+    ):
+        self.cache = cache or CacheStore(redis_url)
+        # Map saved model, road graph and speed arrays read-only, so every
+        # worker process on a host shares one copy; see shared_data.py
+        self.shared_data = shared_data
+        if road_graph_path:
+            from road_network import RoadNetwork
+            
+            # Offline road distances, available as distance_method="road"
+            register_distance_method(
+                "road", RoadNetwork.load(road_graph_path, mmap=shared_data).distance_km
+            )
+            if distance_mode == "auto":
+                # Worker processes cannot rebuild road distances lazily
+                distance_mode = "dense"
+        # Full results of recent requests by fingerprint; a TTL of 0 disables it
+        self.result_cache = ResultCache(self.cache, result_cache_ttl) if result_cache_ttl > 0 else None
+        # Pair distances by geohash cell, persisted across requests. "auto" only
+        # enables it for distance sources that are costlier than a lookup.
+        self.pair_cache = None
+        if distance_cache == "on" or (
+            distance_cache == "auto" and distance_method not in CLOSED_FORM_METHODS
+        ):
+            self.pair_cache = PairDistanceCache(
+                CacheStore(client=self.cache.client, fallback_entries=200_000),
+                distance_method,
+                precision=distance_cache_precision,
+                symmetric=distance_method in CLOSED_FORM_METHODS
+            )
+        self.distance_method = distance_method
+        self.distance_mode = distance_mode
+        # Typical speeds per zone and hour of the week; without a profile every
+        # leg is driven at the live average speed
+        self.speed_cache = None
+        if speed_profile_path:
+            self.speed_cache = SpeedCache(
+                self.cache, SpeedProfiles.load(speed_profile_path, mmap=shared_data)
+            )
+        # Only vehicles within this radius of a pickup are considered for it
+        self.candidate_radius_km = candidate_radius_km
+        self.candidate_fallback_count = candidate_fallback_count
+        # fuel_efficient assigns trips by fleet-wide matching in rounds
+        # ("global") or one vehicle after another ("sequential")
+        if fuel_assignment not in ("global", "sequential"):
+            raise ValueError(f"Unknown fuel assignment '{fuel_assignment}', expected 'global' or 'sequential'")
+        self.fuel_assignment = fuel_assignment
+        # Seconds of local search allowed per time_optimal solve
+        self.search_time_budget = search_time_budget
+        # time_optimal solves at least parallel_min_trips trips as geographic
+        # clusters in this many worker processes (0 or 1 disables)
+        self.parallel_workers = parallel_workers
+        self.parallel_min_trips = parallel_min_trips
+        self._process_pool = None
+        # CPU-bound solve stages run here so the event loop stays responsive
+        self._solver_executor = (
+            ThreadPoolExecutor(max_workers=solver_threads, thread_name_prefix="route-solver")
+            if solver_threads > 0 else None
+        )
+        # Solved plans kept for incremental re-optimization
+        self.sessions = SessionStore(max_sessions, session_ttl)
+        # Seconds of local search allowed per session change
+        self.session_repair_budget = session_repair_budget
+        # Compiled forest over raw features; see forest.py
         self.model = None
+        self.model_dir = model_dir
+        # Without saved models: train in-process, or fail and wait for training.py
+        self.train_if_missing = train_if_missing
+        self._model_loading: Optional[asyncio.Future] = None
+        # Seconds between checks for a newly saved model version (0 disables)
+        self.model_refresh_interval = model_refresh_interval
+        self._model_stamp: Optional[str] = None
+        self._next_model_check = 0.0
         self.logger = logging.getLogger(__name__)
         
-        # Load pre-trained models
-        self._load_models()
+        # "eager" loads now; "lazy" on first use; "background" once the server
+        # calls start_model_loading()
+        self.model_loading = model_loading
+        if model_loading == "eager":
+            self._load_models()
+        elif model_loading not in ("lazy", "background"):
+            raise ValueError(f"Unknown model loading mode '{model_loading}'")
         
         # API keys and configurations
         self.google_maps_api_key = "YOUR_GOOGLE_MAPS_API_KEY"
@@ -65,78 +185,92 @@ class RouteOptimizer:
     def _load_models(self):
         """Load pre-trained ML models for route optimization."""
         try:
-            self.model = joblib.load('models/route_efficiency_model.pkl')
-            self.scaler = joblib.load('models/feature_scaler.pkl')
+            self._model_stamp = model_stamp(self.model_dir)
+            self.model = load_models(self.model_dir, mmap=self.shared_data)
             self.logger.info("Models loaded successfully")
         except FileNotFoundError:
+            if not self.train_if_missing:
+                raise RuntimeError(
+                    f"No trained models in '{self.model_dir}'; run `python training.py`"
+                )
             self.logger.warning("No pre-trained models found. Training new models...")
             self._train_models()
     
     def _train_models(self):
         """Train machine learning models for route optimization."""
-        # Generate synthetic training data (in production, use historical data)
-        training_data = self._generate_training_data()
-        
-        features = [
-            'distance', 'traffic_factor', 'time_of_day', 'day_of_week',
-            'weather_score', 'vehicle_efficiency', 'load_factor', 'priority_score'
-        ]
-        
-        X = training_data[features]
-        y = training_data['efficiency_score']
-        
-        # Scale features
-        X_scaled = self.scaler.fit_transform(X)
-        
-        # Train Random Forest model
-        self.model = RandomForestRegressor(
-            n_estimators=100,
-            max_depth=10,
-            random_state=42
-        )
-        self.model.fit(X_scaled, y)
-        
-        # Save models
-        joblib.dump(self.model, 'models/route_efficiency_model.pkl')
-        joblib.dump(self.scaler, 'models/feature_scaler.pkl')
-        
+        self.model = train_models(self.model_dir)
+        self._model_stamp = model_stamp(self.model_dir)
         self.logger.info("Models trained and saved successfully")
     
-    def _generate_training_data(self) -> pd.DataFrame:
-        """Generate synthetic training data for model training."""
-        np.random.seed(42)
-        n_samples = 10000
-        
-        data = {
-            'distance': np.random.exponential(50, n_samples),  # km
-            'traffic_factor': np.random.beta(2, 2, n_samples),  # 0-1
-            'time_of_day': np.random.randint(0, 24, n_samples),  # hour
-            'day_of_week': np.random.randint(0, 7, n_samples),  # 0=Monday
-            'weather_score': np.random.beta(3, 2, n_samples),  # 0-1 (1=perfect weather)
-            'vehicle_efficiency': np.random.normal(15, 3, n_samples),  # km/l
-            'load_factor': np.random.beta(2, 2, n_samples),  # 0-1
-            'priority_score': np.random.randint(1, 6, n_samples),  # 1-5
-        }
-        
-        df = pd.DataFrame(data)
-        
-        # Calculate efficiency score based on features
-        df['efficiency_score'] = (
-            (100 - df['distance'] * 0.5) * df['weather_score'] * 
-            (1 - df['traffic_factor'] * 0.3) * df['vehicle_efficiency'] / 20 *
-            (1 - df['load_factor'] * 0.2) * (6 - df['priority_score']) / 5
-        )
+    @property
+    def models_ready(self) -> bool:
+        return self.model is not None
+    
+    def start_model_loading(self) -> asyncio.Future:
+        """Load models on a worker thread; later calls share it until it fails."""
+        loading = self._model_loading
+        if loading is None or (loading.done() and loading.exception() is not None):
+            if self.models_ready:
+                self._model_loading = asyncio.get_running_loop().create_future()
+                self._model_loading.set_result(None)
+            else:
+                self._model_loading = asyncio.get_running_loop().run_in_executor(
+                    None, self._load_models
+                )
+        return self._model_loading
+    
+    def model_status(self) -> Dict:
+        """Readiness of the efficiency model: ready, not_loaded, loading or failed."""
+        if self.models_ready:
+            return {"status": "ready"}
+        if self._model_loading is None:
+            return {"status": "not_loaded"}
+        if not self._model_loading.done():
+            return {"status": "loading"}
+        return {"status": "failed", "error": str(self._model_loading.exception())}
+    
+    async def ensure_models(self):
+        """Wait until models are loaded, starting the load if nobody has.
         
-        # Normalize efficiency score to 0-100
-        df['efficiency_score'] = np.clip(df['efficiency_score'], 0, 100)
+        Once loaded, checks for a newly saved version at most every
+        model_refresh_interval seconds.
+        """
+        if not self.models_ready:
+            await asyncio.shield(self.start_model_loading())
+        elif self.model_refresh_interval > 0 and time.monotonic() >= self._next_model_check:
+            self._next_model_check = time.monotonic() + self.model_refresh_interval
+            await self.refresh_models()
+    
+    async def refresh_models(self) -> bool:
+        """Swap in the model training.py saved last, if it changed; returns whether it did.
         
-        return df
+        The new model is loaded completely before it replaces the current one
+        in a single assignment, so every predict call sees one whole model and
+        the worker keeps serving throughout. A version that fails to load
+        leaves the current model in place.
+        """
+        stamp = model_stamp(self.model_dir)
+        if stamp is None or stamp == self._model_stamp:
+            return False
+        try:
+            model = await asyncio.get_running_loop().run_in_executor(
+                None, lambda: load_models(self.model_dir, mmap=self.shared_data)
+            )
+        except Exception as e:
+            self.logger.error(f"Keeping the current model; loading the new one failed: {e}")
+            return False
+        self.model, self._model_stamp = model, stamp
+        self.logger.info(f"Swapped in model {stamp}")
+        return True
     
     async def optimize_routes(
         self, 
         vehicles: List[Vehicle], 
         trips: List[Trip],
-        optimization_strategy: str = "balanced"
+        optimization_strategy: str = "balanced",
+        time_budget: Optional[float] = None,
+        departure_time: Optional[datetime] = None,
+        on_route: Optional[Callable[[OptimizedRoute], None]] = None
     ) -> List[OptimizedRoute]:
         """
         Optimize routes for multiple vehicles and trips.
@@ -145,44 +279,335 @@ class RouteOptimizer:
             vehicles: Available vehicles
             trips: List of trips to be assigned
             optimization_strategy: "fuel_efficient", "time_optimal", "balanced"
+            time_budget: Seconds of local search for "time_optimal" (defaults to search_time_budget)
+            departure_time: When vehicles leave, for time windows and model features (defaults to now)
+            on_route: Called on the event loop with each route as soon as it is final
         
         Returns:
             List of optimized routes for each vehicle
         """
-        self.logger.info(f"Optimizing routes for {len(vehicles)} vehicles and {len(trips)} trips")
-        
-        # Get real-time traffic data
+        with stage("optimize"):
+            self.logger.info(f"Optimizing routes for {len(vehicles)} vehicles and {len(trips)} trips")
+            
+            if optimization_strategy not in ("fuel_efficient", "time_optimal"):
+                # Only the balanced strategy scores with the model
+                with stage("model_wait"):
+                    await self.ensure_models()
+            
+            # Get real-time traffic data
+            with stage("traffic"):
+                traffic_data = await self._get_traffic_data()
+            
+            # Identical re-submissions are served from the result cache
+            fingerprint = None
+            if self.result_cache is not None:
+                with stage("result_cache"):
+                    fingerprint = request_fingerprint(
+                        vehicles, trips, optimization_strategy,
+                        traffic_bucket(traffic_data, datetime.now()),
+                        {
+                            "time_budget": time_budget,
+                            "departure_time": departure_time,
+                            # Results scored by a replaced model are not reused
+                            "model": self._model_stamp
+                        }
+                    )
+                    cached = await self.result_cache.get(fingerprint)
+                if cached is not None:
+                    self.logger.info(f"Serving cached optimization {fingerprint[:12]}")
+                    optimized_routes = decode_routes(cached, vehicles, trips, OptimizedRoute)
+                    if on_route is not None:
+                        for route in optimized_routes:
+                            on_route(route)
+                    with stage("cache_results"):
+                        await self._cache_optimization_results(optimized_routes)
+                    return optimized_routes
+            
+            # Cached pair distances, read in one multi-get
+            coordinates = known = None
+            if self.pair_cache is not None:
+                with stage("pair_cache"):
+                    coordinates = IndexedLocations(self._request_locations(vehicles, trips)).coordinates
+                    known = await self.pair_cache.lookup(coordinates)
+            
+            # Zone speeds for the hours the routes may run
+            travel_times = None
+            if self.speed_cache is not None:
+                with stage("travel_times"):
+                    departure_time = departure_time or datetime.now()
+                    if coordinates is None:
+                        coordinates = IndexedLocations(self._request_locations(vehicles, trips)).coordinates
+                    travel_times = await self.speed_cache.travel_times(
+                        coordinates, departure_time,
+                        horizon_hours(time_window_hours(trips, departure_time)[1])
+                    )
+            
+            # Routes are handed back to this loop as the solver thread finishes them
+            emit = None
+            if on_route is not None:
+                loop = asyncio.get_running_loop()
+                emit = lambda route: loop.call_soon_threadsafe(on_route, route)
+            
+            # Solve off the event loop
+            OPTIMIZATIONS.inc(strategy=optimization_strategy)
+            optimized_routes, distance_matrix = await self._run_off_loop(
+                self._solve_routes, vehicles, trips, optimization_strategy,
+                traffic_data, time_budget, departure_time, known, emit, travel_times
+            )
+            
+            if known is not None:
+                with stage("pair_cache"):
+                    await self.pair_cache.save(coordinates, distance_matrix.matrix, known)
+            
+            if fingerprint is not None:
+                with stage("result_cache"):
+                    await self.result_cache.set(fingerprint, encode_routes(optimized_routes, vehicles, trips))
+            
+            # Cache results
+            with stage("cache_results"):
+                await self._cache_optimization_results(optimized_routes)
+            
+            return optimized_routes
+    
+    async def create_session(
+        self,
+        vehicles: List[Vehicle],
+        trips: List[Trip],
+        time_budget: Optional[float] = None,
+        departure_time: Optional[datetime] = None
+    ) -> Tuple[PlanningSession, List[OptimizedRoute]]:
+        """Solve a plan with the time_optimal strategy and keep it for update_session."""
+        self.logger.info(f"Planning session for {len(vehicles)} vehicles and {len(trips)} trips")
         traffic_data = await self._get_traffic_data()
+        with stage("session_plan"):
+            session = await self._run_off_loop(
+                self._plan_session, vehicles, trips, traffic_data, time_budget, departure_time
+            )
+        self.sessions.add(session)
+        
+        optimized_routes = await self.session_routes(session)
+        await self._cache_optimization_results(optimized_routes)
+        return session, optimized_routes
+    
+    async def _plan_session(
+        self,
+        vehicles: List[Vehicle],
+        trips: List[Trip],
+        traffic_data: Dict,
+        time_budget: Optional[float],
+        departure_time: Optional[datetime]
+    ) -> PlanningSession:
+        # Dense, so later changes only add rows and columns for new locations
+        distance_matrix = build_distance_oracle(
+            self._request_locations(vehicles, trips), method=self.distance_method, mode="dense"
+        )
+        departure_time = departure_time or datetime.now()
+        problem = routing_problem(
+            distance_matrix, vehicles, trips, traffic_data.get('average_speed', 40), departure_time
+        )
+        solver = LocalSearchSolver(
+            problem, time_budget=self.search_time_budget if time_budget is None else time_budget
+        )
+        # Every trip gets the full search: leftovers are only retried where a change frees room
+        solver.solve(self._insertion_order(trip_arrays(trips)[1], problem.due_times), full_construction=True)
+        DISTANCE_PAIRS.inc(distance_matrix.computed_pairs)
+        return PlanningSession(
+            list(vehicles), trips, distance_matrix, solver, traffic_data, departure_time
+        )
+    
+    async def update_session(
+        self,
+        session_id: str,
+        operations: List[Dict]
+    ) -> Optional[Tuple[PlanningSession, List[OptimizedRoute]]]:
+        """Apply changes to a session's plan; returns it with the routes that changed, or None if unknown.
+        
+        See PlanningSession.apply for the operations. Raises ValueError for
+        invalid ones, leaving the plan unchanged.
+        """
+        session = self.sessions.get(session_id)
+        if session is None:
+            return None
+        
+        # One change at a time per session
+        async with self._session_lock(session):
+            with stage("session_repair"):
+                changed = await self._run_off_loop(self._repair_session, session, operations)
+            optimized_routes = await self.session_routes(session, changed)
+        await self._cache_optimization_results(optimized_routes, replace_fleet=False)
+        return session, optimized_routes
+    
+    async def get_session(self, session_id: str) -> Optional[Tuple[PlanningSession, List[OptimizedRoute]]]:
+        """A session with all its routes, or None if unknown; waits for a change in progress."""
+        session = self.sessions.get(session_id)
+        if session is None:
+            return None
+        async with self._session_lock(session):
+            optimized_routes = await self.session_routes(session)
+        return session, optimized_routes
+    
+    def _session_lock(self, session: PlanningSession) -> asyncio.Lock:
+        if session.lock is None:
+            session.lock = asyncio.Lock()
+        return session.lock
+    
+    async def _repair_session(self, session: PlanningSession, operations: List[Dict]) -> List[int]:
+        computed = session.distance_matrix.computed_pairs
+        changed = session.apply(operations, self.session_repair_budget)
+        DISTANCE_PAIRS.inc(session.distance_matrix.computed_pairs - computed)
+        return changed
+    
+    async def session_routes(
+        self,
+        session: PlanningSession,
+        positions: Optional[List[int]] = None
+    ) -> List[OptimizedRoute]:
+        """Route metrics for the session's vehicles at the given positions, or all of them."""
+        if positions is None:
+            positions = range(len(session.vehicles))
+        
+        optimized_routes = []
+        for v in positions:
+            trips, waypoints, duration = session.route(v)
+            optimized_routes.append(await self._calculate_route_metrics(
+                session.vehicles[v].id, trips, session.distance_matrix,
+                session.traffic_data, waypoints, duration
+            ))
+        return optimized_routes
+    
+    async def _run_off_loop(self, coroutine_fn, *args):
+        """Run a CPU-bound coroutine function on a solver thread with its own event loop."""
+        if self._solver_executor is None:
+            return await coroutine_fn(*args)
+        
+        loop = asyncio.get_running_loop()
+        # Carries the request's trace over to the solver thread
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(
+            self._solver_executor, context.run, lambda: asyncio.run(coroutine_fn(*args))
+        )
+    
+    async def _solve_routes(
+        self,
+        vehicles: List[Vehicle],
+        trips: List[Trip],
+        optimization_strategy: str,
+        traffic_data: Dict,
+        time_budget: Optional[float],
+        departure_time: Optional[datetime],
+        known_distances: Optional[np.ndarray] = None,
+        on_route: Optional[Callable[[OptimizedRoute], None]] = None,
+        travel_times: Optional[TravelTimes] = None
+    ) -> Tuple[List[OptimizedRoute], DistanceOracle]:
+        """Distance matrix, strategy and route metrics: the CPU-bound part of optimize_routes.
         
+        With travel_times, strategies plan at the zones' average speed in the
+        departure hour and route durations are re-timed leg by leg. Routes a
+        strategy reports final early are handed to on_route before it returns.
+        """
         # Calculate distance matrix
-        distance_matrix = await self._calculate_distance_matrix(vehicles, trips)
+        with stage("distance_matrix"):
+            distance_matrix = await self._calculate_distance_matrix(vehicles, trips, known_distances)
+        
+        # Apply optimization algorithm; time windows are relative to departure
+        departure_time = departure_time or datetime.now()
+        if travel_times is not None:
+            traffic_data = {**traffic_data, "average_speed": travel_times.average_speed()}
+        
+        finished: Dict[str, OptimizedRoute] = {}
+        
+        async def finish(routes: Dict[str, List[Trip]], waypoints: Dict, durations: Dict[str, float]):
+            """Metrics for routes that will not change any more, handed to on_route one by one."""
+            if travel_times is not None:
+                with stage("travel_times"):
+                    durations = self._timed_durations(
+                        [vehicle for vehicle in vehicles if vehicle.id in routes],
+                        trips, routes, waypoints, distance_matrix, travel_times
+                    )
+            with stage("route_metrics"):
+                for vehicle_id, assigned_trips in routes.items():
+                    route = await self._calculate_route_metrics(
+                        vehicle_id, assigned_trips, distance_matrix, traffic_data,
+                        waypoints.get(vehicle_id), durations.get(vehicle_id)
+                    )
+                    finished[vehicle_id] = route
+                    if on_route is not None:
+                        on_route(route)
         
-        # Apply optimization algorithm
+        waypoints = {}
         if optimization_strategy == "fuel_efficient":
-            routes = await self._optimize_for_fuel_efficiency(vehicles, trips, distance_matrix, traffic_data)
+            with stage("fuel_efficient"):
+                routes, durations = await self._optimize_for_fuel_efficiency(
+                    vehicles, trips, distance_matrix, traffic_data, departure_time
+                )
         elif optimization_strategy == "time_optimal":
-            routes = await self._optimize_for_time(vehicles, trips, distance_matrix, traffic_data)
+            with stage("time_optimal"):
+                routes, waypoints, durations = await self._optimize_for_time(
+                    vehicles, trips, distance_matrix, traffic_data, time_budget, departure_time,
+                    finish if on_route is not None else None
+                )
         else:  # balanced
-            routes = await self._optimize_balanced(vehicles, trips, distance_matrix, traffic_data)
-        
-        # Calculate route metrics
-        optimized_routes = []
-        for vehicle_id, assigned_trips in routes.items():
-            route = await self._calculate_route_metrics(
-                vehicle_id, assigned_trips, distance_matrix, traffic_data
-            )
-            optimized_routes.append(route)
+            with stage("balanced"):
+                routes, durations = await self._optimize_balanced(
+                    vehicles, trips, distance_matrix, traffic_data, departure_time
+                )
         
-        # Cache results
-        await self._cache_optimization_results(optimized_routes)
+        # Calculate route metrics for the routes not finished early
+        await finish(
+            {vehicle_id: assigned for vehicle_id, assigned in routes.items() if vehicle_id not in finished},
+            waypoints, durations
+        )
+        optimized_routes = [finished[vehicle_id] for vehicle_id in routes]
         
-        return optimized_routes
+        # Lazy oracles compute pairs up to here
+        DISTANCE_PAIRS.inc(distance_matrix.computed_pairs)
+        return optimized_routes, distance_matrix
+    
+    def _timed_durations(
+        self,
+        vehicles: List[Vehicle],
+        trips: List[Trip],
+        routes: Dict[str, List[Trip]],
+        waypoints: Dict[str, List[Location]],
+        distance_matrix: DistanceOracle,
+        travel_times: TravelTimes
+    ) -> Dict[str, float]:
+        """Hours each route takes at its zones' speeds in the hours it drives, waits and service included."""
+        ready_times, _ = time_window_hours(trips, travel_times.departure)
+        positions = {trip_id: k for k, trip_id in enumerate(trip_ids(trips))}
+        durations = {}
+        for vehicle in vehicles:
+            assigned = routes.get(vehicle.id)
+            if not assigned:
+                durations[vehicle.id] = 0.0
+                continue
+            stops = waypoints.get(vehicle.id) or [
+                location for trip in assigned for location in (trip.pickup, trip.delivery)
+            ]
+            
+            # Pickups wait for the window to open and take the trip's service time
+            pickups = {id(trip.pickup): trip for trip in assigned}
+            ready = np.zeros(len(stops))
+            service = np.zeros(len(stops))
+            for i, stop in enumerate(stops):
+                trip = pickups.pop(id(stop), None)
+                if trip is not None:
+                    ready[i] = ready_times[positions[trip.id]]
+                    service[i] = trip.estimated_duration
+            
+            indices = distance_matrix.indices_of([vehicle.current_location] + stops)
+            distances = distance_matrix.pairs(indices[:-1], indices[1:]).astype(np.float64)
+            durations[vehicle.id] = float(
+                travel_times.completion_hours(indices[:-1], distances, ready, service)[-1]
+            )
+        return durations
     
     async def _get_traffic_data(self) -> Dict:
         """Fetch real-time traffic data from external APIs."""
         try:
             # Check cache first
-            cached_data = self.redis_client.get("traffic_data")
+            cached_data = await self.cache.get("traffic_data")
+            CACHE_LOOKUPS.inc(cache="traffic", outcome="hit" if cached_data else "miss")
             if cached_data:
                 return json.loads(cached_data)
             
@@ -195,10 +620,10 @@ class RouteOptimizer:
             }
             
             # Cache for 5 minutes
-            self.redis_client.setex(
-                "traffic_data", 
-                300, 
-                json.dumps(traffic_data, default=str)
+            await self.cache.set(
+                "traffic_data",
+                json.dumps(traffic_data, default=str).encode(),
+                ttl=300
             )
             
             return traffic_data
@@ -207,205 +632,335 @@ class RouteOptimizer:
             self.logger.error(f"Error fetching traffic data: {e}")
             return {"average_speed": 40, "congestion_level": 0.3, "incidents": []}
     
-    async def _calculate_distance_matrix(
-        self, 
-        vehicles: List[Vehicle], 
-        trips: List[Trip]
-    ) -> Dict[str, Dict[str, float]]:
-        """Calculate distance matrix between all locations."""
-        locations = []
+    def _request_locations(self, vehicles: List[Vehicle], trips: List[Trip]) -> Sequence[Location]:
+        """Vehicle locations followed by the pickup and delivery of each trip.
         
-        # Add vehicle locations
-        for vehicle in vehicles:
-            locations.append(vehicle.current_location)
+        For TripColumns this is an (n, 2) array of degrees, so no trip is built.
+        """
+        if isinstance(trips, TripColumns):
+            vehicle_points = np.array(
+                [location_key(v.current_location) for v in vehicles], dtype=np.float64
+            ).reshape(-1, 2)
+            return np.vstack((vehicle_points, trips.stop_coordinates()))
+        locations = [vehicle.current_location for vehicle in vehicles]
         
         # Add pickup and delivery locations
         for trip in trips:
             locations.append(trip.pickup)
             locations.append(trip.delivery)
+        return locations
+    
+    async def _calculate_distance_matrix(
+        self, 
+        vehicles: List[Vehicle], 
+        trips: List[Trip],
+        known: Optional[np.ndarray] = None
+    ) -> DistanceOracle:
+        """Calculate distance matrix between all locations.
         
-        # Remove duplicates
-        unique_locations = list({
-            (loc.latitude, loc.longitude): loc 
-            for loc in locations
-        }.values())
+        known holds cached distances (NaN where missing); only the rest are computed.
+        """
+        # Straight-line distance unless a road graph is configured. Large
+        # problems get a lazy oracle that only computes the pairs strategies read.
+        return build_distance_oracle(
+            self._request_locations(vehicles, trips),
+            method=self.distance_method, mode=self.distance_mode, known=known
+        )
+    
+    def _candidate_indices(
+        self,
+        targets: np.ndarray,
+        queries: np.ndarray
+    ) -> Optional[List[np.ndarray]]:
+        """Positions of nearby targets for each query point, or None when pre-filtering is off."""
+        if self.candidate_radius_km is None or len(targets) == 0 or len(queries) == 0:
+            return None
         
-        # Calculate distance matrix
-        matrix = {}
-        for i, loc1 in enumerate(unique_locations):
-            key1 = f"{loc1.latitude},{loc1.longitude}"
-            matrix[key1] = {}
-            
-            for j, loc2 in enumerate(unique_locations):
-                key2 = f"{loc2.latitude},{loc2.longitude}"
-                
-                if i == j:
-                    matrix[key1][key2] = 0.0
-                else:
-                    # Use geodesic distance (in production, use actual road distance)
-                    distance = geodesic(
-                        (loc1.latitude, loc1.longitude),
-                        (loc2.latitude, loc2.longitude)
-                    ).kilometers
-                    matrix[key1][key2] = distance
-        
-        return matrix
+        return SpatialIndex(targets).candidates(
+            queries, self.candidate_radius_km, self.candidate_fallback_count
+        )
+    
+    def _init_route_state(
+        self,
+        vehicles: List[Vehicle],
+        trips: List[Trip],
+        distance_matrix: DistanceOracle,
+        traffic_data: Dict,
+        departure_time: datetime
+    ) -> FleetRouteState:
+        """Create empty running route state for every vehicle."""
+        ready_times, due_times = time_window_hours(trips, departure_time)
+        return FleetRouteState(
+            vehicles,
+            distance_matrix.indices_of([v.current_location for v in vehicles]),
+            distance_matrix,
+            average_speed=traffic_data.get('average_speed', 40),
+            ready_times=ready_times,
+            due_times=due_times,
+            service_times=trip_arrays(trips)[2]
+        )
+    
+    def _state_routes(
+        self,
+        state: FleetRouteState,
+        vehicles: List[Vehicle],
+        trips: List[Trip]
+    ) -> Tuple[Dict[str, List[Trip]], Dict[str, float]]:
+        """Trips and hours to complete per vehicle from a fleet route state."""
+        unassigned = len(trips) - sum(len(indices) for indices in state.trip_indices)
+        if unassigned:
+            self.logger.warning(f"{unassigned} trips have no feasible placement")
+        durations = {vehicle.id: float(state.duration[v]) for v, vehicle in enumerate(vehicles)}
+        return state.routes(vehicles, trips), durations
+    
+    def _get_process_pool(self) -> ProcessPoolExecutor:
+        """Worker processes for parallel solves, started on first use."""
+        if self._process_pool is None:
+            # Spawned workers import only the solver modules, not this service
+            self._process_pool = ProcessPoolExecutor(
+                max_workers=self.parallel_workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._process_pool
     
     async def _optimize_for_fuel_efficiency(
         self, 
         vehicles: List[Vehicle], 
         trips: List[Trip],
-        distance_matrix: Dict,
-        traffic_data: Dict
-    ) -> Dict[str, List[Trip]]:
+        distance_matrix: DistanceOracle,
+        traffic_data: Dict,
+        departure_time: datetime
+    ) -> Tuple[Dict[str, List[Trip]], Dict[str, float]]:
         """Optimize routes prioritizing fuel efficiency."""
-        routes = {vehicle.id: [] for vehicle in vehicles}
-        unassigned_trips = trips.copy()
+        state = self._init_route_state(vehicles, trips, distance_matrix, traffic_data, departure_time)
+        weights = trip_arrays(trips)[0]
+        pickup_indices, delivery_indices = stop_indices(distance_matrix, trips)
+        if self.fuel_assignment == "global" and len(trips) and len(vehicles):
+            assign_in_rounds(state, weights, pickup_indices, delivery_indices)
+            return self._state_routes(state, vehicles, trips)
+        
+        unassigned = np.ones(len(trips), dtype=bool)
+        candidates = self._candidate_indices(
+            distance_matrix.coordinates[pickup_indices],
+            distance_matrix.coordinates[state.start_location]
+        )
         
         # Sort trips by distance from depot (shortest first)
-        for vehicle in vehicles:
-            vehicle_key = f"{vehicle.current_location.latitude},{vehicle.current_location.longitude}"
+        for v in range(len(vehicles)):
+            if candidates is None:
+                positions = np.flatnonzero(unassigned)
+            else:
+                positions = candidates[v][unassigned[candidates[v]]]
             
-            # Calculate distances to all pickup points
-            trip_distances = []
-            for trip in unassigned_trips:
-                pickup_key = f"{trip.pickup.latitude},{trip.pickup.longitude}"
-                distance = distance_matrix.get(vehicle_key, {}).get(pickup_key, float('inf'))
-                trip_distances.append((distance, trip))
+            # Calculate distances to unassigned candidate pickup points
+            distances = distance_matrix.one_to_many(state.start_location[v], pickup_indices[positions])
             
-            # Sort by distance and assign trips
-            trip_distances.sort(key=lambda x: x[0])
-            
-            current_capacity = 0
-            for distance, trip in trip_distances:
-                if (current_capacity + trip.weight <= vehicle.capacity and 
-                    trip in unassigned_trips):
-                    routes[vehicle.id].append(trip)
-                    unassigned_trips.remove(trip)
-                    current_capacity += trip.weight
+            # Assign nearest trips while capacity and time windows allow
+            for k in positions[np.argsort(distances, kind="stable")]:
+                if state.feasible(v, k, weights[k], pickup_indices[k], delivery_indices[k]):
+                    state.assign(v, k, weights[k], pickup_indices[k], delivery_indices[k])
+                    unassigned[k] = False
         
-        return routes
+        return self._state_routes(state, vehicles, trips)
     
     async def _optimize_for_time(
         self, 
         vehicles: List[Vehicle], 
         trips: List[Trip],
-        distance_matrix: Dict,
-        traffic_data: Dict
-    ) -> Dict[str, List[Trip]]:
-        """Optimize routes prioritizing delivery time."""
-        routes = {vehicle.id: [] for vehicle in vehicles}
-        
-        # Sort trips by priority and time window
-        sorted_trips = sorted(trips, key=lambda t: (t.priority, t.time_window[1]))
-        
-        for trip in sorted_trips:
-            best_vehicle = None
-            best_score = float('inf')
-            
-            for vehicle in vehicles:
-                # Calculate insertion cost
-                score = await self._calculate_insertion_cost(
-                    vehicle, trip, routes[vehicle.id], distance_matrix
-                )
-                
-                if score < best_score:
-                    best_score = score
-                    best_vehicle = vehicle
-            
-            if best_vehicle:
-                routes[best_vehicle.id].append(trip)
+        distance_matrix: DistanceOracle,
+        traffic_data: Dict,
+        time_budget: Optional[float] = None,
+        departure_time: Optional[datetime] = None,
+        on_final: Optional[Callable[..., Awaitable[None]]] = None
+    ) -> Tuple[Dict[str, List[Trip]], Dict[str, List[Location]], Dict[str, float]]:
+        """Optimize routes prioritizing delivery time.
+        
+        Builds routes by cheapest feasible insertion of each pickup/delivery
+        pair, then improves them with 2-opt, or-opt, relocate and exchange
+        moves until the time budget runs out. Returns trips per vehicle, the
+        stop sequence each vehicle drives and the hours it takes.
+        
+        When solving clusters in parallel, on_final is awaited with the same
+        three dicts for each cluster's vehicles as soon as their routes are
+        final, before the remaining clusters are done.
+        """
+        problem = routing_problem(
+            distance_matrix, vehicles, trips,
+            traffic_data.get('average_speed', 40), departure_time or datetime.now()
+        )
+        vehicle_locations, pickups = problem.vehicle_locations, problem.pickups
+        budget = self.search_time_budget if time_budget is None else time_budget
+        
+        # Insert trips by priority and time window
+        order = self._insertion_order(trip_arrays(trips)[1], problem.due_times)
+        
+        if self.parallel_workers > 1 and len(trips) >= self.parallel_min_trips:
+            timer = LocalSearchSolver(problem)
+            on_cluster = None
+            if on_final is not None:
+                async def on_cluster(positions: np.ndarray, cluster_routes: List[List[int]]):
+                    fleet_routes = [[] for _ in vehicles]
+                    for v, stops in zip(positions, cluster_routes):
+                        fleet_routes[v] = stops
+                    completion = timer.completion_times(fleet_routes)[positions]
+                    await on_final(*self._stop_routes(
+                        [vehicles[v] for v in positions], trips, cluster_routes, completion
+                    ))
+            stop_routes, unassigned = await solve_clustered(
+                self._get_process_pool(), problem, order, budget, self.parallel_workers, on_cluster
+            )
+            completion = timer.completion_times(stop_routes)
+        else:
+            candidates = self._candidate_indices(
+                distance_matrix.coordinates[vehicle_locations],
+                distance_matrix.coordinates[pickups]
+            )
+            solver = LocalSearchSolver(problem, time_budget=budget, candidates=candidates)
+            stop_routes = solver.solve(order)
+            unassigned = solver.unassigned
+            completion = solver.completion_times()
         
-        return routes
+        if unassigned:
+            self.logger.warning(f"{len(unassigned)} trips have no feasible placement")
+        
+        return self._stop_routes(vehicles, trips, stop_routes, completion)
+    
+    def _stop_routes(
+        self,
+        vehicles: List[Vehicle],
+        trips: List[Trip],
+        stop_routes: List[List[int]],
+        completion: np.ndarray
+    ) -> Tuple[Dict[str, List[Trip]], Dict[str, List[Location]], Dict[str, float]]:
+        """Trips, stop sequence and hours per vehicle from LocalSearchSolver stop routes."""
+        routes = {}
+        waypoints = {}
+        durations = {vehicle.id: float(hours) for vehicle, hours in zip(vehicles, completion)}
+        for vehicle, stops in zip(vehicles, stop_routes):
+            routes[vehicle.id] = [trips[stop >> 1] for stop in stops if not stop & 1]
+            waypoints[vehicle.id] = [
+                trips[stop >> 1].delivery if stop & 1 else trips[stop >> 1].pickup
+                for stop in stops
+            ]
+        
+        return routes, waypoints, durations
+    
+    def _insertion_order(self, priorities: np.ndarray, due_times: np.ndarray) -> List[int]:
+        """Trip indices by priority, then by due time."""
+        return np.lexsort((due_times, priorities)).tolist()
     
     async def _optimize_balanced(
         self, 
         vehicles: List[Vehicle], 
         trips: List[Trip],
-        distance_matrix: Dict,
-        traffic_data: Dict
-    ) -> Dict[str, List[Trip]]:
+        distance_matrix: DistanceOracle,
+        traffic_data: Dict,
+        departure_time: datetime
+    ) -> Tuple[Dict[str, List[Trip]], Dict[str, float]]:
         """Optimize routes with balanced approach using ML model."""
-        routes = {vehicle.id: [] for vehicle in vehicles}
+        state = self._init_route_state(vehicles, trips, distance_matrix, traffic_data, departure_time)
+        if not vehicles:
+            return self._state_routes(state, vehicles, trips)
         
-        for trip in trips:
-            best_vehicle = None
-            best_score = float('-inf')
+        weights, priorities, _ = trip_arrays(trips)
+        pickup_indices, delivery_indices = stop_indices(distance_matrix, trips)
+        candidates = self._candidate_indices(
+            distance_matrix.coordinates[state.start_location],
+            distance_matrix.coordinates[pickup_indices]
+        )
+        all_positions = np.arange(len(vehicles))
+        
+        for t, (weight, priority) in enumerate(zip(weights.tolist(), priorities.tolist())):
+            positions = all_positions if candidates is None else candidates[t]
             
-            for vehicle in vehicles:
-                # Calculate efficiency score using ML model
-                score = await self._predict_route_efficiency(
-                    vehicle, trip, routes[vehicle.id], distance_matrix, traffic_data
-                )
-                
-                if score > best_score:
-                    best_score = score
-                    best_vehicle = vehicle
+            # Score every candidate vehicle for this trip with one model call
+            scores = await self._predict_route_efficiency(
+                weight, priority, pickup_indices[t], positions, state, traffic_data, departure_time
+            )
             
-            if best_vehicle:
-                routes[best_vehicle.id].append(trip)
+            # Only vehicles that can take the trip on time and within capacity
+            feasible = state.feasible(positions, t, weight, pickup_indices[t], delivery_indices[t])
+            if not feasible.any():
+                continue
+            scores = np.where(feasible, scores, -np.inf)
+            
+            # argmax keeps the first best vehicle, as the sequential comparison did
+            best = positions[int(np.argmax(scores))]
+            state.assign(best, t, weight, pickup_indices[t], delivery_indices[t])
         
-        return routes
+        return self._state_routes(state, vehicles, trips)
     
-    async def _predict_route_efficiency(
+    def _efficiency_features(
         self,
-        vehicle: Vehicle,
-        trip: Trip,
-        current_route: List[Trip],
-        distance_matrix: Dict,
-        traffic_data: Dict
-    ) -> float:
-        """Predict route efficiency using ML model."""
-        # Calculate features
-        vehicle_key = f"{vehicle.current_location.latitude},{vehicle.current_location.longitude}"
-        pickup_key = f"{trip.pickup.latitude},{trip.pickup.longitude}"
-        
-        distance = distance_matrix.get(vehicle_key, {}).get(pickup_key, 0)
-        current_load = sum(t.weight for t in current_route)
-        load_factor = (current_load + trip.weight) / vehicle.capacity
-        
-        features = np.array([[
-            distance,
-            traffic_data.get('congestion_level', 0.3),
-            datetime.now().hour,
-            datetime.now().weekday(),
-            0.8,  # weather_score (placeholder)
-            vehicle.fuel_efficiency,
-            load_factor,
-            trip.priority
-        ]])
-        
-        # Scale features and predict
-        features_scaled = self.scaler.transform(features)
-        efficiency_score = self.model.predict(features_scaled)[0]
-        
-        return efficiency_score
-    
-    async def _calculate_insertion_cost(
+        distances: np.ndarray,
+        fuel_efficiencies: np.ndarray,
+        load_factors: np.ndarray,
+        priority,
+        traffic_data: Dict,
+        departure_time: datetime
+    ) -> np.ndarray:
+        """Build the efficiency model feature matrix, one row per candidate."""
+        features = np.empty((len(distances), 8))
+        features[:, 0] = distances
+        features[:, 1] = traffic_data.get('congestion_level', 0.3)
+        features[:, 2] = departure_time.hour
+        features[:, 3] = departure_time.weekday()
+        features[:, 4] = 0.8  # weather_score (placeholder)
+        features[:, 5] = fuel_efficiencies
+        features[:, 6] = load_factors
+        features[:, 7] = priority
+        return features
+    
+    def _score_efficiency(self, features: np.ndarray) -> np.ndarray:
+        """Predict efficiency scores for a raw feature matrix in one batch."""
+        PREDICT_CALLS.inc()
+        PREDICT_ROWS.inc(len(features))
+        return self.model.predict(features)
+    
+    async def _predict_route_efficiency(
         self,
-        vehicle: Vehicle,
-        trip: Trip,
-        current_route: List[Trip],
-        distance_matrix: Dict
-    ) -> float:
-        """Calculate the cost of inserting a trip into current route."""
-        # Simple insertion cost calculation
-        vehicle_key = f"{vehicle.current_location.latitude},{vehicle.current_location.longitude}"
-        pickup_key = f"{trip.pickup.latitude},{trip.pickup.longitude}"
+        weight: float,
+        priority: int,
+        pickup_index: int,
+        positions: np.ndarray,
+        state: FleetRouteState,
+        traffic_data: Dict,
+        departure_time: datetime
+    ) -> np.ndarray:
+        """Predict efficiency of adding a trip to each candidate vehicle using ML model."""
+        distances = state.distance_matrix.pairs(
+            state.start_location[positions], np.full(len(positions), pickup_index)
+        )
+        load_factors = (state.load[positions] + weight) / state.capacity[positions]
         
-        base_distance = distance_matrix.get(vehicle_key, {}).get(pickup_key, 0)
-        capacity_penalty = max(0, (sum(t.weight for t in current_route) + trip.weight) - vehicle.capacity) * 1000
+        features = self._efficiency_features(
+            distances,
+            state.fuel_efficiency[positions],
+            load_factors,
+            priority,
+            traffic_data,
+            departure_time
+        )
         
-        return base_distance + capacity_penalty
+        return self._score_efficiency(features)
     
     async def _calculate_route_metrics(
         self,
         vehicle_id: str,
         trips: List[Trip],
-        distance_matrix: Dict,
-        traffic_data: Dict
+        distance_matrix: DistanceOracle,
+        traffic_data: Dict,
+        stops: Optional[List[Location]] = None,
+        duration: Optional[float] = None
     ) -> OptimizedRoute:
-        """Calculate comprehensive metrics for an optimized route."""
+        """Calculate comprehensive metrics for an optimized route.
+        
+        When the strategy ordered the stops itself, distance follows that
+        sequence; otherwise each trip is driven pickup to delivery in turn.
+        duration is the strategy's schedule, in hours from departure until
+        the last delivery including waits and service times; without it the
+        driving time is used.
+        """
         total_distance = 0.0
         total_duration = 0.0
         waypoints = []
@@ -422,26 +977,32 @@ class RouteOptimizer:
             )
         
         # Calculate route metrics
-        current_location = None
-        for i, trip in enumerate(trips):
-            if i == 0:
-                # Distance from vehicle to first pickup
-                # This would use the vehicle's current location
-                pass
-            
-            # Add pickup and delivery waypoints
-            waypoints.extend([trip.pickup, trip.delivery])
-            
-            # Calculate distances (simplified)
-            pickup_key = f"{trip.pickup.latitude},{trip.pickup.longitude}"
-            delivery_key = f"{trip.delivery.latitude},{trip.delivery.longitude}"
-            
-            trip_distance = distance_matrix.get(pickup_key, {}).get(delivery_key, 0)
-            total_distance += trip_distance
-            
-            # Estimate duration (distance / average_speed)
-            avg_speed = traffic_data.get('average_speed', 40)
-            total_duration += trip_distance / avg_speed
+        avg_speed = traffic_data.get('average_speed', 40)
+        if stops:
+            # Drive the stop sequence chosen by the strategy
+            waypoints = list(stops)
+            stop_indices = distance_matrix.indices_of(waypoints)
+            total_distance = float(
+                distance_matrix.pairs(stop_indices[:-1], stop_indices[1:]).sum(dtype=np.float64)
+            )
+            total_duration = total_distance / avg_speed
+        else:
+            for trip in trips:
+                # Add pickup and delivery waypoints
+                waypoints.extend([trip.pickup, trip.delivery])
+                
+                # Calculate distances (simplified)
+                trip_distance = distance_matrix.distance(
+                    distance_matrix.index_of(trip.pickup),
+                    distance_matrix.index_of(trip.delivery)
+                )
+                total_distance += trip_distance
+                
+                # Estimate duration (distance / average_speed)
+                total_duration += trip_distance / avg_speed
+        
+        if duration is not None:
+            total_duration = duration
         
         # Calculate fuel cost (simplified)
         fuel_efficiency = 15  # km/l (would get from vehicle data)
@@ -461,8 +1022,16 @@ class RouteOptimizer:
             waypoints=waypoints
         )
     
-    async def _cache_optimization_results(self, routes: List[OptimizedRoute]):
-        """Cache optimization results for quick access."""
+    async def _cache_optimization_results(
+        self,
+        routes: List[OptimizedRoute],
+        replace_fleet: bool = True
+    ):
+        """Cache optimization results for quick access.
+        
+        With replace_fleet=False only the given vehicles' entries are
+        updated, for changes that touched part of a plan.
+        """
         cache_data = {
             "timestamp": datetime.now().isoformat(),
             "routes": [
@@ -478,11 +1047,13 @@ class RouteOptimizer:
             ]
         }
         
-        self.redis_client.setex(
-            "latest_optimization", 
-            3600,  # 1 hour
-            json.dumps(cache_data, default=str)
-        )
+        # Fleet summary plus one entry per vehicle, written in a single pipeline
+        items = {}
+        if replace_fleet:
+            items["latest_optimization"] = json.dumps(cache_data, default=str).encode()
+        for summary in cache_data["routes"]:
+            items[f"latest_optimization:{summary['vehicle_id']}"] = json.dumps(summary).encode()
+        await self.cache.set_many(items, ttl=3600)  # 1 hour
     
     async def get_route_suggestions(
         self, 
@@ -490,8 +1061,11 @@ class RouteOptimizer:
         current_location: Location
     ) -> Dict:
         """Get real-time route suggestions for a specific vehicle."""
-        # Get traffic updates
-        traffic_data = await self._get_traffic_data()
+        # Get traffic updates and the vehicle's last optimized route
+        traffic_data, route_summary = await asyncio.gather(
+            self._get_traffic_data(),
+            self.cache.get(f"latest_optimization:{vehicle_id}")
+        )
         
         # Check for route alternatives
         suggestions = {
@@ -499,6 +1073,8 @@ class RouteOptimizer:
             "alternative_routes": [],
             "estimated_savings": {}
         }
+        if route_summary:
+            suggestions["current_route"] = json.loads(route_summary)
         
         if traffic_data.get('congestion_level', 0) > 0.7:
             suggestions["traffic_alerts"].append(
@@ -507,9 +1083,9 @@ class RouteOptimizer:
         
         return suggestions
     
-    def get_optimization_metrics(self) -> Dict:
+    async def get_optimization_metrics(self) -> Dict:
         """Get overall optimization performance metrics."""
-        cached_data = self.redis_client.get("latest_optimization")
+        cached_data = await self.cache.get("latest_optimization")
         if not cached_data:
             return {"error": "No recent optimization data available"}
         
@@ -528,34 +1104,343 @@ class RouteOptimizer:
 
 # FastAPI endpoints for the service
 from fastapi import FastAPI, HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
 
 app = FastAPI(title="AI Route Optimizer", version="1.0.0")
-optimizer = RouteOptimizer()
+road_graph_path = os.getenv("ROAD_GRAPH_PATH")
+optimizer = RouteOptimizer(
+    distance_method="road" if road_graph_path else "haversine",
+    road_graph_path=road_graph_path,
+    speed_profile_path=os.getenv("SPEED_PROFILE_PATH"),
+    model_dir=os.getenv("MODEL_DIR", "models"),
+    # Never train on the import path; models come from training.py
+    model_loading=os.getenv("MODEL_LOADING", "background"),
+    train_if_missing=os.getenv("TRAIN_IF_MISSING", "0") == "1",
+    max_sessions=int(os.getenv("MAX_SESSIONS", "32")),
+    shared_data=os.getenv("SHARED_DATA", "0") == "1",
+    model_refresh_interval=float(os.getenv("MODEL_REFRESH_SECONDS", "0"))
+)
+# Bounds concurrent solves; requests beyond the queue depth are rejected with 429
+job_queue = JobQueue(
+    max_concurrency=int(os.getenv("MAX_CONCURRENT_SOLVES", "2")),
+    max_queue=int(os.getenv("MAX_QUEUED_SOLVES", "16"))
+)
+QUEUE_DEPTH.set_function(lambda: job_queue.depth)
+SESSIONS.set_function(lambda: len(optimizer.sessions))
 
 class OptimizationRequest(BaseModel):
-    vehicles: List[Dict]
-    trips: List[Dict]
-    strategy: str = "balanced"
+    # Validated straight into the dataclasses, nested locations and ISO 8601 windows included
+    vehicles: List[Vehicle]
+    trips: List[Trip]
+    strategy: Literal["fuel_efficient", "time_optimal", "balanced"] = "balanced"
+    time_budget: Optional[float] = Field(None, ge=0)
+    # When vehicles leave; time windows, speed profiles and model features use it (defaults to now)
+    departure_time: Optional[datetime] = None
+
+class TripColumnsModel(BaseModel):
+    """Trips as parallel arrays with one entry per trip; see columnar.TRIP_COLUMNS."""
+    id: List[str]
+    pickup_latitude: List[float]
+    pickup_longitude: List[float]
+    delivery_latitude: List[float]
+    delivery_longitude: List[float]
+    weight: List[float]
+    priority: List[int]
+    ready_time: Optional[List[Optional[datetime]]] = None
+    due_time: Optional[List[Optional[datetime]]] = None
+    estimated_duration: Optional[List[float]] = None
+
+class ColumnarOptimizationRequest(OptimizationRequest):
+    trips: TripColumnsModel
+
+ENCODINGS = ("full", "compact")
+
+def _pickup_indices(vehicles: List[Vehicle], trips: Sequence[Trip]) -> Dict[str, int]:
+    """Compact index of each trip's pickup, by trip id; its delivery is the next index.
+    
+    Indices address the request's locations: vehicle locations in request
+    order, then each trip's pickup and delivery.
+    """
+    return {trip_id: len(vehicles) + 2 * k for k, trip_id in enumerate(trip_ids(trips))}
+
+def _route_body(route: OptimizedRoute, pickup_index: Optional[Dict[str, int]] = None) -> Dict:
+    """A route as sent to clients; with pickup_index, in the compact encoding.
+    
+    The compact encoding lists trip ids instead of trips and request
+    location indices (see _pickup_indices) instead of waypoints.
+    """
+    if pickup_index is None:
+        return route.__dict__
+    location_index = {}
+    for trip in route.trips:
+        location_index[id(trip.pickup)] = pickup_index[trip.id]
+        location_index[id(trip.delivery)] = pickup_index[trip.id] + 1
+    return {
+        "vehicle_id": route.vehicle_id,
+        "trip_ids": [trip.id for trip in route.trips],
+        "total_distance": route.total_distance,
+        "total_duration": route.total_duration,
+        "fuel_cost": route.fuel_cost,
+        "efficiency_score": route.efficiency_score,
+        "waypoints": [location_index[id(location)] for location in route.waypoints]
+    }
+
+def _parse_request(request: OptimizationRequest) -> Tuple[List[Vehicle], Sequence[Trip]]:
+    """Vehicles and trips of a request; columnar trips stay array-backed.
+    
+    Raises ValueError for trip columns that fail validation.
+    """
+    if isinstance(request.trips, TripColumnsModel):
+        return request.vehicles, TripColumns.from_columns(dict(request.trips), Trip, Location)
+    return request.vehicles, request.trips
+
+def _unassigned_trips(trips: Sequence[Trip], routes: List[OptimizedRoute]) -> List[str]:
+    assigned = {trip.id for route in routes for trip in route.trips}
+    return [trip_id for trip_id in trip_ids(trips) if trip_id not in assigned]
+
+async def _optimize_request(
+    vehicles: List[Vehicle],
+    trips: Sequence[Trip],
+    strategy: str,
+    time_budget: Optional[float],
+    departure_time: Optional[datetime] = None,
+    encoding: str = "full"
+) -> Dict:
+    """Run one parsed optimization request and build its response body."""
+    routes = await optimizer.optimize_routes(
+        vehicles, trips, strategy, time_budget=time_budget, departure_time=departure_time
+    )
+    pickup_index = _pickup_indices(vehicles, trips) if encoding == "compact" else None
+    
+    return {
+        "status": "success",
+        "encoding": encoding,
+        "routes": [_route_body(route, pickup_index) for route in routes],
+        "unassigned_trips": _unassigned_trips(trips, routes),
+        "metrics": await optimizer.get_optimization_metrics()
+    }
+
+async def _queued_optimization(debug: bool, *args) -> Dict:
+    """Run _optimize_request(*args) through the job queue; with debug, attach its stage trace."""
+    trace = Trace() if debug else None
+    with tracing(trace):
+        body = await job_queue.run(_optimize_request, *args)
+    if trace is not None:
+        body["trace"] = trace.to_dict()
+    return body
+
+def _ndjson(data: Dict) -> bytes:
+    return json.dumps(jsonable_encoder(data), separators=(",", ":")).encode() + b"\n"
+
+async def _stream_optimization(
+    vehicles: List[Vehicle],
+    trips: List[Trip],
+    solve: asyncio.Future,
+    routes: asyncio.Queue,
+    pickup_index: Optional[Dict[str, int]]
+):
+    """NDJSON lines: a start line, one route line per vehicle as it is final, then a summary.
+    
+    If the solve fails after routes were sent, the last line is an error.
+    """
+    finished = object()
+    solve.add_done_callback(lambda _: routes.put_nowait(finished))
+    yield _ndjson({
+        "type": "start",
+        "encoding": "full" if pickup_index is None else "compact",
+        "vehicles": len(vehicles),
+        "trips": len(trips)
+    })
+    
+    while True:
+        route = await routes.get()
+        if route is finished:
+            break
+        yield _ndjson({"type": "route", "route": _route_body(route, pickup_index)})
+    
+    try:
+        optimized_routes = solve.result()
+    except Exception as e:
+        yield _ndjson({"type": "error", "detail": str(e)})
+        return
+    yield _ndjson({
+        "type": "summary",
+        "unassigned_trips": _unassigned_trips(trips, optimized_routes),
+        "metrics": await optimizer.get_optimization_metrics()
+    })
+
+class SessionOperation(BaseModel):
+    """One change to a planning session; see PlanningSession.apply for the fields each op needs."""
+    op: Literal["add_trip", "remove_trip", "move_vehicle", "vehicle_unavailable"]
+    trip: Optional[Trip] = None
+    trip_id: Optional[str] = None
+    vehicle_id: Optional[str] = None
+    location: Optional[Location] = None
+
+class SessionChangeRequest(BaseModel):
+    operations: List[SessionOperation]
+
+def _session_body(session: PlanningSession, routes: List[OptimizedRoute]) -> Dict:
+    return {
+        "session_id": session.id,
+        "version": session.version,
+        "routes": [route.__dict__ for route in routes],
+        "unassigned_trips": session.unassigned_trip_ids
+    }
+
+def _parse_operation(operation: SessionOperation) -> Dict:
+    """A session change as the dict PlanningSession.apply takes, without unset fields."""
+    return {name: value for name, value in operation if value is not None}
+
+async def _create_session_request(request: OptimizationRequest) -> Dict:
+    session, routes = await optimizer.create_session(
+        request.vehicles, request.trips, time_budget=request.time_budget,
+        departure_time=request.departure_time
+    )
+    return _session_body(session, routes)
+
+@app.on_event("startup")
+async def start_background_model_loading():
+    if optimizer.model_loading == "background":
+        optimizer.start_model_loading()
+
+@app.on_event("shutdown")
+async def close_cache():
+    await optimizer.cache.close()
 
 @app.post("/optimize-routes")
-async def optimize_routes_endpoint(request: OptimizationRequest):
-    """Optimize routes for given vehicles and trips."""
+async def optimize_routes_endpoint(request: OptimizationRequest, encoding: str = "full", debug: bool = False):
+    """Optimize routes for given vehicles and trips.
+    
+    encoding=compact sends trip ids and location indices instead of full objects.
+    debug=true adds a trace with the seconds spent in each stage.
+    """
+    if encoding not in ENCODINGS:
+        raise HTTPException(status_code=400, detail=f"encoding must be one of {ENCODINGS}")
     try:
-        # Convert dictionaries to dataclasses
-        vehicles = [Vehicle(**v) for v in request.vehicles]
-        trips = [Trip(**t) for t in request.trips]
-        
-        routes = await optimizer.optimize_routes(vehicles, trips, request.strategy)
-        
-        return {
-            "status": "success",
-            "routes": [route.__dict__ for route in routes],
-            "metrics": optimizer.get_optimization_metrics()
-        }
+        return await _queued_optimization(
+            debug, *_parse_request(request), request.strategy, request.time_budget,
+            request.departure_time, encoding
+        )
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/optimize-routes/columnar")
+async def optimize_columnar_endpoint(
+    request: ColumnarOptimizationRequest,
+    encoding: str = "compact",
+    debug: bool = False
+):
+    """Optimize routes for trips sent as parallel arrays, for requests with many trips.
+    
+    The trip columns are validated as arrays; trip objects are only built
+    for the stages that need them. Responses default to the compact encoding.
+    """
+    if encoding not in ENCODINGS:
+        raise HTTPException(status_code=400, detail=f"encoding must be one of {ENCODINGS}")
+    try:
+        vehicles, trips = _parse_request(request)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        return await _queued_optimization(
+            debug, vehicles, trips, request.strategy, request.time_budget,
+            request.departure_time, encoding
+        )
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/optimize-routes/stream")
+async def stream_optimization_endpoint(request: OptimizationRequest, encoding: str = "compact"):
+    """Optimize routes and stream them as NDJSON, each vehicle's route as soon as it is final.
+    
+    When time_optimal solves clusters in parallel, the routes of a cluster
+    that placed all its trips are sent as it finishes; other routes follow
+    once the solve is done.
+    """
+    if encoding not in ENCODINGS:
+        raise HTTPException(status_code=400, detail=f"encoding must be one of {ENCODINGS}")
+    vehicles, trips = _parse_request(request)
+    routes = asyncio.Queue()
+    try:
+        solve = job_queue.start(
+            optimizer.optimize_routes, vehicles, trips, request.strategy,
+            time_budget=request.time_budget, departure_time=request.departure_time,
+            on_route=routes.put_nowait
+        )
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    
+    pickup_index = _pickup_indices(vehicles, trips) if encoding == "compact" else None
+    return StreamingResponse(
+        _stream_optimization(vehicles, trips, solve, routes, pickup_index),
+        media_type="application/x-ndjson"
+    )
+
+@app.post("/optimize-routes/jobs", status_code=202)
+async def submit_optimization_job(request: OptimizationRequest):
+    """Queue an optimization and return its job id for polling."""
+    try:
+        job = job_queue.submit(
+            _optimize_request, *_parse_request(request), request.strategy, request.time_budget,
+            request.departure_time
+        )
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    return job.to_dict()
+
+@app.get("/optimize-routes/jobs/{job_id}")
+async def get_optimization_job(job_id: str, wait: float = 0):
+    """Job status and result; wait > 0 long-polls for up to that many seconds."""
+    job = await job_queue.wait(job_id, min(wait, 60))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+@app.post("/sessions", status_code=201)
+async def create_session_endpoint(request: OptimizationRequest):
+    """Plan routes and keep the plan for incremental changes; strategy is always time_optimal."""
+    try:
+        return await job_queue.run(_create_session_request, request)
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/sessions/{session_id}/changes")
+async def update_session_endpoint(session_id: str, request: SessionChangeRequest):
+    """Apply add_trip, remove_trip, move_vehicle and vehicle_unavailable changes.
+    
+    Returns only the routes that changed.
+    """
+    try:
+        operations = [_parse_operation(op) for op in request.operations]
+        updated = await optimizer.update_session(session_id, operations)
+    except (KeyError, TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if updated is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return _session_body(*updated)
+
+@app.get("/sessions/{session_id}")
+async def get_session_endpoint(session_id: str):
+    """The session's current plan."""
+    found = await optimizer.get_session(session_id)
+    if found is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return _session_body(*found)
+
+@app.delete("/sessions/{session_id}", status_code=204)
+async def delete_session_endpoint(session_id: str):
+    if not optimizer.sessions.delete(session_id):
+        raise HTTPException(status_code=404, detail="Session not found")
+
 @app.get("/route-suggestions/{vehicle_id}")
 async def get_route_suggestions_endpoint(vehicle_id: str, lat: float, lng: float):
     """Get real-time route suggestions for a vehicle."""
@@ -566,10 +1451,28 @@ async def get_route_suggestions_endpoint(vehicle_id: str, lat: float, lng: float
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/health")
+async def health_check():
+    """Liveness: the process is up and serving."""
+    return {"status": "healthy"}
+
+@app.get("/ready")
+async def readiness_check():
+    """Readiness: 503 while models are loading or failed to load."""
+    status = optimizer.model_status()
+    if status["status"] in ("loading", "failed"):
+        raise HTTPException(status_code=503, detail=status)
+    return status
+
 @app.get("/metrics")
 async def get_metrics_endpoint():
     """Get optimization performance metrics."""
-    return optimizer.get_optimization_metrics()
+    return await optimizer.get_optimization_metrics()
+
+@app.get("/metrics/prometheus")
+async def get_prometheus_metrics_endpoint():
+    """Stage latencies, cache, model and queue counters in the Prometheus text format."""
+    return Response(REGISTRY.render(), media_type="text/plain; version=0.0.4")
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,136 @@
+import numpy as np
+from typing import Dict, List, Optional, Sequence
+
+from time_windows import EPSILON
+
+
+class FleetRouteState:
+    """Array-backed running state of every vehicle's route.
+
+    Vehicles are addressed by their position in the vehicle list and trips by
+    their position in the trip list. Assigning a trip updates load, last stop,
+    distance and duration in O(1), so strategies never re-sum a route.
+
+    Trips are appended pickup then delivery, so a route's only time constraint
+    for a new trip is its own window: duration is the clock at the end of
+    the route, including waits for ready times and service times, and
+    feasible() checks capacity and the due time against it for many vehicles
+    at once.
+    """
+
+    __slots__ = (
+        "distance_matrix", "average_speed", "capacity", "fuel_efficiency",
+        "start_location", "load", "last_location", "distance", "duration",
+        "trip_indices", "ready_times", "due_times", "service_times",
+    )
+
+    def __init__(
+        self,
+        vehicles: Sequence,
+        vehicle_indices: np.ndarray,
+        distance_matrix,
+        average_speed: float = 40.0,
+        ready_times: Optional[np.ndarray] = None,
+        due_times: Optional[np.ndarray] = None,
+        service_times: Optional[np.ndarray] = None
+    ):
+        """Time windows are hours after departure; without them trips are untimed."""
+        self.distance_matrix = distance_matrix
+        self.average_speed = average_speed
+        self.capacity = np.array([v.capacity for v in vehicles], dtype=np.float64)
+        self.fuel_efficiency = np.array([v.fuel_efficiency for v in vehicles], dtype=np.float64)
+        self.start_location = np.array(vehicle_indices, dtype=np.intp)
+        self.load = np.zeros(len(vehicles), dtype=np.float64)
+        self.last_location = np.array(vehicle_indices, dtype=np.intp)
+        self.distance = np.zeros(len(vehicles), dtype=np.float64)
+        self.duration = np.zeros(len(vehicles), dtype=np.float64)
+        self.trip_indices: List[List[int]] = [[] for _ in vehicles]
+        self.ready_times = ready_times
+        self.due_times = due_times
+        self.service_times = service_times
+
+    def __len__(self) -> int:
+        return len(self.trip_indices)
+
+    def _delivery_arrival(self, v, trip_index: int, pickup_index: int, delivery_index: int):
+        """When vehicle(s) v would reach the trip's delivery if it were appended."""
+        legs = self.distance_matrix.pairs(
+            np.atleast_1d(self.last_location[v]), np.full(np.size(v), pickup_index)
+        )
+        arrival = self.duration[v] + legs / self.average_speed
+        if self.ready_times is not None:
+            arrival = np.maximum(arrival, self.ready_times[trip_index])
+        if self.service_times is not None:
+            arrival = arrival + self.service_times[trip_index]
+        return arrival + self.distance_matrix.distance(pickup_index, delivery_index) / self.average_speed
+
+    def feasible(
+        self,
+        v,
+        trip_index: int,
+        weight: float,
+        pickup_index: int,
+        delivery_index: int
+    ) -> np.ndarray:
+        """Whether appending the trip keeps each vehicle in v within capacity and on time."""
+        ok = self.load[v] + weight <= self.capacity[v] + EPSILON
+        if self.due_times is not None and np.isfinite(self.due_times[trip_index]):
+            ok &= (
+                self._delivery_arrival(v, trip_index, pickup_index, delivery_index)
+                <= self.due_times[trip_index] + EPSILON
+            ).reshape(np.shape(ok))
+        return ok
+
+    def feasible_pairs(
+        self,
+        v: np.ndarray,
+        trip_indices: np.ndarray,
+        weights: np.ndarray,
+        legs: np.ndarray,
+        trip_legs: np.ndarray
+    ) -> np.ndarray:
+        """feasible() element-wise over vehicle and trip arrays.
+
+        legs are the distances from each vehicle's last stop to the trip's
+        pickup and trip_legs from the pickup to the delivery, both already
+        looked up by the caller.
+        """
+        ok = self.load[v] + weights <= self.capacity[v] + EPSILON
+        if self.due_times is not None:
+            arrival = self.duration[v] + legs / self.average_speed
+            if self.ready_times is not None:
+                arrival = np.maximum(arrival, self.ready_times[trip_indices])
+            if self.service_times is not None:
+                arrival = arrival + self.service_times[trip_indices]
+            arrival = arrival + trip_legs / self.average_speed
+            ok &= arrival <= self.due_times[trip_indices] + EPSILON
+        return ok
+
+    def assign(
+        self,
+        v: int,
+        trip_index: int,
+        weight: float,
+        pickup_index: int,
+        delivery_index: int
+    ):
+        """Append a trip to vehicle v's route and advance its running totals."""
+        leg = (
+            self.distance_matrix.distance(self.last_location[v], pickup_index)
+            + self.distance_matrix.distance(pickup_index, delivery_index)
+        )
+        if self.ready_times is None and self.service_times is None:
+            self.duration[v] += leg / self.average_speed
+        else:
+            self.duration[v] = self._delivery_arrival(v, trip_index, pickup_index, delivery_index)[0]
+        self.trip_indices[v].append(trip_index)
+        self.load[v] += weight
+        self.last_location[v] = delivery_index
+        self.distance[v] += leg
+
+    def routes(self, vehicles: Sequence, trips: Sequence) -> Dict[str, List]:
+        """Materialize assignments as vehicle id -> ordered trips."""
+        return {
+            vehicle.id: [trips[k] for k in self.trip_indices[v]]
+            for v, vehicle in enumerate(vehicles)
+        }
@@ -0,0 +1,203 @@
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import replace
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from distance_engine import DistanceOracle
+from local_search import LocalSearchSolver, routing_problem
+
+OPERATIONS = ("add_trip", "remove_trip", "move_vehicle", "vehicle_unavailable")
+
+
+class PlanningSession:
+    """A solved plan kept between requests, so changes repair it instead of re-solving.
+
+    Holds the request's vehicles and trips, the distance matrix over their
+    locations and the solver with its routes. Each change touches only the
+    routes involved: new locations get just their own matrix rows, removed
+    or displaced trips are re-inserted at their cheapest feasible positions
+    and only the routes that changed are improved.
+    """
+
+    def __init__(
+        self,
+        vehicles: List,
+        trips: List,
+        distance_matrix: DistanceOracle,
+        solver: LocalSearchSolver,
+        traffic_data: Dict,
+        departure_time: datetime
+    ):
+        self.id = uuid.uuid4().hex
+        self.vehicles = vehicles
+        # Trip list positions are solver trip indices; removed trips leave None
+        self.trips: List = list(trips)
+        self.distance_matrix = distance_matrix
+        self.solver = solver
+        self.traffic_data = traffic_data
+        self.departure_time = departure_time
+        self.version = 1
+        self.updated_at = time.time()
+        self.lock: Optional[asyncio.Lock] = None
+        self._vehicle_index = {v.id: k for k, v in enumerate(vehicles)}
+        self._trip_index = {t.id: k for k, t in enumerate(trips)}
+
+    @property
+    def unassigned_trip_ids(self) -> List[str]:
+        return [self.trips[k].id for k in self.solver.unassigned]
+
+    def route(self, v: int) -> Tuple[List, List, float]:
+        """Trips, stop locations and hours to complete of vehicle v's route."""
+        stops = self.solver.routes[v]
+        trips = [self.trips[stop >> 1] for stop in stops if not stop & 1]
+        waypoints = [
+            self.trips[stop >> 1].delivery if stop & 1 else self.trips[stop >> 1].pickup
+            for stop in stops
+        ]
+        completion = self.solver.completion_times([stops])[0] if stops else 0.0
+        return trips, waypoints, float(completion)
+
+    def _vehicle(self, vehicle_id: str) -> int:
+        try:
+            return self._vehicle_index[vehicle_id]
+        except KeyError:
+            raise ValueError(f"Unknown vehicle '{vehicle_id}'")
+
+    def _add_trips(self, trips: Sequence) -> List[int]:
+        """Append trips to the problem; returns their solver indices."""
+        if not trips:
+            return []
+        self.distance_matrix.extend([loc for t in trips for loc in (t.pickup, t.delivery)])
+        added = routing_problem(
+            self.distance_matrix, [], trips,
+            self.solver.problem.average_speed, self.departure_time
+        )
+        problem = self.solver.problem
+        self.solver.extend(replace(
+            problem,
+            pickups=np.concatenate((problem.pickups, added.pickups)),
+            deliveries=np.concatenate((problem.deliveries, added.deliveries)),
+            weights=np.concatenate((problem.weights, added.weights)),
+            ready_times=np.concatenate((problem.ready_times, added.ready_times)),
+            due_times=np.concatenate((problem.due_times, added.due_times)),
+            service_times=np.concatenate((problem.service_times, added.service_times))
+        ))
+        indices = list(range(len(self.trips), len(self.trips) + len(trips)))
+        for k, trip in zip(indices, trips):
+            self.trips.append(trip)
+            self._trip_index[trip.id] = k
+        return indices
+
+    def apply(self, operations: Sequence[Dict], time_budget: float = 0.05) -> List[int]:
+        """Apply changes in order and repair the plan; returns positions of vehicles whose routes changed.
+
+        Operations are dicts with an "op" of:
+            add_trip             {"trip": Trip}
+            remove_trip          {"trip_id": str}, e.g. cancelled or delivered
+            move_vehicle         {"vehicle_id": str, "location": Location}
+            vehicle_unavailable  {"vehicle_id": str}
+        All operations are validated before any is applied.
+        """
+        known_trips = set(self._trip_index)
+        removed_trips = set()
+        for operation in operations:
+            if operation.get("op") not in OPERATIONS:
+                raise ValueError(f"Unknown operation '{operation.get('op')}', expected one of {OPERATIONS}")
+            if operation["op"] == "add_trip":
+                if operation.get("trip") is None:
+                    raise ValueError("add_trip needs a trip")
+                if operation["trip"].id in known_trips:
+                    raise ValueError(f"Trip '{operation['trip'].id}' is already planned")
+                # Trips are added before removals run, so an id cannot be reused in one change
+                if operation["trip"].id in removed_trips:
+                    raise ValueError(f"Trip '{operation['trip'].id}' is removed in the same change")
+                known_trips.add(operation["trip"].id)
+            if operation["op"] == "remove_trip":
+                if operation.get("trip_id") not in known_trips:
+                    raise ValueError(f"Unknown trip '{operation.get('trip_id')}'")
+                # A second removal of the same trip is rejected too
+                known_trips.discard(operation["trip_id"])
+                removed_trips.add(operation["trip_id"])
+            if operation["op"] in ("move_vehicle", "vehicle_unavailable"):
+                self._vehicle(operation.get("vehicle_id"))
+            if operation["op"] == "move_vehicle" and operation.get("location") is None:
+                raise ValueError("move_vehicle needs a location")
+
+        solver = self.solver
+        changed = set()
+        # Vehicles with room or time freed, where earlier leftovers may now fit
+        freed = set()
+        pending = self._add_trips([op["trip"] for op in operations if op["op"] == "add_trip"])
+        for operation in operations:
+            op = operation["op"]
+            if op == "remove_trip":
+                k = self._trip_index.pop(operation["trip_id"])
+                v = solver.remove(k)
+                changed.add(v)
+                freed.add(v)
+                self.trips[k] = None
+                pending = [t for t in pending if t != k]
+            elif op == "move_vehicle":
+                v = self._vehicle(operation["vehicle_id"])
+                location = operation["location"]
+                solver.problem.vehicle_locations[v] = self.distance_matrix.extend([location])[0]
+                self.vehicles[v] = replace(self.vehicles[v], current_location=location)
+                pending.extend(solver.reroute(v))
+                changed.add(v)
+                freed.add(v)
+            elif op == "vehicle_unavailable":
+                v = self._vehicle(operation["vehicle_id"])
+                pending.extend(solver.disable(v))
+                changed.add(v)
+
+        changed.update(solver.insert(pending, time_budget, freed))
+        changed.discard(-1)
+        self.version += 1
+        self.updated_at = time.time()
+        return sorted(changed)
+
+
+class SessionStore:
+    """In-process planning sessions, dropped after ttl seconds without use.
+
+    Sessions hold solver state and distance matrices, so at most
+    max_sessions are kept; the least recently used is dropped first.
+    """
+
+    def __init__(self, max_sessions: int = 32, ttl: float = 3600):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions: "OrderedDict[str, PlanningSession]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def add(self, session: PlanningSession):
+        self._expire()
+        self._sessions[session.id] = session
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    def get(self, session_id: str) -> Optional[PlanningSession]:
+        self._expire()
+        session = self._sessions.get(session_id)
+        if session is not None:
+            self._sessions.move_to_end(session_id)
+        return session
+
+    def delete(self, session_id: str) -> bool:
+        return self._sessions.pop(session_id, None) is not None
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        expired = [
+            session_id for session_id, session in self._sessions.items()
+            if session.updated_at < cutoff
+        ]
+        for session_id in expired:
+            del self._sessions[session_id]
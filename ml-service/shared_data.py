@@ -0,0 +1,96 @@
+"""Read-only arrays shared by worker processes through memory-mapped files.
+
+Every uvicorn worker builds its own RouteOptimizer, so arrays loaded from
+.npz files are decompressed and copied once per worker. map_npz instead
+exports a file's arrays once, as plain .npy files next to it, and maps them
+read-only: the OS page cache then holds one copy for all workers, and a
+worker opening them parses nothing.
+"""
+import logging
+import os
+import shutil
+import tempfile
+import time
+from typing import Dict
+
+import numpy as np
+
+ARRAYS_SUFFIX = ".arrays"
+# Exports of replaced files are removed once this old; workers swap long before
+STALE_SECONDS = 600
+# Smaller arrays, scalars included, are read into memory instead of mapped
+MMAP_MIN_BYTES = 4096
+
+logger = logging.getLogger(__name__)
+
+
+def _stamp(stat: os.stat_result) -> str:
+    return f"{stat.st_ino:x}-{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+
+def file_stamp(path: str) -> str:
+    """Identity of a file's current content; changes when the file is replaced."""
+    return _stamp(os.stat(path))
+
+
+def map_npz(path: str) -> Dict[str, np.ndarray]:
+    """Arrays of an .npz file, memory-mapped read-only from their exported copies.
+
+    Exports live in <path>.arrays/<stamp>/ where stamp identifies the file
+    content they were read from, so a file replaced with os.replace gets a
+    new export and workers still mapping the old one are unaffected.
+    """
+    for attempt in range(3):
+        try:
+            return _map_npz(path)
+        except FileNotFoundError:
+            # An export was cleaned up between listing and opening it
+            if attempt == 2 or not os.path.exists(path):
+                raise
+
+
+def _map_npz(path: str) -> Dict[str, np.ndarray]:
+    root = path + ARRAYS_SUFFIX
+    with open(path, "rb") as f:
+        stamp = _stamp(os.fstat(f.fileno()))
+        directory = os.path.join(root, stamp)
+        if not os.path.isdir(directory):
+            with np.load(f) as data:
+                arrays = {name: data[name] for name in data.files}
+            try:
+                _export(root, directory, arrays)
+            except PermissionError as e:
+                logger.warning(f"Cannot export {path} for sharing, keeping a private copy: {e}")
+                return arrays
+            _remove_stale(root, stamp)
+    arrays = {}
+    for name in os.listdir(directory):
+        if name.endswith(".npy"):
+            path = os.path.join(directory, name)
+            mode = "r" if os.path.getsize(path) >= MMAP_MIN_BYTES else None
+            arrays[name[:-len(".npy")]] = np.load(path, mmap_mode=mode)
+    return arrays
+
+
+def _export(root: str, directory: str, arrays: Dict[str, np.ndarray]):
+    """Write arrays to directory in one rename, so readers see all of them or none."""
+    os.makedirs(root, exist_ok=True)
+    staging = tempfile.mkdtemp(dir=root, prefix=".staging-")
+    for name, array in arrays.items():
+        np.save(os.path.join(staging, f"{name}.npy"), array)
+    try:
+        os.rename(staging, directory)
+    except OSError:
+        # Another worker exported the same file first
+        shutil.rmtree(staging, ignore_errors=True)
+        if not os.path.isdir(directory):
+            raise
+
+
+def _remove_stale(root: str, keep: str):
+    # Mapped files stay readable after removal; only new maps need the directory
+    cutoff = time.time() - STALE_SECONDS
+    for entry in os.listdir(root):
+        path = os.path.join(root, entry)
+        if entry != keep and os.path.getmtime(path) < cutoff:
+            shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,54 @@
+"""Cold-start benchmark for the ML service.
+
+    python startup_benchmark.py --runs 5
+
+Each run starts a fresh interpreter per model loading mode and reports how
+long importing the ASGI app takes, i.e. until uvicorn could accept traffic,
+and how long until the efficiency model is ready. Train models first with
+training.py, or set TRAIN_IF_MISSING=1 to include training in the ready time.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+PROBE = """
+import asyncio, json, time
+start = time.perf_counter()
+import main
+from route_optimizer import optimizer
+imported = time.perf_counter() - start
+asyncio.run(optimizer.ensure_models())
+print(json.dumps({"import_s": imported, "ready_s": time.perf_counter() - start}))
+"""
+
+
+def measure(mode: str) -> dict:
+    env = dict(os.environ, MODEL_LOADING=mode)
+    completed = subprocess.run(
+        [sys.executable, "-c", PROBE],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+        capture_output=True,
+        text=True
+    )
+    if completed.returncode != 0:
+        sys.exit(f"{mode} run failed:\n{completed.stderr}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure service cold-start time.")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'mode':<12}{'import (s)':>12}{'ready (s)':>12}")
+    for mode in ("background", "eager"):
+        runs = [measure(mode) for _ in range(args.runs)]
+        print(
+            f"{mode:<12}"
+            f"{statistics.median(r['import_s'] for r in runs):>12.3f}"
+            f"{statistics.median(r['ready_s'] for r in runs):>12.3f}"
+        )
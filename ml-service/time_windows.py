@@ -0,0 +1,132 @@
+from datetime import datetime
+
+import numpy as np
+
+EPSILON = 1e-6
+
+
+def to_datetime(value) -> datetime:
+    """Accept datetimes as given and ISO 8601 strings as sent over JSON."""
+    if isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+
+
+class RouteSchedule:
+    """Arrival, slack and forward time slack of every position on one route.
+
+    Position 0 is the vehicle's start, left at time 0; positions 1..n are its
+    stops. A stop is reached at its arrival time, starts no earlier than its
+    ready time and must start no later than its latest time; it is left after
+    its service time. Times are hours after departure.
+
+    slack[k] is how much later stop k could start and still be on time.
+    forward_slack[k] is how much later stop k could be reached without any
+    stop from k onward starting late: waiting at a stop absorbs a delay
+    before it reaches later stops, so
+
+        forward_slack[k] = wait[k] + min(slack[k], forward_slack[k + 1])
+
+    With these, whether a delay is feasible for the rest of the route is a
+    single comparison instead of a re-simulation.
+    """
+
+    __slots__ = ("arrival", "departure", "slack", "forward_slack", "cumulative_wait")
+
+    def __init__(
+        self,
+        travel: np.ndarray,
+        ready: np.ndarray,
+        latest: np.ndarray,
+        service: np.ndarray
+    ):
+        """travel[k] is the driving time into stop k + 1 from the position before it."""
+        n = len(travel)
+        arrival = np.zeros(n + 1)
+        start = np.zeros(n + 1)
+        departure = np.zeros(n + 1)
+        clock = 0.0
+        for k in range(n):
+            arrival[k + 1] = clock + travel[k]
+            start[k + 1] = max(arrival[k + 1], ready[k])
+            clock = departure[k + 1] = start[k + 1] + service[k]
+
+        wait = start - arrival
+        slack = np.empty(n + 1)
+        slack[0] = np.inf
+        slack[1:] = latest - start[1:]
+        forward_slack = np.empty(n + 2)
+        forward_slack[n + 1] = np.inf
+        for k in range(n, -1, -1):
+            forward_slack[k] = wait[k] + min(slack[k], forward_slack[k + 1])
+
+        self.arrival = arrival
+        self.departure = departure
+        self.slack = slack
+        self.forward_slack = forward_slack
+        self.cumulative_wait = np.cumsum(wait)
+
+    @property
+    def feasible(self) -> bool:
+        return bool(self.slack.min() >= -EPSILON) if len(self.slack) else True
+
+    @property
+    def completion(self) -> float:
+        """Time the route's last stop is left."""
+        return float(self.departure[-1])
+
+    def insertion_feasible(
+        self,
+        pickup_slots: np.ndarray,
+        delivery_slots: np.ndarray,
+        to_pickup: np.ndarray,
+        pickup_to_next: np.ndarray,
+        to_delivery: np.ndarray,
+        delivery_to_next: np.ndarray,
+        pickup_to_delivery: float,
+        ready: float,
+        service: float,
+        due: float
+    ) -> np.ndarray:
+        """Which (pickup slot, delivery slot) insertions keep every stop on time.
+
+        Slot i places a stop after position i (j >= i for the delivery). The
+        travel arrays are driving times per slot: from position i to the new
+        stop, and from the new stop to position i + 1 (unused at the last
+        slot). The new pickup has the given ready and service time and the new
+        delivery must arrive by due.
+        """
+        n = len(self.arrival) - 1
+        i, j = pickup_slots, delivery_slots
+        pickup_departure = np.maximum(self.departure + to_pickup, ready) + service
+        # Arrival delay the pickup pushes onto the stop after it
+        pushed = np.full(n + 1, np.inf)
+        pushed[:n] = pickup_departure[:n] + pickup_to_next[:n] - self.arrival[1:]
+
+        # Stops between pickup and delivery absorb the delay with their waits:
+        # stop k starts max(0, pushed[i] - (W[k] - W[i])) late, for W the
+        # cumulative wait, so all of them are on time iff
+        # pushed[i] + W[i] <= min(slack[k] + W[k]) over i < k <= j
+        tolerance = self.slack + self.cumulative_wait
+        between = np.where(
+            np.arange(n + 1)[None, :] > np.arange(n + 1)[:, None], tolerance[None, :], np.inf
+        )
+        np.minimum.accumulate(between, axis=1, out=between)
+        same = i == j
+        ok = same | (pushed[i] + self.cumulative_wait[i] <= between[i, j] + EPSILON)
+
+        shift = np.maximum(0.0, pushed[i] - (self.cumulative_wait[j] - self.cumulative_wait[i]))
+        delivery_arrival = np.where(
+            same,
+            pickup_departure[i] + pickup_to_delivery,
+            self.departure[j] + shift + to_delivery[j]
+        )
+        ok &= delivery_arrival <= due + EPSILON
+
+        # Delay the delivery pushes onto the stop after it, within its forward slack
+        has_next = j < n
+        after = j[has_next]
+        delay = np.full(len(j), -np.inf)
+        delay[has_next] = delivery_arrival[has_next] + delivery_to_next[after] - self.arrival[after + 1]
+        ok &= delay <= self.forward_slack[np.minimum(j + 1, n + 1)] + EPSILON
+        return ok
@@ -0,0 +1,406 @@
+"""Offline training for the route efficiency model.
+
+    python training.py --model-dir models
+    python training.py --model-dir models --history trips.jsonl [--warm-start]
+
+Writes route_efficiency_model.pkl and feature_scaler.pkl, plus forest.npz,
+the compiled form the service loads at startup instead of training on its
+request path. Without --history the model is fitted to synthetic data; with
+it, to completed trips exported from the backend trips collection (JSONL,
+e.g. from mongoexport, or Parquet). Every run is also kept under
+versions/<version>/ with a metadata.json describing it.
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import shutil
+import tempfile
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from forest import CompiledForest
+from shared_data import file_stamp
+
+MODEL_FILE = "route_efficiency_model.pkl"
+SCALER_FILE = "feature_scaler.pkl"
+FOREST_FILE = "forest.npz"
+METADATA_FILE = "metadata.json"
+VERSIONS_DIR = "versions"
+ARTIFACT_FILES = (MODEL_FILE, SCALER_FILE, FOREST_FILE, METADATA_FILE)
+
+FEATURES = [
+    'distance', 'traffic_factor', 'time_of_day', 'day_of_week',
+    'weather_score', 'vehicle_efficiency', 'load_factor', 'priority_score'
+]
+
+
+def generate_training_data(n_samples: int = 10000, seed: int = 42):
+    """Generate synthetic training data for model training."""
+    import pandas as pd
+
+    np.random.seed(seed)
+
+    data = {
+        'distance': np.random.exponential(50, n_samples),  # km
+        'traffic_factor': np.random.beta(2, 2, n_samples),  # 0-1
+        'time_of_day': np.random.randint(0, 24, n_samples),  # hour
+        'day_of_week': np.random.randint(0, 7, n_samples),  # 0=Monday
+        'weather_score': np.random.beta(3, 2, n_samples),  # 0-1 (1=perfect weather)
+        'vehicle_efficiency': np.random.normal(15, 3, n_samples),  # km/l
+        'load_factor': np.random.beta(2, 2, n_samples),  # 0-1
+        'priority_score': np.random.randint(1, 6, n_samples),  # 1-5
+    }
+
+    df = pd.DataFrame(data)
+
+    # Calculate efficiency score based on features
+    df['efficiency_score'] = (
+        (100 - df['distance'] * 0.5) * df['weather_score'] *
+        (1 - df['traffic_factor'] * 0.3) * df['vehicle_efficiency'] / 20 *
+        (1 - df['load_factor'] * 0.2) * (6 - df['priority_score']) / 5
+    )
+
+    # Normalize efficiency score to 0-100
+    df['efficiency_score'] = np.clip(df['efficiency_score'], 0, 100)
+
+    return df
+
+
+# Trip export fields the features come from, with the values the service
+# assumes when a trip does not record them
+REFERENCE_SPEED = 40.0  # km/h, the service's default average_speed
+HISTORY_DEFAULTS = {
+    'trafficFactor': 0.3,
+    'weatherScore': 0.8,
+    'fuelEfficiency': 15.0,
+    'loadFactor': 0.5,
+    'priority': 3,
+}
+
+
+def _parse_dates(values) -> "pd.Series":
+    """Datetimes from ISO strings or mongoexport's {"$date": ...} wrappers, as naive UTC."""
+    import pandas as pd
+
+    values = pd.Series(values).map(lambda v: v.get('$date') if isinstance(v, dict) else v)
+    return pd.to_datetime(values, errors='coerce', utc=True).dt.tz_localize(None)
+
+
+def iter_trip_records(path: str, chunk_size: int = 10000) -> Iterator["pd.DataFrame"]:
+    """Stream a trips export as DataFrames of at most chunk_size raw records."""
+    import pandas as pd
+
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+        return
+
+    records = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                records.append(json.loads(line))
+            if len(records) == chunk_size:
+                yield pd.DataFrame.from_records(records)
+                records = []
+    if records:
+        yield pd.DataFrame.from_records(records)
+
+
+def trip_features(records: "pd.DataFrame") -> Tuple[np.ndarray, np.ndarray]:
+    """Feature matrix and observed efficiency for the completed trips in a chunk.
+
+    Features follow FEATURES, in the order the service builds them. Unless the
+    export carries an efficiencyScore, a trip's efficiency is its planned
+    driving time at REFERENCE_SPEED over the time it actually took, as 0-100.
+    """
+    if 'status' in records:
+        records = records[records['status'] == 'Completed'].reset_index(drop=True)
+    if records.empty or 'distance' not in records or 'startDate' not in records:
+        return np.empty((0, len(FEATURES))), np.empty(0)
+
+    def column(name):
+        if name not in records:
+            return np.full(len(records), HISTORY_DEFAULTS[name], dtype=float)
+        values = records[name].to_numpy(dtype=float, na_value=np.nan)
+        return np.where(np.isnan(values), HISTORY_DEFAULTS[name], values)
+
+    distance = records['distance'].to_numpy(dtype=float, na_value=np.nan)
+    start = _parse_dates(records['startDate'])
+    end = _parse_dates(records['endDate'] if 'endDate' in records else [None] * len(records))
+    hours = ((end - start).dt.total_seconds() / 3600).to_numpy(dtype=float, na_value=np.nan)
+
+    if 'efficiencyScore' in records:
+        target = records['efficiencyScore'].to_numpy(dtype=float, na_value=np.nan)
+    else:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            target = 100 * distance / REFERENCE_SPEED / hours
+    target = np.clip(target, 0, 100)
+
+    if 'loadFactor' not in records and {'weight', 'capacity'} <= set(records):
+        weight = records['weight'].to_numpy(dtype=float, na_value=np.nan)
+        capacity = records['capacity'].to_numpy(dtype=float, na_value=np.nan)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            load_factor = np.where(capacity > 0, weight / capacity, HISTORY_DEFAULTS['loadFactor'])
+    else:
+        load_factor = column('loadFactor')
+
+    features = np.column_stack([
+        distance,
+        column('trafficFactor'),
+        start.dt.hour.to_numpy(dtype=float, na_value=np.nan),
+        start.dt.weekday.to_numpy(dtype=float, na_value=np.nan),
+        column('weatherScore'),
+        column('fuelEfficiency'),
+        load_factor,
+        column('priority'),
+    ])
+    valid = (
+        np.isfinite(features).all(axis=1) & np.isfinite(target)
+        & (distance > 0) & ~(hours <= 0)
+    )
+    return features[valid], target[valid]
+
+
+def _new_version() -> str:
+    return datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+
+
+def save_artifacts(model, scaler, model_dir: str, metadata: Dict) -> "CompiledForest":
+    """Write a model version under versions/ and make it the one load_models picks up.
+
+    The version is written to a temporary directory and renamed into place;
+    the top-level files are then swapped in one by one with os.replace, so a
+    reader never sees a partially written file.
+    """
+    import joblib
+
+    forest = CompiledForest.from_sklearn(model, scaler)
+    version = metadata.setdefault('version', _new_version())
+    metadata.setdefault('created_at', datetime.now(timezone.utc).isoformat())
+    metadata.setdefault('features', FEATURES)
+    metadata['n_trees'] = len(model.estimators_)
+
+    versions_dir = os.path.join(model_dir, VERSIONS_DIR)
+    os.makedirs(versions_dir, exist_ok=True)
+    staging = tempfile.mkdtemp(dir=versions_dir, prefix=".staging-")
+    joblib.dump(model, os.path.join(staging, MODEL_FILE))
+    joblib.dump(scaler, os.path.join(staging, SCALER_FILE))
+    forest.save(os.path.join(staging, FOREST_FILE))
+    with open(os.path.join(staging, METADATA_FILE), "w") as f:
+        json.dump(metadata, f, indent=2)
+    version_dir = os.path.join(versions_dir, version)
+    os.rename(staging, version_dir)
+
+    for name in ARTIFACT_FILES:
+        temporary = os.path.join(model_dir, f".{name}.tmp")
+        shutil.copyfile(os.path.join(version_dir, name), temporary)
+        os.replace(temporary, os.path.join(model_dir, name))
+    return forest
+
+
+def current_version(model_dir: str = "models") -> Optional[Dict]:
+    """Metadata of the model load_models would pick up, or None if unversioned."""
+    try:
+        with open(os.path.join(model_dir, METADATA_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def train_from_history(
+    history_path: str,
+    model_dir: str = "models",
+    n_trees: int = 100,
+    rows_per_tree: int = 50000,
+    chunk_size: int = 10000,
+    holdout_fraction: float = 0.02,
+    warm_start: bool = False,
+    seed: int = 42
+) -> "CompiledForest":
+    """Fit the efficiency model to a trips export in two streaming passes.
+
+    The first pass counts usable trips and fits the scaler incrementally. The
+    second splits the trips into n_trees consecutive windows and grows one
+    tree per window with warm_start, on a uniform sample of at most
+    rows_per_tree trips from it, so memory is bounded by chunk_size and
+    rows_per_tree however long the history is. A small random holdout is kept
+    aside to report mean absolute error in the version metadata.
+
+    With warm_start the current model and scaler are extended with n_trees
+    trees fitted to the new history instead of starting over.
+    """
+    from sklearn.ensemble import RandomForestRegressor
+    from sklearn.preprocessing import StandardScaler
+
+    logger = logging.getLogger(__name__)
+    parent = current_version(model_dir) if warm_start else None
+    if warm_start:
+        import joblib
+
+        model = joblib.load(os.path.join(model_dir, MODEL_FILE))
+        scaler = joblib.load(os.path.join(model_dir, SCALER_FILE))
+        model.set_params(warm_start=True)
+    else:
+        model = RandomForestRegressor(
+            n_estimators=0,
+            max_depth=10,
+            warm_start=True,
+            random_state=seed
+        )
+        scaler = StandardScaler()
+
+    # Pass 1: count trips, fit the scaler
+    n_rows = 0
+    for records in iter_trip_records(history_path, chunk_size):
+        X, _ = trip_features(records)
+        if len(X) and not warm_start:
+            scaler.partial_fit(X)
+        n_rows += len(X)
+    if n_rows == 0:
+        raise ValueError(f"No completed trips with usable features in {history_path}")
+    logger.info(f"Training on {n_rows} historical trips")
+
+    # Pass 2: one tree per window of trips
+    rng = np.random.default_rng(seed)
+    window = math.ceil(n_rows / n_trees)
+    sample_rate = min(1.0, rows_per_tree / window)
+    seen = 0
+    buffer_X: List[np.ndarray] = []
+    buffer_y: List[np.ndarray] = []
+    holdout_X: List[np.ndarray] = []
+    holdout_y: List[np.ndarray] = []
+    max_holdout = max(1, int(holdout_fraction * n_rows))
+    held_out = 0
+
+    def grow(X_window, y_window):
+        model.n_estimators += 1
+        model.fit(scaler.transform(X_window), y_window)
+
+    for records in iter_trip_records(history_path, chunk_size):
+        X, y = trip_features(records)
+        start = 0
+        while start < len(X):
+            stop = min(len(X), start + window - seen)
+            X_part, y_part = X[start:stop], y[start:stop]
+            seen += stop - start
+            start = stop
+
+            # Holdout rows are drawn at random until max_holdout are set aside
+            hold = rng.random(len(X_part)) < holdout_fraction
+            hold &= held_out + np.cumsum(hold) <= max_holdout
+            holdout_X.append(X_part[hold])
+            holdout_y.append(y_part[hold])
+            held_out += int(hold.sum())
+            keep = ~hold & (rng.random(len(X_part)) < sample_rate)
+            buffer_X.append(X_part[keep])
+            buffer_y.append(y_part[keep])
+
+            if seen == window:
+                X_window, y_window = np.concatenate(buffer_X), np.concatenate(buffer_y)
+                if len(X_window):
+                    grow(X_window, y_window)
+                buffer_X, buffer_y, seen = [], [], 0
+    if buffer_X and sum(len(b) for b in buffer_X):
+        grow(np.concatenate(buffer_X), np.concatenate(buffer_y))
+
+    metadata = {
+        'source': os.path.abspath(history_path),
+        'rows': n_rows,
+        'parent_version': parent.get('version') if parent else None,
+    }
+    if held_out:
+        X_holdout, y_holdout = np.concatenate(holdout_X), np.concatenate(holdout_y)
+        predictions = model.predict(scaler.transform(X_holdout))
+        metadata['holdout_rows'] = held_out
+        metadata['holdout_mae'] = float(np.abs(predictions - y_holdout).mean())
+
+    forest = save_artifacts(model, scaler, model_dir, metadata)
+    logger.info(f"Saved model version {metadata['version']} ({forest.n_trees} trees)")
+    return forest
+
+
+def train_models(model_dir: str = "models", n_samples: int = 10000) -> CompiledForest:
+    """Fit the scaler and random forest, save them to model_dir and return the compiled forest."""
+    from sklearn.ensemble import RandomForestRegressor
+    from sklearn.preprocessing import StandardScaler
+
+    # Synthetic training data (in production, use historical data)
+    training_data = generate_training_data(n_samples)
+    X = training_data[FEATURES]
+    y = training_data['efficiency_score']
+
+    # Scale features
+    scaler = StandardScaler()
+    X_scaled = scaler.fit_transform(X)
+
+    # Train Random Forest model
+    model = RandomForestRegressor(
+        n_estimators=100,
+        max_depth=10,
+        random_state=42
+    )
+    model.fit(X_scaled, y)
+
+    # Save models, with a compiled copy for the service
+    return save_artifacts(model, scaler, model_dir, {'source': 'synthetic', 'rows': n_samples})
+
+
+def model_stamp(model_dir: str = "models") -> Optional[str]:
+    """Identity of the saved compiled forest, which changes when a new version is saved."""
+    try:
+        return file_stamp(os.path.join(model_dir, FOREST_FILE))
+    except FileNotFoundError:
+        return None
+
+
+def load_models(model_dir: str = "models", mmap: bool = False) -> CompiledForest:
+    """Load the compiled forest; raises FileNotFoundError when no model is saved.
+
+    With mmap the forest's arrays are mapped read-only, so worker processes
+    share one copy. Model directories from before the compiled format are
+    compiled from their pickles on load.
+    """
+    forest_path = os.path.join(model_dir, FOREST_FILE)
+    if os.path.exists(forest_path):
+        return CompiledForest.load(forest_path, mmap=mmap)
+
+    import joblib
+
+    model = joblib.load(os.path.join(model_dir, MODEL_FILE))
+    scaler = joblib.load(os.path.join(model_dir, SCALER_FILE))
+    return CompiledForest.from_sklearn(model, scaler)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the route efficiency model offline.")
+    parser.add_argument("--model-dir", default=os.getenv("MODEL_DIR", "models"))
+    parser.add_argument("--samples", type=int, default=10000,
+                        help="synthetic rows, when no --history is given")
+    parser.add_argument("--history", help="trips export to train on (.jsonl or .parquet)")
+    parser.add_argument("--warm-start", action="store_true",
+                        help="add trees to the current model instead of replacing it")
+    parser.add_argument("--trees", type=int, default=100)
+    parser.add_argument("--rows-per-tree", type=int, default=50000)
+    parser.add_argument("--chunk-size", type=int, default=10000)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.history:
+        train_from_history(
+            args.history,
+            args.model_dir,
+            n_trees=args.trees,
+            rows_per_tree=args.rows_per_tree,
+            chunk_size=args.chunk_size,
+            warm_start=args.warm_start
+        )
+    else:
+        train_models(args.model_dir, args.samples)
+    logging.getLogger(__name__).info(f"Models trained and saved to {args.model_dir}")
@@ -0,0 +1,237 @@
+"""Time-dependent travel times from typical speeds per zone and hour of the week.
+
+    python travel_time.py observations.csv models/speed_profiles.npz --precision 5
+
+Zones are geohash cells. A profile holds 168 hourly speeds (Monday 00:00
+first) for every zone with observations, plus a city-wide row for zones it
+has none for. Build one from GPS speed observations: a CSV with latitude,
+longitude, timestamp (ISO 8601, local time) and speed_kmh columns.
+"""
+import argparse
+import logging
+import math
+from datetime import datetime
+from typing import Sequence
+
+import numpy as np
+
+from cache_store import CacheStore
+from distance_cache import geohashes
+from metrics import CACHE_LOOKUPS
+from shared_data import map_npz
+
+HOURS_PER_WEEK = 168
+SPEED_KEY_PREFIX = "speed:"
+# Slowest speed a leg is ever timed at, so empty profile cells cannot stall a route
+MIN_SPEED = 1.0
+
+
+def hour_of_week(when: datetime) -> int:
+    return when.weekday() * 24 + when.hour
+
+
+class SpeedProfiles:
+    """Typical speeds in km/h per zone and hour of the week, loaded once into one array."""
+
+    def __init__(self, zones: Sequence[str], speeds: np.ndarray, default: np.ndarray, precision: int):
+        """speeds is (zones, 168); default is the (168,) row for unknown zones."""
+        zones = np.asarray(zones)
+        speeds = np.asarray(speeds, dtype=np.float32)
+        # Saved profiles are already sorted and clamped; mapped ones stay uncopied
+        if np.any(zones[1:] < zones[:-1]):
+            order = np.argsort(zones)
+            zones, speeds = zones[order], speeds[order]
+        if speeds.size and speeds.min() < MIN_SPEED:
+            speeds = np.maximum(speeds, MIN_SPEED)
+        self.zones = zones
+        self.speeds = speeds
+        self.default = np.maximum(np.asarray(default, dtype=np.float32), MIN_SPEED)
+        self.precision = precision
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = False) -> "SpeedProfiles":
+        """Load saved profiles; with mmap, the speeds are mapped read-only and shared between processes."""
+        if mmap:
+            data = map_npz(path)
+            return cls(data["zones"], data["speeds"], data["default"], int(data["precision"]))
+        with np.load(path) as data:
+            return cls(data["zones"], data["speeds"], data["default"], int(data["precision"]))
+
+    def save(self, path: str):
+        np.savez_compressed(
+            path, zones=self.zones, speeds=self.speeds, default=self.default,
+            precision=np.int64(self.precision)
+        )
+
+    @classmethod
+    def from_observations(
+        cls,
+        latitudes: np.ndarray,
+        longitudes: np.ndarray,
+        hours: np.ndarray,
+        speeds: np.ndarray,
+        precision: int = 5,
+        min_samples: int = 3
+    ) -> "SpeedProfiles":
+        """Mean observed speed per zone and hour of the week.
+
+        Hours with fewer than min_samples observations in a zone use the
+        city-wide speed for that hour, scaled by how fast the zone is overall.
+        """
+        zones, rows = np.unique(geohashes(latitudes, longitudes, precision), return_inverse=True)
+        hours = np.asarray(hours, dtype=np.intp) % HOURS_PER_WEEK
+        speeds = np.asarray(speeds, dtype=np.float64)
+
+        totals = np.zeros((len(zones), HOURS_PER_WEEK))
+        counts = np.zeros((len(zones), HOURS_PER_WEEK))
+        np.add.at(totals, (rows, hours), speeds)
+        np.add.at(counts, (rows, hours), 1)
+
+        overall = speeds.mean()
+        city_counts = counts.sum(axis=0)
+        default = np.where(city_counts > 0, totals.sum(axis=0) / np.maximum(city_counts, 1), overall)
+        zone_ratio = (totals.sum(axis=1) / counts.sum(axis=1)) / overall
+        profile = np.where(
+            counts >= min_samples,
+            totals / np.maximum(counts, 1),
+            default[None, :] * zone_ratio[:, None]
+        )
+        return cls(zones, profile, default, precision)
+
+    def cells(self, coordinates: np.ndarray) -> np.ndarray:
+        return geohashes(coordinates[:, 0], coordinates[:, 1], self.precision)
+
+    def zone_speeds(self, cells: Sequence[str], hours: np.ndarray) -> np.ndarray:
+        """(cells, hours) speeds; cells without a profile get the city-wide row."""
+        cells = np.asarray(cells, dtype=str)
+        table = np.tile(self.default[hours], (len(cells), 1))
+        if len(self.zones):
+            positions = np.minimum(np.searchsorted(self.zones, cells), len(self.zones) - 1)
+            known = self.zones[positions] == cells
+            table[known] = self.speeds[positions[known]][:, hours]
+        return table
+
+
+class TravelTimes:
+    """Speeds for every location of one request over the hours after its departure.
+
+    Column j of speeds is the hour starting j hours after the departure's
+    hour; legs are timed at the speed of their origin's zone in the hour
+    they start, and legs starting past the last column use it.
+    """
+
+    def __init__(self, departure: datetime, location_rows: np.ndarray, speeds: np.ndarray):
+        self.departure = departure
+        self.location_rows = location_rows
+        self.speeds = speeds
+        # Hours into the departure's hour bucket at departure
+        self.offset = departure.minute / 60 + departure.second / 3600
+
+    def average_speed(self) -> float:
+        """Mean speed over the request's zones in the departure hour."""
+        return float(self.speeds[:, 0].mean())
+
+    def leg_hours(self, origins: np.ndarray, distances: np.ndarray, starts: np.ndarray) -> np.ndarray:
+        """Hours to drive each leg from location index origins, starting starts hours after departure."""
+        columns = np.clip((self.offset + starts).astype(np.intp), 0, self.speeds.shape[1] - 1)
+        return distances / self.speeds[self.location_rows[origins], columns]
+
+    def completion_hours(
+        self,
+        origins: np.ndarray,
+        distances: np.ndarray,
+        ready: np.ndarray,
+        service: np.ndarray,
+        iterations: int = 3
+    ) -> np.ndarray:
+        """When each stop of a route is done, in hours after departure.
+
+        Stop i is reached by driving distances[i] from location origins[i],
+        waits until ready[i] and then takes service[i] hours. The whole
+        route is timed in array passes: each pass times every leg at the
+        speed of the hour it started in the previous pass, and the waits
+        come from a running maximum, so no stop is visited one at a time.
+        """
+        starts = np.zeros(len(distances))
+        for _ in range(iterations):
+            elapsed = np.cumsum(self.leg_hours(origins, distances, starts) + service)
+            completion = elapsed + np.maximum.accumulate(np.maximum(ready + service - elapsed, 0.0))
+            starts = np.concatenate(([0.0], completion[:-1]))
+        return completion
+
+
+class SpeedCache:
+    """Zone speeds per hour of the week, shared through Redis.
+
+    Values are float32 km/h under speed:<zone>:<hour of week>. Buckets missing
+    from Redis come from the local profiles and are written back, so a live
+    feed can override any zone and hour by writing its key.
+    """
+
+    def __init__(self, store: CacheStore, profiles: SpeedProfiles, ttl: float = 3600):
+        self.store = store
+        self.profiles = profiles
+        self.ttl = ttl
+
+    async def travel_times(self, coordinates: np.ndarray, departure: datetime, hours: int) -> TravelTimes:
+        """Speeds for coordinates (in distance matrix order) over hours buckets from departure."""
+        cells, location_rows = np.unique(
+            self.profiles.cells(coordinates), return_inverse=True
+        )
+        buckets = (hour_of_week(departure) + np.arange(hours)) % HOURS_PER_WEEK
+        keys = [f"{SPEED_KEY_PREFIX}{cell}:{bucket}" for cell in cells for bucket in buckets]
+        values = await self.store.get_many(keys)
+
+        cached = np.array(
+            [np.nan if value is None else np.frombuffer(value, dtype=np.float32)[0] for value in values],
+            dtype=np.float32
+        ).reshape(len(cells), hours)
+        missing = np.isnan(cached)
+        CACHE_LOOKUPS.inc(int(missing.size - missing.sum()), cache="speed", outcome="hit")
+        CACHE_LOOKUPS.inc(int(missing.sum()), cache="speed", outcome="miss")
+        if missing.any():
+            profile = self.profiles.zone_speeds(cells, buckets)
+            cached[missing] = profile[missing]
+            rows, columns = np.nonzero(missing)
+            await self.store.set_many(
+                {keys[r * hours + c]: cached[r, c].tobytes() for r, c in zip(rows.tolist(), columns.tolist())},
+                self.ttl
+            )
+        return TravelTimes(departure, location_rows.reshape(-1), np.maximum(cached, MIN_SPEED))
+
+
+def horizon_hours(due_times: np.ndarray, minimum: int = 12, maximum: int = 48) -> int:
+    """Hour buckets to cover: up to the latest due time, within minimum and maximum."""
+    finite = due_times[np.isfinite(due_times)]
+    latest = math.ceil(float(finite.max())) + 1 if len(finite) else minimum
+    return int(min(maximum, max(minimum, latest)))
+
+
+def build_profiles(path: str, precision: int = 5, min_samples: int = 3) -> SpeedProfiles:
+    import pandas as pd
+
+    observations = pd.read_csv(path, parse_dates=["timestamp"])
+    times = observations["timestamp"]
+    return SpeedProfiles.from_observations(
+        observations["latitude"].to_numpy(),
+        observations["longitude"].to_numpy(),
+        (times.dt.weekday * 24 + times.dt.hour).to_numpy(),
+        observations["speed_kmh"].to_numpy(),
+        precision=precision,
+        min_samples=min_samples
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build zone speed profiles from GPS observations.")
+    parser.add_argument("observations", help="CSV with latitude, longitude, timestamp, speed_kmh")
+    parser.add_argument("output", help="profile file to write (.npz)")
+    parser.add_argument("--precision", type=int, default=5, help="geohash length of a zone")
+    parser.add_argument("--min-samples", type=int, default=3,
+                        help="observations an hour needs before it overrides the city-wide speed")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    profiles = build_profiles(args.observations, args.precision, args.min_samples)
+    profiles.save(args.output)
+    logging.info(f"Wrote speed profiles for {len(profiles.zones)} zones to {args.output}")